@@ -3,9 +3,19 @@ import math
 import time
 import tkinter as tk
 
+from shared.customlogging.samplebatch import SampleBatch
+
 SENSOR_REFRESH = 0.5
 
 
+def latest_row(record):
+    """Return the newest row of data of a sensor log record, which can hold a single row or a batch of them"""
+    if isinstance(record.msg, SampleBatch):
+        return record.msg.last()
+
+    return record.msg
+
+
 class PressureFrame(tk.Frame, logging.Handler):
     def __init__(self, parent):
         tk.Frame.__init__(self, parent, highlightthickness=1, highlightbackground="black")
@@ -30,7 +40,7 @@ class PressureFrame(tk.Frame, logging.Handler):
             return
 
         try:
-            pressure = float(record.msg[1])
+            pressure = float(latest_row(record)[1])
 
             self.value.config(text=round(pressure / 1000.0, 3))
             self.last_update = time.time()
@@ -62,9 +72,10 @@ class AccelerationFrame(tk.Frame, logging.Handler):
             return
 
         try:
-            accel_ms_x = float(record.msg[1])
-            accel_ms_y = float(record.msg[2])
-            accel_ms_z = float(record.msg[3])
+            row = latest_row(record)
+            accel_ms_x = float(row[1])
+            accel_ms_y = float(row[2])
+            accel_ms_z = float(row[3])
 
             accel_ms = math.sqrt(accel_ms_x ** 2 + accel_ms_y ** 2 + accel_ms_z ** 2)
 
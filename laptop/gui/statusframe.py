@@ -1,6 +1,10 @@
 import logging
 import tkinter as tk
 
+from laptop.network.linkmonitor import link_monitor
+
+LINK_REFRESH_PERIOD = 500  # Milliseconds between two updates of the health of the link
+
 
 class StatusFrame(tk.Frame):
     def __init__(self, parent):
@@ -15,6 +19,11 @@ class StatusFrame(tk.Frame):
         self.clear.grid(row=0, column=1, sticky="nsew")
         self.currentlevel = logging.INFO
 
+        # Round-trip time and loss of the control link
+        self.link = tk.Label(self, text=link_monitor.summary())
+        self.link.grid(row=1, column=0, columnspan=2, sticky="nsew")
+        self.parent.after(LINK_REFRESH_PERIOD, self.update_link)
+
         # Make the status fill most of the frame
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(0, weight=1)
@@ -69,6 +78,10 @@ class StatusFrame(tk.Frame):
 
         return clearedError
 
+    def update_link(self):
+        self.link.config(text=link_monitor.summary())
+        self.parent.after(LINK_REFRESH_PERIOD, self.update_link)
+
     def flash_status(self, i):
         if not self.flash:
             return
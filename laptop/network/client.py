@@ -1,65 +1,123 @@
-import json
+import itertools
 import logging
-import select
 import socket
-import struct
+import threading
+from concurrent.futures import Future, TimeoutError
 
 import shared.config as config
+import shared.network.commands as commands
 
 LaptopConfig = config.get_config('laptop')
 serverIp = (LaptopConfig['rpi_ip'], LaptopConfig.getint('rpi_port'))
 
-
-class NetworkError(Exception):
-    pass
+CONNECT_TIMEOUT = 1  # Seconds to wait for the RPi when connecting
+COMMAND_TIMEOUT = 1  # Seconds send_message waits for the response of the RPi
 
 
-class NetworkTimeoutError(Exception):
+class NetworkError(Exception):
     pass
 
 
-def receive_from_socket(sock, size):
-    buf = b""
-
-    while len(buf) != size:
-        read, _, _ = select.select([sock], [], [], 1)  # Make sure we can read from client. If not, we wait up to 1 sec before timing out
-
-        if len(read) == 0:
-            raise NetworkTimeoutError()
-
-        data = read[0].recv(size - len(buf))
-        if not data:
-            raise NetworkError()
-
-        buf += data
-
-    return buf
+class CommandClient:
+    """
+    Long-lived command connection to the RPi (see shared.network.commands). Requests are sent right away, without
+    waiting for the responses of the previous ones, so several commands can be in flight together. A thread receives
+    the responses and completes the future of each request.
 
+    If the connection breaks, the requests waiting for a response fail with a NetworkError, and the next request
+    connects again.
+    """
 
-# TODO: Add better error handling
-def send_message(message):
+    def __init__(self, address):
+        self.address = address
+        self.lock = threading.Lock()  # Protects the socket and the pending requests
+        self.sock = None
+        self.pending = dict()  # Futures of the requests waiting for a response, by id
+        self.ids = itertools.count(1)
+
+    def request(self, message):
+        """
+        Send a request (a dictionary) to the RPi. Returns a Future, whose result is the result of the command. It fails
+        with a CommandError if the RPi could not execute the command, or a NetworkError if the connection broke.
+        """
+        future = Future()
+        with self.lock:
+            try:
+                if self.sock is None:
+                    self.__connect()
+
+                id = next(self.ids)
+                self.pending[id] = future
+                self.sock.sendall(commands.encode(dict(message, id=id)))
+            except OSError as e:
+                self.__disconnect(self.sock, e)
+                if not future.done():
+                    future.set_exception(NetworkError("Could not send the request: {}".format(e)))
+
+        return future
+
+    def reset(self):
+        """Close the connection, for example because the RPi stopped answering. The next request connects again."""
+        with self.lock:
+            self.__disconnect(self.sock, NetworkError("The connection was reset"))
+
+    def __connect(self):
+        self.sock = socket.create_connection(self.address, timeout=CONNECT_TIMEOUT)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=self.__receive, args=(self.sock,), name="command-receiver", daemon=True).start()
+
+    def __disconnect(self, sock, error):
+        """Close a connection, if it is still the current one, and fail its pending requests"""
+        if sock is None or sock is not self.sock:
+            return
+
+        self.sock.close()
+        self.sock = None
+        for future in self.pending.values():
+            future.set_exception(NetworkError("Connection to the RPi lost: {}".format(error)))
+        self.pending.clear()
+
+    def __receive(self, sock):
+        file = sock.makefile('rb')
+        try:
+            while True:
+                response = commands.read(file)
+                if response is None:
+                    raise NetworkError("The RPi closed the connection")
+
+                with self.lock:
+                    future = self.pending.pop(response.get('id'), None)
+                if future is None:
+                    continue
+
+                if response['status'] == commands.OK:
+                    future.set_result(response.get('result'))
+                else:
+                    future.set_exception(commands.CommandError(response.get('error')))
+        except (OSError, ValueError, NetworkError) as e:
+            with self.lock:
+                self.__disconnect(sock, e)
+
+
+command_client = CommandClient(serverIp)
+
+
+def send_message(message, timeout=COMMAND_TIMEOUT):
     """
     Sends the request message to the server. Message should be a dictionary (it will be converted to JSON)
-    Return True if the sending was successful
+    Return True if the RPi executed the request successfully
     """
     logger = logging.getLogger(__name__)
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.settimeout(1)
-            sock.connect(serverIp)
-
-            payload = json.dumps(message).encode("utf-8")
-            sock.sendall(struct.pack("!L", len(payload)))  # Send length of the payload
-            sock.sendall(payload)  # Send the payload itself
-            logger.debug("Sent payload. Now waiting for confirmation.")
-            data = receive_from_socket(sock, len(
-                "OK".encode("utf-8")))  # Receive the confirmation. We read for the exact amount of bytes we expect
-
-            confirmation = data.decode("utf-8")
-            logger.debug("Received {}".format(confirmation))
-            if confirmation != "OK":
-                raise NetworkError
-    except:
+        result = command_client.request(message).result(timeout)
+        logger.debug("Received {}".format(result))
+    except TimeoutError:
+        # The connection is probably dead. Make a new one for the next request.
+        command_client.reset()
+        return False
+    except Exception as e:
+        logger.debug("Request {} failed: {}".format(message, e))
         return False
 
     return True
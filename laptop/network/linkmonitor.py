@@ -0,0 +1,191 @@
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+
+import shared.config as config
+from laptop.network.client import command_client
+from shared.customlogging.errormanager import ErrorManager
+from shared.network.requesttypes import RequestTypes
+
+RTT_WINDOW = 60  # Seconds of pings kept for the percentiles and the loss
+REPORT_PERIOD = 60  # Seconds between two reports of the link health in the logs
+
+# Upper bounds of the buckets of the RTT histograms, in seconds. From 10 us to about 10 s, each 10% bigger than the last.
+RTT_BUCKETS = [1e-5 * 1.1 ** i for i in range(146)]
+
+
+class RttHistogram:
+    """
+    Histogram of the round-trip times of the pings of the last `window` seconds, along with the number of pings lost.
+    The counts are kept per second, so the oldest ones can be removed without keeping every ping.
+    """
+
+    def __init__(self, window=RTT_WINDOW):
+        self.window = window
+        self.slots = deque()  # Tuples (second, bucket counts, lost), from the oldest to the newest
+        self.counts = [0] * (len(RTT_BUCKETS) + 1)  # Sum of the slots. The last bucket is for the bigger times.
+        self.lost = 0
+
+    def __slot(self, now):
+        second = int(now)
+        if len(self.slots) == 0 or self.slots[-1][0] != second:
+            self.slots.append((second, [0] * len(self.counts), [0]))
+        self.expire(now)
+        return self.slots[-1]
+
+    def expire(self, now):
+        """Remove the pings older than the window"""
+        while len(self.slots) != 0 and self.slots[0][0] <= now - self.window:
+            _, counts, lost = self.slots.popleft()
+            self.counts = [total - count for total, count in zip(self.counts, counts)]
+            self.lost -= lost[0]
+
+    def add(self, rtt, now):
+        i = bisect.bisect_left(RTT_BUCKETS, rtt)
+        self.__slot(now)[1][i] += 1
+        self.counts[i] += 1
+
+    def add_lost(self, now):
+        self.__slot(now)[2][0] += 1
+        self.lost += 1
+
+    def answered(self):
+        return sum(self.counts)
+
+    def loss(self):
+        """Return the fraction of the pings that were lost"""
+        total = self.answered() + self.lost
+        return self.lost / total if total != 0 else 0
+
+    def percentile(self, p):
+        """Return the upper bound of the RTT under which p percent of the answered pings are, or None if there are none"""
+        rank = p / 100 * self.answered()
+        cumulated = 0
+        for i, count in enumerate(self.counts):
+            cumulated += count
+            if count != 0 and cumulated >= rank:
+                return RTT_BUCKETS[min(i, len(RTT_BUCKETS) - 1)]
+        return None
+
+
+class LinkMonitor(threading.Thread):
+    """
+    Continuously pings the RPi on the command connection to measure the round-trip time, and watches the telemetry
+    coming from the RPi. The control link is considered down when no ping was answered for link_timeout_ms, and the
+    connection is then reset so a new one is made. A gap in the telemetry longer than telemetry_gap_ms is reported too,
+    as the RPi sends at least a heartbeat every second.
+    """
+
+    def __init__(self):
+        super().__init__(name="link-monitor", daemon=True)
+        LaptopConfig = config.get_config('laptop')
+        self.ping_period = LaptopConfig.getint('ping_period_ms') / 1000
+        self.link_timeout = LaptopConfig.getint('link_timeout_ms') / 1000
+        self.telemetry_gap = LaptopConfig.getint('telemetry_gap_ms') / 1000
+
+        self.lock = threading.Lock()  # Protects everything below, as the pings are answered in another thread
+        self.histogram = RttHistogram()
+        self.pings = dict()  # Time each ping waiting for an answer was sent, by future
+        self.last_answer = None  # time.monotonic() of the last answer to a ping
+        self.last_rtt = None
+        self.link_up = False
+        self.last_telemetry = None  # time.monotonic() of the last data received from the RPi, if any
+
+    def telemetry_received(self):
+        """Tell that data was received from the RPi on the logging connection"""
+        self.last_telemetry = time.monotonic()
+
+    def summary(self):
+        """Return a short description of the health of the link, for the GUI"""
+        with self.lock:
+            if self.last_answer is None:
+                return "Link down (no answer yet)"
+            elif not self.link_up:
+                return "Link down ({:.1f} s without answer)".format(time.monotonic() - self.last_answer)
+
+            self.histogram.expire(time.monotonic())
+            p50, p99 = self.histogram.percentile(50), self.histogram.percentile(99)
+            if p50 is None:
+                return "Link up"
+            return "RTT {:.1f} ms (p50 {:.1f}, p99 {:.1f} ms), loss {:.1f} %".format(
+                self.last_rtt * 1000, p50 * 1000, p99 * 1000, self.histogram.loss() * 100)
+
+    def __answered(self, future):
+        now = time.monotonic()
+        with self.lock:
+            sent = self.pings.pop(future, None)
+            if sent is None:
+                return  # Already counted as lost
+
+            if future.exception() is not None:
+                self.histogram.add_lost(now)
+            else:
+                self.last_rtt = now - sent
+                self.last_answer = now
+                self.histogram.add(self.last_rtt, now)
+
+    def __check(self, em):
+        """Count the pings that were not answered in time as lost, and detect a dead link or telemetry"""
+        now = time.monotonic()
+        with self.lock:
+            for future, sent in list(self.pings.items()):
+                if now - sent > self.link_timeout:
+                    del self.pings[future]
+                    self.histogram.add_lost(now)
+
+            silence = now - self.last_answer if self.last_answer is not None else float('inf')
+            if self.link_up and silence > self.link_timeout:
+                self.link_up = False
+                em.error("Control link to the RPi is down: no answer for {:.0f} ms".format(silence * 1000),
+                         "linkDown")
+                reset = True
+            else:
+                reset = False
+            if not self.link_up and silence <= self.link_timeout:
+                self.link_up = True
+                em.resolve("Control link to the RPi is up, RTT {:.1f} ms".format(self.last_rtt * 1000), "linkDown")
+
+        if reset:
+            command_client.reset()  # The connection may be half-dead. The next ping makes a new one.
+
+        if self.last_telemetry is not None:
+            gap = now - self.last_telemetry
+            if gap > self.telemetry_gap:
+                em.warning("No telemetry received from the RPi for {:.1f} s".format(gap), "telemetryGap")
+            else:
+                em.resolve("Receiving telemetry from the RPi again", "telemetryGap", False)
+
+    def __report(self):
+        with self.lock:
+            self.histogram.expire(time.monotonic())
+            percentiles = [self.histogram.percentile(p) for p in (50, 90, 99, 100)]
+            answered, lost = self.histogram.answered(), self.histogram.lost
+
+        if percentiles[0] is not None:
+            logging.getLogger(__name__).info(
+                "Control link over the last {} s: {} pings answered, {} lost, RTT p50 {:.2f} ms, p90 {:.2f} ms, "
+                "p99 {:.2f} ms, max {:.2f} ms".format(RTT_WINDOW, answered, lost, *[p * 1000 for p in percentiles]))
+
+    def run(self):
+        em = ErrorManager(__name__)
+        next_report = time.monotonic() + REPORT_PERIOD
+        while True:
+            start = time.monotonic()
+            self.__check(em)
+
+            sent = time.monotonic()
+            future = command_client.request({'type': RequestTypes.PING})
+            with self.lock:
+                self.pings[future] = sent
+            future.add_done_callback(self.__answered)
+
+            if start >= next_report:
+                self.__report()
+                next_report = start + REPORT_PERIOD
+
+            time.sleep(max(self.ping_period - (time.monotonic() - start), 0))
+
+
+link_monitor = LinkMonitor()
@@ -1,118 +1,313 @@
+import asyncio
+import json
 import logging
 import logging.handlers
-import pickle
-import select
-import socketserver
-import struct
-import threading
+import socket
 import time
 
 import shared.config as config
+import shared.network.frames as frames
+from laptop.network.linkmonitor import link_monitor
 from shared.customlogging.errormanager import ErrorManager
 
-
-class NetworkError(Exception):
-    pass
-
+WATCHDOG_PERIOD = 1  # Seconds between two checks of the connections
+LINK_TIMEOUT = 3  # A connection is closed if nothing was received for this long. The RPi sends heartbeats when idle.
+NO_CONNECTION_ALERT = 5  # Seconds without any connection before alerting the user
+RATE_REPORT_PERIOD = 30  # Seconds between two reports of the ingest rate of each connection
+UDP_LOSS_WARNING = 0.05  # Warn if more than this fraction of the datagrams were lost since the last report
 
 error_manager = ErrorManager(__name__, 5)
 
+# Header of the csv file of each sensor logger, once written
+csv_headers = dict()
 
-class LogRecordConnector(threading.Thread):
-    """
-    Simple class that will check if a client has connected to the logging server.
-    If no client connects after some time, an alert will be sent to the user.
-    """
-
-    def __init__(self):
-        super().__init__()
-        self._stop_event = threading.Event()
-
-    def run(self):
-        self._stop_event.clear()
 
-        while True:
-            time.sleep(5)
+def decode_frame(decoder, records, version, frame_type, payload):
+    """Decode a frame with the decoder of its connection, and add its record to records"""
+    if frame_type == frames.HEARTBEAT:
+        return
 
-            if self._stop_event.is_set():
-                break
-
-            error_manager.escalate("RPI is not connecting to the logging server", "loggingConnection")
+    try:
+        record = decoder.decode(version, frame_type, payload)
+    except frames.FrameError as e:
+        # Only this frame is lost. The next one can still be read, as the header is always the same.
+        error_manager.warning("Invalid frame from the RPi: {}".format(e), "loggingFrame")
+        return
+
+    if frame_type == frames.SCHEMA:
+        # Only write the header of the csv file once, unless the channel changed
+        if csv_headers.get(record.name) == record.msg:
+            return
+        csv_headers[record.name] = record.msg
 
-    def stop(self):
-        self._stop_event.set()
+    records.append(record)
 
 
-logConnector = LogRecordConnector()
+def handle_records(records):
+    loggers = dict()  # Loggers of the batch, by name. Most records of a batch are for a few sensor loggers.
+    for record in records:
+        logger = loggers.get(record.name)
+        if logger is None:
+            logger = loggers[record.name] = logging.getLogger(record.name)
 
+        # Check if this is for a sensor logs and that is has a handler. If not, raise an error
+        if record.name.startswith('sensorlog') and len(logger.handlers) == 0:
+            logging.getLogger(__name__).error("Unhandled sensor logger: " + record.name)
+            continue
 
-class LogRecordStreamHandler(socketserver.StreamRequestHandler):
-    def read_chunk(self, size):
-        buf = b""
+        logger.handle(record)
 
-        while len(buf) != size:
-            read, _, _ = select.select([self.request], [], [])  # Make sure we can read from client.
 
-            if len(read) == 0:
-                raise NetworkError()
+class LogRecordProtocol(asyncio.BufferedProtocol):
+    """
+    Receives the frames of a connection from the RPi. The bytes are received directly in the buffer of a FrameReader,
+    and all the frames they complete are decoded and handled together.
+    """
 
-            data = read[0].recv(size - len(buf))
-            if not data:
-                raise NetworkError()
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.address = None
+        self.reader = frames.FrameReader()
+        self.decoder = frames.FrameDecoder()  # The RPi sends the schemas of the channels again on each connection
+        self.decompressor = None  # zlib stream of the connection, once the compression is accepted
+        self.superseded = False  # True once the RPi made a newer connection
+
+        self.last_received = time.monotonic()
+
+        # Counters for the metrics. The ingest ones are reset at each report.
+        self.received = 0  # Bytes received and decompressed
+        self.decompressed = 0
+        self.decompression_time = 0
+        self.ingested_bytes = 0
+        self.ingested_records = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.address = transport.get_extra_info('peername')
+
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        self.server.connection_made(self)
+
+    def connection_lost(self, exc):
+        if not self.superseded:
+            error_manager.warning("Network error. Did the client close the connection?", "loggingException")
+
+        if self.decompressed != 0:
+            logging.getLogger(__name__).info(
+                "Received {:.1f} kB of compressed frames from {}, {:.1f} kB once decompressed, in {:.1f} ms of CPU"
+                .format(self.received / 1024, self.address, self.decompressed / 1024, self.decompression_time * 1000))
+
+        self.server.connection_lost(self)
+
+    def get_buffer(self, sizehint):
+        return self.reader.free()
+
+    def buffer_updated(self, nbytes):
+        self.reader.filled(nbytes)
+        self.last_received = time.monotonic()
+        self.ingested_bytes += nbytes
+        link_monitor.telemetry_received()
+
+        try:
+            records = []
+            for version, frame_type, payload in self.reader.frames():
+                if frame_type == frames.HELLO:
+                    self.accept_compression(payload)
+                elif frame_type == frames.COMPRESSED:
+                    for frame in self.decompress(payload):
+                        decode_frame(self.decoder, records, *frame)
+                else:
+                    decode_frame(self.decoder, records, version, frame_type, payload)
+
+            self.ingested_records += len(records)
+            handle_records(records)
+            error_manager.resolve("Network error resolved", "loggingException", False)
+        except Exception as e:
+            error_manager.error("Error while receiving log from client: {}".format(e), "loggingException")
+            self.transport.close()
+
+    def accept_compression(self, payload):
+        """Answer the HELLO frame of the RPi, accepting zlib if it is proposed"""
+        proposed = json.loads(bytes(payload)).get('compression', [])
+        compression = 'zlib' if 'zlib' in proposed else None
+        self.transport.write(frames.ack_frame(compression))
+        self.decompressor = frames.make_decompressor() if compression is not None else None
+
+    def decompress(self, payload):
+        """Return the frames held in a COMPRESSED frame, as tuples (version, type, payload)"""
+        if self.decompressor is None:
+            raise frames.FrameError("Compressed frame received before the compression was accepted")
+
+        start = time.thread_time()
+        data = self.decompressor.decompress(payload)
+        self.decompression_time += time.thread_time() - start
+        self.received += len(payload)
+        self.decompressed += len(data)
+        return list(frames.split_frames(data))
+
+    def take_rates(self, period):
+        """Return the bytes and records received per second since the last call, period seconds ago"""
+        rates = self.ingested_bytes / period, self.ingested_records / period
+        self.ingested_bytes = self.ingested_records = 0
+        return rates
+
+
+class DatagramStream:
+    """State of the datagrams received from a sender, since it started"""
+
+    def __init__(self, session, sequence):
+        self.session = session
+        self.expected = sequence  # Sequence number of the next datagram
+        self.decoder = frames.FrameDecoder()  # The schemas are sent again every second
+
+        # Counters since the last report
+        self.received = 0
+        self.lost = 0  # Skipped sequence numbers
+        self.late = 0  # Datagrams arriving after a newer one. They are dropped, so the live views never go back.
+        self.undecoded = 0  # Frames received before the schema of their channel
+
+    def take_stats(self):
+        stats = self.received, self.lost, self.late, self.undecoded
+        self.received = self.lost = self.late = self.undecoded = 0
+        return stats
+
+
+class TelemetryDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Receives the data of the loss-tolerant channels, sent by the RPi in UDP datagrams. The sequence numbers of the
+    datagrams are used to count the lost ones.
+    """
 
-            buf += data
+    def __init__(self):
+        self.streams = dict()  # DatagramStream of each sender, by address
+
+    def datagram_received(self, data, address):
+        link_monitor.telemetry_received()
+        try:
+            version, session, sequence = frames.DATAGRAM_HEADER.unpack_from(data)
+            if version != frames.VERSION:
+                raise frames.FrameError("Unsupported datagram version {}, expected {}".format(version, frames.VERSION))
+
+            stream = self.streams.get(address)
+            if stream is None or stream.session != session:
+                # First datagram of the sender, or the sender restarted
+                stream = self.streams[address] = DatagramStream(session, sequence)
+
+            gap = (sequence - stream.expected) & 0xFFFFFFFF
+            if gap >= 0x80000000:
+                stream.late += 1
+                return
+            stream.lost += gap
+            stream.expected = (sequence + 1) & 0xFFFFFFFF
+            stream.received += 1
+
+            records = []
+            for version, frame_type, payload in frames.split_frames(memoryview(data)[frames.DATAGRAM_HEADER.size:]):
+                if frame_type != frames.SCHEMA and \
+                        frames.CHANNEL_ID.unpack_from(payload)[0] not in stream.decoder.channels:
+                    stream.undecoded += 1
+                    continue
+                decode_frame(stream.decoder, records, version, frame_type, payload)
+
+            handle_records(records)
+        except Exception as e:
+            error_manager.warning("Invalid datagram from {}: {}".format(address, e), "loggingDatagram")
+
+
+class LoggingServer:
+    """
+    Accepts the connections of the RPi, each one being handled by a LogRecordProtocol. When the RPi reconnects (after
+    a reboot or a network outage), the new connection is used right away, and the older ones from the same host are
+    closed instead of waiting for TCP to notice they are dead. Connections that stay silent longer than LINK_TIMEOUT
+    are closed too, as the RPi sends heartbeats when it has nothing else to send.
 
-        return buf
+    The datagrams of the loss-tolerant channels are received on DEFAULT_UDP_LOGGING_PORT, next to the connections.
+    """
 
-    def handle(self):
-        global logConnector
+    def __init__(self):
+        self.connections = []  # From the oldest to the newest
+        self.datagrams = TelemetryDatagramProtocol()
+        self.disconnected_since = time.monotonic()
+        self.last_report = time.monotonic()
+
+    def connection_made(self, connection):
+        host = connection.address[0]
+        for old in self.connections:
+            if old.address[0] == host:
+                logging.getLogger(__name__).info("{} reconnected from {}, closing its previous connection from {}"
+                                                 .format(host, connection.address, old.address))
+                old.superseded = True
+                old.transport.abort()
+
+        self.connections.append(connection)
+        error_manager.resolve("Got a connection from {}".format(connection.address), "loggingConnection")
+
+    def connection_lost(self, connection):
+        if connection in self.connections:
+            self.connections.remove(connection)
+        if len(self.connections) == 0:
+            self.disconnected_since = time.monotonic()
+
+    async def watch(self):
+        """Close the dead connections, alert the user if the RPi is not connected and report the ingest rates"""
         logger = logging.getLogger(__name__)
-        error_manager.resolve("Got a connection from {}".format(self.client_address), "loggingConnection")
-
-        logConnector.stop()  # Stop monitoring for connection
-
-        self.request.setblocking(0)
-        connected = True
-        while connected:
-            try:
-                chunk = self.read_chunk(4)
-                length = struct.unpack(">L", chunk)[0]
-
-                body = self.read_chunk(length)
-                obj = pickle.loads(body)
-
-                record = logging.makeLogRecord(obj)
-                self.handle_record(record)
-                error_manager.resolve("Network error resolved", "loggingException", False)
-            except (NetworkError, ConnectionResetError):
-                error_manager.warning("Network error. Did the client close the connection?", "loggingException")
-                connected = False
-            except Exception as e:
-                error_manager.error("Error while receiving log from client: {}".format(e), "loggingException")
-                connected = False
-
-        logConnector = LogRecordConnector()
-        logConnector.start()  # Monitor for connection and send alert to user if necessary
-
-    def handle_record(self, record):
-        logger = logging.getLogger(record.name)
-
-        # Check if this is for a sensor logs and that is has a handler. If not, raise an error
-        if record.name.startswith('sensorlog') and len(logger.handlers) == 0:
-            logging.getLogger(__name__).error("Unhandled sensor logger: " + record.name)
-            return
-
-        logger.handle(record)
+        while True:
+            await asyncio.sleep(WATCHDOG_PERIOD)
+            now = time.monotonic()
+
+            for connection in list(self.connections):
+                if now - connection.last_received > LINK_TIMEOUT:
+                    error_manager.warning("Nothing received from {} for {:.1f} s, closing the connection".format(
+                        connection.address, now - connection.last_received), "loggingTimeout")
+                    connection.transport.abort()
+                else:
+                    error_manager.resolve("Receiving logs again", "loggingTimeout", False)
+
+            if len(self.connections) == 0 and now - self.disconnected_since > NO_CONNECTION_ALERT:
+                error_manager.escalate("RPI is not connecting to the logging server", "loggingConnection")
+
+            if now - self.last_report >= RATE_REPORT_PERIOD:
+                for connection in self.connections:
+                    byte_rate, record_rate = connection.take_rates(now - self.last_report)
+                    logger.info("Ingest from {}: {:.1f} kB/s, {:.0f} records/s".format(connection.address,
+                                                                                     byte_rate / 1024, record_rate))
+                self.report_datagrams()
+                self.last_report = now
+
+    def report_datagrams(self):
+        for address, stream in self.datagrams.streams.items():
+            received, lost, late, undecoded = stream.take_stats()
+            if received + lost == 0:
+                continue
+
+            loss = lost / (received + lost)
+            logging.getLogger(__name__).info("Datagrams from {}: {} received, {} lost ({:.1f} %), {} late, {} frames "
+                                             "before their schema".format(address, received, lost, loss * 100, late,
+                                                                          undecoded))
+            if loss > UDP_LOSS_WARNING:
+                error_manager.warning("{:.1f} % of the telemetry datagrams from {} were lost in the last {} s".format(
+                    loss * 100, address, RATE_REPORT_PERIOD), "loggingDatagramLoss")
+            else:
+                error_manager.resolve("Telemetry datagrams are not lost anymore", "loggingDatagramLoss", False)
+
+    async def serve_forever(self, host, port):
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: LogRecordProtocol(self), host, port, reuse_address=True)
+        await loop.create_datagram_endpoint(lambda: self.datagrams,
+                                            local_addr=(host, logging.handlers.DEFAULT_UDP_LOGGING_PORT))
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.watch())
 
 
 def logging_receive_forever():
     LaptopConfig = config.get_config('laptop')
     try:
-        socketserver.TCPServer.allow_reuse_address = True
-        with socketserver.TCPServer((LaptopConfig['laptop_listening_ip'], logging.handlers.DEFAULT_TCP_LOGGING_PORT),
-                                    LogRecordStreamHandler) as server:
-            logConnector.start()  # Monitor for connection and send alert to user if necessary
-            server.serve_forever()
+        asyncio.run(LoggingServer().serve_forever(LaptopConfig['laptop_listening_ip'],
+                                                  logging.handlers.DEFAULT_TCP_LOGGING_PORT))
     except:
         logging.getLogger(__name__).exception("Error starting the laptop's TCP server! Please restart the whole GUI "
                                               "application")
@@ -6,12 +6,12 @@ import tkinter.messagebox
 
 import laptop.gui.controlgui as controlgui
 import laptop.gui.logginggui as logginggui
+import shared.config as config
 from laptop.gui.sensorgui import SensorGUI
+from laptop.network.linkmonitor import link_monitor
 from laptop.network.loggingreceiver import logging_receive_forever
-from laptop.network.pingchecker import PingChecker
 from shared.customlogging.filter import SensorFilter
-from shared.customlogging.formatter import CSVFormatter
-from shared.customlogging.handler import MakeFileHandler
+from shared.customlogging.handler import CSVLogHandler, MakeFileHandler
 
 
 def create_sensorlog_handler(name):
@@ -20,8 +20,9 @@ def create_sensorlog_handler(name):
 
     splitName = name.split('.')
 
-    csvHandler = MakeFileHandler('laptop', 'sensor', splitName[1], 'csv')
-    csvHandler.setFormatter(CSVFormatter())
+    LaptopConfig = config.get_config('laptop')
+    csvHandler = CSVLogHandler('laptop', 'sensor', splitName[1], LaptopConfig.getint('csv_flush_kb') * 1024,
+                               LaptopConfig.getint('csv_flush_ms'), LaptopConfig.getint('csv_fsync_ms'))
     sensorlogger.addHandler(csvHandler)
     sensorlogger.setLevel(logging.INFO)
 
@@ -50,6 +51,7 @@ logger.addHandler(fileHandler)
 create_sensorlog_handler("sensorlog.thermometer")
 create_sensorlog_handler("sensorlog.pressure")
 create_sensorlog_handler("sensorlog.acceleration")
+create_sensorlog_handler("sensorlog.vibration")
 
 # Setting up of the GUI
 root = tk.Tk()
@@ -74,8 +76,8 @@ t = threading.Thread(target=logging_receive_forever)
 t.setDaemon(True)
 t.start()
 
-# Start the ping daemon
-PingChecker().start()
+# Start monitoring the link with the RPi
+link_monitor.start()
 
 
 # Add confirmation box on closing
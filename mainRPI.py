@@ -2,6 +2,8 @@ import logging
 import multiprocessing
 import time
 
+import rpi.logging.telemetry as telemetry
+import shared.config as config
 from rpi.logging.listener import LoggingListener
 from rpi.network.server import Server
 # from rpi.sensors.accelerometer import Accelerometer
@@ -12,16 +14,20 @@ from shared.customlogging.errormanager import ErrorManager
 from shared.customlogging.handler import CustomQueueHandler
 
 if __name__ == '__main__':
-    queue = multiprocessing.Queue(-1)  # Central queue for the logs
+    queue = multiprocessing.Queue(-1)  # Central queue for the logs and the sensor data
     logListen = LoggingListener(queue)  # Start worker which will actually log everything
     logListen.start()
 
     # Setup logging for main process and all child processes
-    h = CustomQueueHandler(queue)
+    RPIConfig = config.get_config('rpi')
+    h = CustomQueueHandler(queue, RPIConfig.getint('log_batch_size'), RPIConfig.getfloat('log_batch_ms'))
     root = logging.getLogger()
     root.addHandler(h)
     root.setLevel(logging.INFO)
 
+    # Sensor data goes to the same queue, but without the logging module
+    telemetry.setup(queue)
+
     # Next lines starts all of the other processes and monitor them in case they quit
     processClassesList = [Server, Thermometer, Pressure, Accelerometer]
     processes = dict()
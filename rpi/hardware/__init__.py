@@ -0,0 +1,44 @@
+"""
+Central access to the hardware libraries used on the RPi. Modules needing hardware import it from here, for example
+`from rpi.hardware import GPIO, smbus`, instead of importing the libraries directly.
+
+If `simulate_hardware` is enabled in the rpi section of config.ini, simulated devices from rpi.hardware.simulated
+are returned instead. This allows running the whole acquisition pipeline (mainRPI.py) on a normal computer.
+The backends are only imported when first accessed, so a process only needs the libraries it actually uses.
+"""
+import glob
+import importlib
+
+import shared.config as config
+
+SIMULATE = config.get_config('rpi').getboolean('simulate_hardware')
+
+# Name of the module for each backend: (real hardware, simulated hardware)
+_BACKENDS = {
+    'GPIO': ('RPi.GPIO', 'rpi.hardware.simulated.gpio'),
+    'smbus': ('smbus', 'rpi.hardware.simulated.smbus'),
+    'spidev': ('spidev', 'rpi.hardware.simulated.spidev'),
+    'serial': ('serial', 'rpi.hardware.simulated.serial'),
+    'dmx': ('rpi.hardware.dmx', 'rpi.hardware.simulated.dmx'),
+    'w1': ('rpi.hardware.w1', 'rpi.hardware.simulated.w1'),
+}
+
+
+def __getattr__(name):
+    if name not in _BACKENDS:
+        raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+    module = importlib.import_module(_BACKENDS[name][1 if SIMULATE else 0])
+    globals()[name] = module  # Cache it, so this function is not called again for that name
+    return module
+
+
+def glob_serial_ports(pattern):
+    """
+    Return the serial ports matching pattern, like glob.glob(). When simulating, the simulated ports are returned.
+    """
+    if SIMULATE:
+        from rpi.hardware.simulated import serial
+        return serial.glob_ports(pattern)
+
+    return glob.glob(pattern)
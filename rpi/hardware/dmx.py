@@ -0,0 +1,7 @@
+"""
+Real backend for the DMX controller, giving the same interface as rpi.hardware.simulated.dmx
+"""
+from DMXEnttecPro import Controller
+from DMXEnttecPro.utils import get_port_by_serial_number
+
+__all__ = ['Controller', 'get_port_by_serial_number']
@@ -0,0 +1,65 @@
+"""
+Simulated versions of the RPi hardware: the sensors on the I2C and SPI buses, the GPIO pins, the DS18B20 sysfs files,
+the Teensy serial port and the DMX controller. The devices produce realistic data at the rates configured in the
+device registers, and take about as long as the real buses to answer.
+
+The settings are in the simulation section of config.ini.
+"""
+import random
+import time
+
+import shared.config as config
+
+settings = config.get_config('simulation')
+
+# Wiring of the simulated board. Must match the pins used by the drivers.
+ACCELEROMETER_INT1_PIN = 6
+PRESSURE_INT1_PIN = 13
+VIBRATION_BUSY_PIN = 5
+HEATER_RELAY_PIN = 21
+
+# Phases of a parabola, after the level flight: (name, load factor in g, duration in s)
+PARABOLA_PHASES = [("pull up", 1.8, 20), ("microgravity", 0.0, 22), ("pull out", 1.8, 20)]
+
+
+def vertical_load(t):
+    """
+    Return the load factor (in g) felt along the vertical axis at time t (in s), during a series of parabolas
+    separated by level flight.
+    """
+    phase_time = t % settings.getfloat('parabola_period')
+    level_time = settings.getfloat('parabola_period') - sum(duration for _, _, duration in PARABOLA_PHASES)
+
+    if phase_time < level_time:
+        return 1.0
+    phase_time -= level_time
+
+    for _, load, duration in PARABOLA_PHASES:
+        if phase_time < duration:
+            return load
+        phase_time -= duration
+
+    return 1.0
+
+
+def noise(amplitude):
+    """Gaussian noise with the given standard deviation"""
+    return random.gauss(0, amplitude)
+
+
+class BusTime:
+    """
+    Makes the calling thread wait the time bus transactions would take on the real hardware. time.sleep() cannot
+    sleep accurately for less than about a millisecond, so short waits are accumulated and slept together.
+    """
+
+    def __init__(self):
+        self.owed = 0.0
+
+    def spend(self, seconds):
+        self.owed += seconds
+        if self.owed >= 0.001:
+            start = time.perf_counter()
+            time.sleep(self.owed)
+            # Keep track of oversleeping, but don't let it build a large credit
+            self.owed = max(self.owed - (time.perf_counter() - start), -0.001)
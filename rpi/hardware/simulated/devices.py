@@ -0,0 +1,563 @@
+"""
+Models of the sensors found on the I2C and SPI buses. Each process gets its own instance of each device, created the
+first time it is accessed.
+"""
+import math
+import struct
+import threading
+import time
+from collections import deque
+
+from rpi.hardware.simulated import ACCELEROMETER_INT1_PIN, PRESSURE_INT1_PIN, VIBRATION_BUSY_PIN, gpio, noise, \
+    settings, vertical_load
+
+CABIN_PRESSURE = 81000  # Pressure in Pa in a cabin pressurized at about 6000 ft
+
+
+def cabin_pressure():
+    """Return the pressure in the cabin now, in Pa"""
+    # The pressure varies a bit with the load, as the cabin pressure regulation lags behind
+    return CABIN_PRESSURE + 150 * (vertical_load(time.time()) - 1) + noise(settings.getfloat('pressure_noise'))
+
+
+class ADXL343:
+    """
+    ADXL343 accelerometer, with its FIFO. The samples are generated at the output data rate set in BW_RATE, when the
+    device is accessed.
+    """
+
+    DEVID = 0x00
+    BW_RATE = 0x2C
+    POWER_CTL = 0x2D
+    INT_ENABLE = 0x2E
+    INT_MAP = 0x2F
+    INT_SOURCE = 0x30
+    DATA_X0 = 0x32
+    DATA_Z1 = 0x37
+    FIFO_CTL = 0x38
+    FIFO_STATUS = 0x39
+
+    RATES_HZ = {0x0F: 3200, 0x0E: 1600, 0x0D: 800, 0x0C: 400, 0x0B: 200, 0x0A: 100, 0x09: 50, 0x08: 25, 0x07: 12.5,
+                0x06: 6.25}
+    FIFO_SIZE = 32
+    LSB_G = 0.004  # g per LSB in full resolution
+
+    def __init__(self, int1_pin=None):
+        self.lock = threading.Lock()
+        self.registers = bytearray(0x40)
+        self.registers[self.DEVID] = 0xE5
+        self.registers[self.BW_RATE] = 0x0A
+
+        self.fifo = deque()
+        self.output = bytes(6)  # Content of the data registers when the FIFO is empty
+        self.next_sample = None  # time.monotonic() at which the next sample is acquired
+
+        self.int1 = gpio.LOW
+        self.int1_edges = [0, 0]  # Rising, falling
+        if int1_pin is not None:
+            gpio.connect(int1_pin, gpio.SimulatedPin(self.__int1_level, self.__int1_next_change, self.__int1_edges))
+
+    def __period(self):
+        return 1.0 / self.RATES_HZ.get(self.registers[self.BW_RATE] & 0x0F, 100)
+
+    def __watermark(self):
+        return self.registers[self.FIFO_CTL] & 0x1F
+
+    def __sample(self):
+        load = vertical_load(time.time())
+        amplitude = settings.getfloat('accelerometer_noise')
+        counts = [int(round(g / self.LSB_G)) for g in (noise(amplitude), noise(amplitude), load + noise(amplitude))]
+        return struct.pack("<hhh", *(max(min(c, 4095), -4096) for c in counts))
+
+    def __update(self):
+        """Acquire the samples due since the last access. Must be called with the lock held."""
+        if not self.registers[self.POWER_CTL] & 0x08:  # Not in measure mode
+            self.next_sample = None
+            return
+
+        now = time.monotonic()
+        period = self.__period()
+        if self.next_sample is None:
+            self.next_sample = now + period
+            return
+
+        due = int((now - self.next_sample) / period) + 1 if now >= self.next_sample else 0
+        self.next_sample += due * period
+
+        # Only the last samples can still be in the FIFO
+        for _ in range(min(due, self.FIFO_SIZE + 1)):
+            mode = self.registers[self.FIFO_CTL] >> 6
+            if mode == 0b00:  # Bypass
+                self.fifo.clear()
+            elif mode == 0b01 and len(self.fifo) >= self.FIFO_SIZE:  # FIFO mode stops collecting when full
+                break
+            elif len(self.fifo) >= self.FIFO_SIZE:  # Stream and trigger modes drop the oldest sample
+                self.fifo.popleft()
+
+            self.fifo.append(self.__sample())
+
+        self.__track_int1()
+
+    def __track_int1(self):
+        """Count the edges on INT1 after the FIFO changed. Must be called with the lock held."""
+        watermark = self.registers[self.INT_ENABLE] & 0b10 and not self.registers[self.INT_MAP] & 0b10
+        level = gpio.HIGH if watermark and len(self.fifo) >= self.__watermark() else gpio.LOW
+        if level != self.int1:
+            self.int1 = level
+            self.int1_edges[0 if level == gpio.HIGH else 1] += 1
+
+    def __int1_level(self):
+        with self.lock:
+            self.__update()
+            return self.int1
+
+    def __int1_edges(self):
+        with self.lock:
+            self.__update()
+            return tuple(self.int1_edges)
+
+    def __int1_next_change(self):
+        with self.lock:
+            if self.next_sample is None or len(self.fifo) >= self.__watermark():
+                return None  # Only goes low when the FIFO is read
+            return self.next_sample + (self.__watermark() - len(self.fifo) - 1) * self.__period()
+
+    def __read_register(self, register):
+        if self.DATA_X0 <= register <= self.DATA_Z1:
+            data = self.fifo[0] if len(self.fifo) != 0 else self.output
+            return data[register - self.DATA_X0]
+        elif register == self.FIFO_STATUS:
+            return min(len(self.fifo), self.FIFO_SIZE)
+        elif register == self.INT_SOURCE:
+            data_ready = 0x80 if len(self.fifo) != 0 else 0
+            watermark = 0x02 if len(self.fifo) >= self.__watermark() else 0
+            return data_ready | watermark
+
+        return self.registers[register]
+
+    def read(self, register, length):
+        """
+        Read length registers starting at register in one transaction. If the data registers were read, the FIFO
+        pops at the end of the transaction.
+        """
+        with self.lock:
+            self.__update()
+            data = [self.__read_register((register + i) & 0x3F) for i in range(length)]
+
+            if register <= self.DATA_Z1 < register + length and len(self.fifo) != 0:
+                self.output = self.fifo.popleft()
+                self.__track_int1()
+
+        gpio.notify()
+        return data
+
+    def write(self, register, values):
+        with self.lock:
+            self.__update()
+            for i, value in enumerate(values):
+                address = (register + i) & 0x3F
+                self.registers[address] = value & 0xFF
+
+                if address == self.FIFO_CTL:
+                    self.fifo.clear()
+
+            # Start acquiring right away if measure mode was just enabled
+            self.__update()
+            self.__track_int1()
+
+        gpio.notify()
+
+
+class PressureSensor:
+    """
+    Pressure sensor fitted on the board, as the driver uses it in one-shot mode: a measurement is started each time the
+    one-shot bit of CTRL_REG0 is set. P_DA is set in STATUS_REG once it is done, and cleared once PRESS_OUT_H is read.
+
+    Its continuous mode and FIFO are not modelled, as their registers have not been checked against the datasheet of
+    the part. See LPS25H for a sensor with a FIFO.
+    """
+
+    CTRL_REG0 = 0x20
+    STATUS_REG = 0x27
+    PRESS_OUT_XL = 0x28
+    PRESS_OUT_H = 0x2A
+    WHO_AM_I = 0x0F
+
+    AUTO_INCREMENT = 0x80
+    ONE_SHOT_TIME = 0.04  # Time needed for a one-shot measurement, in s
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.registers = bytearray(0x40)
+        self.registers[self.WHO_AM_I] = 0xBB
+        self.latest = struct.pack("<i", int(cabin_pressure() * 64))[:3]  # 24 bits, LSB is 1/64 Pa
+        self.measurement_done = None  # time.monotonic() at which the measurement in progress is done
+
+    def __update(self):
+        """Complete the measurement in progress if it is done. Must be called with the lock held."""
+        if self.measurement_done is not None and time.monotonic() >= self.measurement_done:
+            self.measurement_done = None
+            self.latest = struct.pack("<i", int(cabin_pressure() * 64))[:3]
+            self.registers[self.CTRL_REG0] &= ~0b1
+            self.registers[self.STATUS_REG] |= 0b10  # P_DA
+
+    def read(self, register, length):
+        with self.lock:
+            self.__update()
+            register &= ~self.AUTO_INCREMENT
+            data = [self.__read_register(register + i) for i in range(length)]
+            if register <= self.PRESS_OUT_H < register + length:
+                self.registers[self.STATUS_REG] &= ~0b10
+            return data
+
+    def __read_register(self, register):
+        if self.PRESS_OUT_XL <= register <= self.PRESS_OUT_H:
+            return self.latest[register - self.PRESS_OUT_XL]
+        return self.registers[register]
+
+    def write(self, register, values):
+        with self.lock:
+            self.__update()
+            register &= ~self.AUTO_INCREMENT
+            for i, value in enumerate(values):
+                address = register + i
+                # The driver sets both bits to start a measurement, and only the second one to reset the sensor
+                if address == self.CTRL_REG0 and value & 0b11 == 0b10:  # Software reset
+                    self.registers = bytearray(0x40)
+                    self.registers[self.WHO_AM_I] = 0xBB
+                    self.measurement_done = None
+                    continue
+
+                self.registers[address] = value & 0xFF
+
+                if address == self.CTRL_REG0 and value & 0b1 and self.measurement_done is None:  # One-shot
+                    self.measurement_done = time.monotonic() + self.ONE_SHOT_TIME
+
+
+class LPS25H:
+    """
+    LPS25H pressure sensor, with its FIFO and INT1 pin, following the register map of its datasheet. The samples are
+    generated at the output data rate set in CTRL_REG1, when the device is accessed. Only the bypass, FIFO and stream
+    modes of the FIFO are modelled, and only the watermark and data ready signals of INT1.
+    """
+
+    WHO_AM_I = 0x0F
+    CTRL_REG1 = 0x20
+    CTRL_REG2 = 0x21
+    CTRL_REG3 = 0x22
+    CTRL_REG4 = 0x23
+    STATUS_REG = 0x27
+    PRESS_OUT_XL = 0x28
+    PRESS_OUT_H = 0x2A
+    FIFO_CTRL = 0x2E
+    FIFO_STATUS = 0x2F
+
+    AUTO_INCREMENT = 0x80
+    RATES_HZ = {0b001: 1, 0b010: 7, 0b011: 12.5, 0b100: 25}
+    FIFO_SIZE = 32
+    ONE_SHOT_TIME = 0.04  # Time needed for a one-shot measurement, in s
+
+    def __init__(self, int1_pin=None):
+        self.lock = threading.Lock()
+        self.__reset()
+
+        self.int1 = gpio.LOW
+        self.int1_edges = [0, 0]  # Rising, falling
+        if int1_pin is not None:
+            gpio.connect(int1_pin, gpio.SimulatedPin(self.__int1_level, self.__int1_next_change, self.__int1_edges))
+
+    def __reset(self):
+        self.registers = bytearray(0x40)
+        self.registers[self.WHO_AM_I] = 0xBD
+        self.fifo = deque()
+        self.output = self.__sample()  # Content of the output registers when the FIFO is not used
+        self.data_ready = False  # P_DA of STATUS_REG
+        self.next_sample = None  # time.monotonic() at which the next sample is acquired
+
+    @staticmethod
+    def __sample():
+        return struct.pack("<i", int(cabin_pressure() * 40.96))[:3]  # 24 bits, 4096 LSB/hPa
+
+    def __period(self):
+        rate = self.RATES_HZ.get((self.registers[self.CTRL_REG1] >> 4) & 0b111)
+        return 1.0 / rate if rate is not None else None
+
+    def __fifo_mode(self):
+        """Return the FIFO mode, or None if the FIFO is not enabled"""
+        if not self.registers[self.CTRL_REG2] & 0b01000000:  # FIFO_EN
+            return None
+        return self.registers[self.FIFO_CTRL] >> 5
+
+    def __watermark(self):
+        """Return True if the FIFO is at or above its watermark level"""
+        if not self.registers[self.CTRL_REG2] & 0b00100000:  # WTM_EN
+            return False
+        return len(self.fifo) >= (self.registers[self.FIFO_CTRL] & 0x1F)
+
+    def __acquire(self):
+        """Store a new sample in the FIFO or the output registers. Must be called with the lock held."""
+        sample = self.__sample()
+        mode = self.__fifo_mode()
+        if mode is None or mode == 0b000:  # No FIFO, or bypass
+            self.fifo.clear()
+            self.output = sample
+        elif mode == 0b001 and len(self.fifo) >= self.FIFO_SIZE:  # FIFO mode stops collecting when full
+            return
+        else:  # Stream mode drops the oldest sample
+            if len(self.fifo) >= self.FIFO_SIZE:
+                self.fifo.popleft()
+            self.fifo.append(sample)
+        self.data_ready = True
+
+    def __update(self):
+        """Acquire the samples due since the last access. Must be called with the lock held."""
+        period = self.__period()
+        if not self.registers[self.CTRL_REG1] & 0x80 or period is None:  # Powered down, or one-shot only
+            self.next_sample = None
+            return
+
+        now = time.monotonic()
+        if self.next_sample is None:
+            self.next_sample = now + period
+            return
+
+        due = int((now - self.next_sample) / period) + 1 if now >= self.next_sample else 0
+        self.next_sample += due * period
+
+        # Only the last samples can still be in the FIFO
+        for _ in range(min(due, self.FIFO_SIZE + 1)):
+            self.__acquire()
+
+        self.__track_int1()
+
+    def __track_int1(self):
+        """Count the edges on INT1 after the device changed. Must be called with the lock held."""
+        signals = self.registers[self.CTRL_REG4]
+        active = (signals & 0b0100 and self.__watermark()) or (signals & 0b0001 and self.data_ready)
+        if self.registers[self.CTRL_REG3] & 0x80:  # INT_H_L: active low
+            active = not active
+
+        level = gpio.HIGH if active else gpio.LOW
+        if level != self.int1:
+            self.int1 = level
+            self.int1_edges[0 if level == gpio.HIGH else 1] += 1
+
+    def __int1_level(self):
+        with self.lock:
+            self.__update()
+            return self.int1
+
+    def __int1_edges(self):
+        with self.lock:
+            self.__update()
+            return tuple(self.int1_edges)
+
+    def __int1_next_change(self):
+        with self.lock:
+            if self.next_sample is None:
+                return None
+            signals = self.registers[self.CTRL_REG4]
+            if signals & 0b0001 and not self.data_ready:
+                return self.next_sample
+            if signals & 0b0100 and self.registers[self.CTRL_REG2] & 0b00100000 and not self.__watermark():
+                missing = (self.registers[self.FIFO_CTRL] & 0x1F) - len(self.fifo)
+                return self.next_sample + (missing - 1) * self.__period()
+            return None  # Only changes when the data is read
+
+    def __read_register(self, register):
+        if self.PRESS_OUT_XL <= register <= self.PRESS_OUT_H:
+            data = self.fifo[0] if len(self.fifo) != 0 else self.output
+            return data[register - self.PRESS_OUT_XL]
+        elif register == self.STATUS_REG:
+            return 0b10 if self.data_ready else 0
+        elif register == self.FIFO_STATUS:
+            full = len(self.fifo) >= self.FIFO_SIZE
+            return ((0x80 if self.__watermark() else 0) | (0x40 if full else 0) | (0x20 if len(self.fifo) == 0 else 0) |
+                    (len(self.fifo) & 0x1F))
+
+        return self.registers[register]
+
+    def read(self, register, length):
+        """
+        Read length registers in one transaction. The address only increments if AUTO_INCREMENT is set. Each time
+        PRESS_OUT_H is read, the FIFO pops, and while the FIFO is enabled the address rolls back to PRESS_OUT_XL, so
+        the next sample is read in the same transaction.
+        """
+        with self.lock:
+            self.__update()
+
+            auto_increment = register & self.AUTO_INCREMENT
+            address = register & ~self.AUTO_INCREMENT
+            data = []
+            for _ in range(length):
+                data.append(self.__read_register(address))
+                if address == self.PRESS_OUT_H:
+                    if len(self.fifo) != 0:
+                        self.fifo.popleft()
+                    self.data_ready = len(self.fifo) != 0
+                    if self.__fifo_mode() is not None:
+                        address = self.PRESS_OUT_XL
+                        continue
+                if auto_increment:
+                    address += 1
+
+            self.__track_int1()
+
+        gpio.notify()
+        return data
+
+    def write(self, register, values):
+        with self.lock:
+            self.__update()
+            register &= ~self.AUTO_INCREMENT
+            for i, value in enumerate(values):
+                address = register + i
+                if address == self.CTRL_REG2 and value & 0b100:  # SWRESET
+                    self.__reset()
+                    continue
+
+                self.registers[address] = value & 0xFF
+
+                if address == self.CTRL_REG2 and value & 0b1:  # ONE_SHOT
+                    time.sleep(self.ONE_SHOT_TIME)
+                    self.__acquire()
+                    self.registers[address] &= ~0b1
+                elif address == self.FIFO_CTRL or (address == self.CTRL_REG2 and not value & 0b01000000):
+                    self.fifo.clear()
+
+            # Start acquiring right away if the device was just powered up
+            self.__update()
+            self.__track_int1()
+
+        gpio.notify()
+
+
+class ADcmXL3021:
+    """
+    ADcmXL3021 vibration sensor in manual FFT mode. Communication is done in 16 bits frames, and the data requested in
+    a frame is returned in the next one. BUSY is low while a command or a capture is being processed.
+    """
+
+    GLOB_CMD_UPPER = 0x3F
+    X_BUF = 0x0E
+    Y_BUF = 0x10
+    Z_BUF = 0x12
+    AVG_CNT = 0x3A
+    FFT_AVG1 = 0x06
+
+    BINS = 2048
+    WRITE_BUSY_TIME = 0.0001  # Time the sensor is busy after a register write, in s
+    # Vibrations of the aircraft: (frequency in Hz, amplitude in mg)
+    PEAKS = [(24, 40), (48, 15), (95, 25), (190, 8), (400, 5)]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.registers = {0x56: 0x0BCD, self.AVG_CNT: 7, self.FFT_AVG1: 1}  # PROD_ID
+        self.pending = 0  # Answer to send in the next frame
+        self.busy_until = 0
+        self.busy_count = 0  # Number of times BUSY went low
+        self.buffers = {self.X_BUF: [0] * self.BINS, self.Y_BUF: [0] * self.BINS, self.Z_BUF: [0] * self.BINS}
+        self.pointers = {self.X_BUF: 0, self.Y_BUF: 0, self.Z_BUF: 0}
+
+        gpio.connect(VIBRATION_BUSY_PIN,
+                     gpio.SimulatedPin(self.__busy_level, self.__busy_next_change, self.__busy_edges))
+
+    def __busy_level(self):
+        return gpio.HIGH if time.monotonic() >= self.busy_until else gpio.LOW
+
+    def __busy_next_change(self):
+        return self.busy_until if time.monotonic() < self.busy_until else None
+
+    def __busy_edges(self):
+        with self.lock:
+            # Every time BUSY went low, it goes back high at the end of the command
+            rising = self.busy_count if time.monotonic() >= self.busy_until else self.busy_count - 1
+            return rising, self.busy_count
+
+    def __set_busy(self, duration):
+        """Make the sensor busy for duration seconds. Must be called with the lock held."""
+        now = time.monotonic()
+        if now >= self.busy_until:
+            self.busy_count += 1
+        self.busy_until = max(self.busy_until, now + duration)
+
+    def __capture(self):
+        """Start a FFT capture, and make the sensor busy for as long as the real one would be"""
+        samplerate = 220000 / 2 ** self.registers[self.AVG_CNT]
+        binsize = samplerate / 4096
+        averages = max(self.registers[self.FFT_AVG1], 1)
+
+        for axis, weight in ((self.X_BUF, 0.6), (self.Y_BUF, 0.4), (self.Z_BUF, 1.0)):
+            values = []
+            for i in range(self.BINS):
+                mg = 0.5 + abs(noise(0.2))
+                for frequency, amplitude in self.PEAKS:
+                    mg += weight * amplitude * math.exp(-((i * binsize - frequency) / (2 * binsize)) ** 2)
+
+                # The sensor returns 2048 * log2(value / 0.9535), for a value in mg
+                values.append(max(min(int(2048 * math.log2(mg * averages / 0.9535)), 0xFFFF), 0))
+
+            self.buffers[axis] = values
+            self.pointers[axis] = 0
+
+        self.__set_busy(4096 / samplerate * averages)
+
+    def transfer(self, frame):
+        """Send a 16 bits frame (2 bytes), and return the 2 bytes received"""
+        with self.lock:
+            answer = [(self.pending >> 8) & 0xFF, self.pending & 0xFF]
+
+            address = frame[0] & 0x7F
+            if frame[0] & 0x80:  # Write, one byte at a time
+                register = address & ~0b1
+                value = self.registers.get(register, 0)
+                if address & 0b1:
+                    value = (value & 0x00FF) | (frame[1] << 8)
+                else:
+                    value = (value & 0xFF00) | frame[1]
+                self.registers[register] = value
+
+                if address == self.GLOB_CMD_UPPER and frame[1] & 0x08:
+                    self.__capture()
+                else:
+                    self.__set_busy(self.WRITE_BUSY_TIME)
+
+                self.pending = 0
+            elif address in self.buffers:
+                self.pending = self.buffers[address][self.pointers[address]]
+                self.pointers[address] = (self.pointers[address] + 1) % self.BINS
+            else:
+                self.pending = self.registers.get(address, 0)
+
+        gpio.notify()
+        return answer
+
+
+# Devices on each bus, by I2C address or SPI (bus, chip select), and the factory creating them
+I2C_DEVICES = {0x53: 'i2c_accelerometer', 0x5C: 'pressure'}
+SPI_DEVICES = {(0, 0): 'spi_accelerometer', (0, 1): 'vibration'}
+PIN_DEVICES = {ACCELEROMETER_INT1_PIN: 'spi_accelerometer', PRESSURE_INT1_PIN: 'pressure',
+               VIBRATION_BUSY_PIN: 'vibration'}
+FACTORIES = {
+    'i2c_accelerometer': ADXL343,
+    'spi_accelerometer': lambda: ADXL343(ACCELEROMETER_INT1_PIN),
+    'pressure': lambda: LPS25H(PRESSURE_INT1_PIN) if settings.getboolean('pressure_lps25h') else PressureSensor(),
+    'vibration': ADcmXL3021,
+}
+
+_devices = dict()
+_devices_lock = threading.Lock()
+
+
+def get(name):
+    """Return the device with that name, creating it if needed"""
+    with _devices_lock:
+        if name not in _devices:
+            _devices[name] = FACTORIES[name]()
+        return _devices[name]
+
+
+def wire(pin):
+    """Create the device driving this GPIO pin, if there is one"""
+    if pin in PIN_DEVICES:
+        get(PIN_DEVICES[pin])
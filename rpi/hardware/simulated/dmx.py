@@ -0,0 +1,39 @@
+"""
+Simulated DMXEnttecPro controller. The level of the channels is kept so the simulated photodiodes of the Teensy can
+see which LEDs are on.
+"""
+channels = bytearray(513)  # Channel 0 is not used, DMX channels start at 1
+
+
+def get_port_by_serial_number(serial_number):
+    return '/dev/ttyUSB0'
+
+
+class Controller:
+    def __init__(self, port_string, dmx_size=512, baudrate=57600, timeout=1, auto_submit=False):
+        self.port = port_string
+        self.auto_submit = auto_submit
+        self.pending = dict()
+
+    def set_channel(self, channel, value):
+        if not 1 <= channel <= 512:
+            raise ValueError("Invalid DMX channel {}".format(channel))
+
+        self.pending[channel] = value
+        if self.auto_submit:
+            self.submit()
+
+    def get_channel(self, channel):
+        return self.pending.get(channel, channels[channel])
+
+    def clear_channels(self):
+        for channel in range(1, 513):
+            self.pending[channel] = 0
+
+    def submit(self):
+        for channel, value in self.pending.items():
+            channels[channel] = value
+        self.pending.clear()
+
+    def close(self):
+        pass
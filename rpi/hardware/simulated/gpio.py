@@ -0,0 +1,216 @@
+"""
+Simulated RPi.GPIO. Input pins are driven by the simulated devices wired to them, and the level of the output pins
+is kept so devices can react to it (for example the heater relay).
+"""
+import threading
+import time
+
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+# Protects everything below. Also used to wake up the edge watcher thread when a device changed state.
+_condition = threading.Condition()
+
+_sources = dict()  # Input pin number -> SimulatedPin driving it
+_pulls = dict()  # Input pin number -> level when nothing drives it
+_outputs = dict()  # Output pin number -> level
+_watches = dict()  # Pin number -> _EdgeWatch
+_watcher = None
+
+
+class SimulatedPin:
+    """
+    Output of a simulated device, wired to a GPIO input.
+    level: function returning the current level of the pin
+    next_change: function returning the time (time.monotonic()) at which the level will change by itself, or None
+    if it will only change when the device is accessed. The device must call notify() after such an access.
+    edges: function returning the number of rising and falling edges since the device was created. Pulses can be
+    shorter than the time needed to check the level, so the edges are counted by the device, like the kernel does.
+    """
+
+    def __init__(self, level, next_change, edges):
+        self.level = level
+        self.next_change = next_change
+        self.edges = edges
+
+
+class _EdgeWatch:
+    def __init__(self, edge, edges):
+        self.edge = edge
+        self.edges = edges
+        self.callbacks = []
+        self.detected = False
+
+
+def connect(pin, source):
+    """Wire the output of a simulated device to an input pin"""
+    with _condition:
+        _sources[pin] = source
+        _condition.notify_all()
+
+
+def notify():
+    """Must be called by devices after an access changed the level of one of their pins"""
+    with _condition:
+        _condition.notify_all()
+
+
+def output_level(pin):
+    """Return the level set on an output pin"""
+    return _outputs.get(pin, LOW)
+
+
+def setmode(mode):
+    pass
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=LOW):
+    # Make sure the device wired to this pin exists, so the pin is driven
+    from rpi.hardware.simulated import devices
+    devices.wire(channel)
+
+    with _condition:
+        if direction == OUT:
+            _outputs[channel] = initial
+        else:
+            _outputs.pop(channel, None)
+            _pulls[channel] = HIGH if pull_up_down == PUD_UP else LOW
+
+
+def input(channel):
+    if channel in _outputs:
+        return _outputs[channel]
+
+    source = _sources.get(channel)
+    if source is None:
+        return _pulls.get(channel, LOW)
+
+    return source.level()
+
+
+def output(channel, value):
+    with _condition:
+        _outputs[channel] = HIGH if value else LOW
+
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    global _watcher
+
+    with _condition:
+        if channel in _watches:
+            raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+
+        watch = _EdgeWatch(edge, _edges(channel))
+        if callback is not None:
+            watch.callbacks.append(callback)
+        _watches[channel] = watch
+
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch_edges, daemon=True)
+            _watcher.start()
+
+        _condition.notify_all()
+
+
+def add_event_callback(channel, callback):
+    with _condition:
+        _watches[channel].callbacks.append(callback)
+
+
+def remove_event_detect(channel):
+    with _condition:
+        _watches.pop(channel, None)
+
+
+def event_detected(channel):
+    with _condition:
+        watch = _watches.get(channel)
+        if watch is None or not watch.detected:
+            return False
+
+        watch.detected = False
+        return True
+
+
+def wait_for_edge(channel, edge, bouncetime=None, timeout=None):
+    """Same as RPi.GPIO: timeout is in ms, and the channel is returned, or None on timeout"""
+    event = threading.Event()
+    add_event_detect(channel, edge, lambda ch: event.set())
+    try:
+        return channel if event.wait(timeout / 1000 if timeout is not None else None) else None
+    finally:
+        remove_event_detect(channel)
+
+
+def cleanup(channel=None):
+    with _condition:
+        if channel is None:
+            _watches.clear()
+            _outputs.clear()
+        else:
+            _watches.pop(channel, None)
+            _outputs.pop(channel, None)
+
+
+def _edges(channel):
+    """Return the number of rising and falling edges on that pin"""
+    source = _sources.get(channel)
+    return source.edges() if source is not None else (0, 0)
+
+
+def _scan_edges():
+    """
+    Check all the watched pins for edges. Must be called with _condition held.
+    Returns the callbacks to call, and the time to wait before the next scan (None to wait for a notification).
+    """
+    fired = []
+    next_scan = None
+    for pin, watch in _watches.items():
+        rising, falling = _edges(pin)
+        new_rising = rising != watch.edges[0]
+        new_falling = falling != watch.edges[1]
+        watch.edges = (rising, falling)
+
+        if (new_rising and watch.edge in (RISING, BOTH)) or (new_falling and watch.edge in (FALLING, BOTH)):
+            watch.detected = True
+            fired.extend((callback, pin) for callback in watch.callbacks)
+
+        source = _sources.get(pin)
+        change = source.next_change() if source is not None else None
+        if change is not None and (next_scan is None or change < next_scan):
+            next_scan = change
+
+    if next_scan is not None:
+        next_scan = max(next_scan - time.monotonic(), 0)
+
+    return fired, next_scan
+
+
+def _watch_edges():
+    """
+    Thread doing the edge detection. It sleeps until a device is accessed or a pin is due to change by itself.
+    """
+    while True:
+        with _condition:
+            fired, wait_time = _scan_edges()
+            if len(fired) == 0:
+                _condition.wait(wait_time)
+                continue
+
+        # Call outside of the lock, so the callbacks can use the GPIO functions
+        for callback, pin in fired:
+            callback(pin)
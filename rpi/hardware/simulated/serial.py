@@ -0,0 +1,85 @@
+"""
+Simulated pyserial, with the Teensy at the other end. The Teensy prints its state every teensy_line_period seconds:
+the state of the motors, and which LEDs its photodiodes see turned on.
+"""
+import fnmatch
+import threading
+import time
+
+from rpi.hardware.simulated import dmx, settings
+
+PORTS = ['/dev/ttyACM0']
+
+LED_COUNT = 7
+
+
+class SerialException(IOError):
+    pass
+
+
+def glob_ports(pattern):
+    return [port for port in PORTS if fnmatch.fnmatch(port, pattern)]
+
+
+class Serial:
+    def __init__(self, port=None, baudrate=9600, timeout=None, **kwargs):
+        if port not in PORTS:
+            raise SerialException("could not open port {}".format(port))
+
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.motor_end = [0.0, 0.0]  # time.monotonic() at which each motor stops
+        self.next_line = time.monotonic()
+
+    def write(self, data):
+        with self.lock:
+            for line in bytes(data).decode('utf-8').split():
+                command = int(line)
+                if command >> 2 != 0b1001:
+                    continue
+
+                motor_number = (command >> 1) & 1
+                self.motor_end[motor_number] = time.monotonic() + settings.getfloat('motor_run_time')
+
+        return len(data)
+
+    def __state(self):
+        now = time.monotonic()
+        motors = 0
+        for motor_number, end in enumerate(self.motor_end):
+            running = 1 if now < end else 0
+            # Bits 2-3 are for the first motor, bits 0-1 for the second one. Timeout bit is never set.
+            motors |= (running << 1) << (2 if motor_number == 0 else 0)
+
+        leds = 0
+        for i in range(LED_COUNT):
+            if dmx.channels[i + 1] != 0:
+                leds |= 1 << i
+
+        return (motors << 7) | leds
+
+    def readline(self):
+        with self.lock:
+            wait = self.next_line - time.monotonic()
+            if self.timeout is not None and wait > self.timeout:
+                time.sleep(self.timeout)
+                return b''
+
+            time.sleep(max(wait, 0))
+            self.next_line = max(self.next_line, time.monotonic()) + settings.getfloat('teensy_line_period')
+            return "{}\r\n".format(self.__state()).encode('utf-8')
+
+    def flushInput(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def close(self):
+        pass
@@ -0,0 +1,50 @@
+"""
+Simulated smbus. Transactions take the time they would on the real bus, at i2c_clock_hz.
+"""
+import errno
+
+from rpi.hardware.simulated import BusTime, devices, settings
+
+
+class SMBus:
+    def __init__(self, bus=None):
+        self.bus = bus
+        self.bus_time = BusTime()
+        self.clock = settings.getint('i2c_clock_hz')
+
+    def __device(self, address):
+        if address not in devices.I2C_DEVICES:
+            raise OSError(errno.EREMOTEIO, "Remote I/O error")
+        return devices.get(devices.I2C_DEVICES[address])
+
+    def __transaction(self, data_bytes, read):
+        # Address and register bytes, then the data. Reads need a repeated start and the address again.
+        total_bytes = 2 + data_bytes + (1 if read else 0)
+        self.bus_time.spend(total_bytes * 9 / self.clock)
+
+    def read_byte_data(self, address, register):
+        device = self.__device(address)
+        self.__transaction(1, True)
+        return device.read(register, 1)[0]
+
+    def write_byte_data(self, address, register, value):
+        device = self.__device(address)
+        self.__transaction(1, False)
+        device.write(register, [value])
+
+    def read_word_data(self, address, register):
+        data = self.read_i2c_block_data(address, register, 2)
+        return data[0] | (data[1] << 8)
+
+    def read_i2c_block_data(self, address, register, length=32):
+        device = self.__device(address)
+        self.__transaction(length, True)
+        return device.read(register, length)
+
+    def write_i2c_block_data(self, address, register, data):
+        device = self.__device(address)
+        self.__transaction(len(data), False)
+        device.write(register, list(data))
+
+    def close(self):
+        pass
@@ -0,0 +1,56 @@
+"""
+Simulated spidev. Every transfer takes spi_transfer_latency_us plus the time to clock the bytes.
+"""
+from rpi.hardware.simulated import BusTime, devices, settings
+
+
+class SpiDev:
+    def __init__(self, bus=None, device=None):
+        self.max_speed_hz = 500000
+        self.mode = 0
+        self.lsbfirst = False
+        self.bits_per_word = 8
+        self.cshigh = False
+        self.device = None
+        self.bus_time = BusTime()
+
+        if bus is not None:
+            self.open(bus, device)
+
+    def open(self, bus, device):
+        if (bus, device) not in devices.SPI_DEVICES:
+            raise FileNotFoundError("No such SPI device: /dev/spidev{}.{}".format(bus, device))
+        self.device = devices.get(devices.SPI_DEVICES[(bus, device)])
+
+    def __spend(self, length, speed_hz, delay_usecs):
+        latency = settings.getfloat('spi_transfer_latency_us') + delay_usecs
+        self.bus_time.spend(latency / 1e6 + length * 8 / (speed_hz or self.max_speed_hz))
+
+    def xfer2(self, values, speed_hz=0, delay_usecs=0, bits_per_word=0):
+        self.__spend(len(values), speed_hz, delay_usecs)
+
+        if isinstance(self.device, devices.ADXL343):
+            # First byte: read bit, multiple bytes bit and 6 bits address
+            register = values[0] & 0x3F
+            if values[0] & 0x80:
+                length = len(values) - 1 if values[0] & 0x40 else 1
+                data = self.device.read(register, length)
+                return [0] + data + [0] * (len(values) - 1 - length)
+
+            self.device.write(register, values[1:] if values[0] & 0x40 else values[1:2])
+            return [0] * len(values)
+
+        # Devices using 16 bits frames. Chip select stays low for the whole transfer, so the device sees a single frame.
+        return self.device.transfer(values[:2]) + [0] * (len(values) - 2)
+
+    def xfer(self, values, speed_hz=0, delay_usecs=0, bits_per_word=0):
+        return self.xfer2(values, speed_hz, delay_usecs, bits_per_word)
+
+    def readbytes(self, length):
+        return self.xfer2([0] * length)
+
+    def writebytes(self, values):
+        self.xfer2(values)
+
+    def close(self):
+        self.device = None
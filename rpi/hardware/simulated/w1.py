@@ -0,0 +1,168 @@
+"""
+Simulated one-wire sysfs files of the DS18B20 thermometers, with a bulk read capable bus master. Any DS18B20 id
+(starting with 28-) can be opened and is created on first access. The temperature follows a simple thermal model of
+the experiment, heated when the heater relay pin is high.
+"""
+import fnmatch
+import threading
+import time
+import zlib
+
+from rpi.hardware.simulated import HEATER_RELAY_PIN, gpio, noise, settings
+
+DEVICES_PATH = '/sys/bus/w1/devices/'
+BULK_READ_PATH = DEVICES_PATH + 'w1_bus_master1/therm_bulk_read'
+
+# Time in seconds needed for a temperature conversion at each resolution
+CONVERSION_TIMES = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.75}
+
+HEATING_RATE = 0.05  # Temperature increase in C/s when the heater is on
+COOLING_FACTOR = 0.002  # Fraction of the difference with the ambient temperature lost each second
+
+_lock = threading.Lock()
+_thermometers = dict()  # Id -> _DS18B20
+_bulk_done = 0.0  # time.monotonic() at which the bulk conversion is done
+
+
+class _ThermalModel:
+    def __init__(self):
+        self.temperature = settings.getfloat('ambient_temperature')
+        self.last_update = time.monotonic()
+
+    def update(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+
+        ambient = settings.getfloat('ambient_temperature')
+        if gpio.output_level(HEATER_RELAY_PIN) == gpio.HIGH:
+            self.temperature += HEATING_RATE * elapsed
+        self.temperature -= COOLING_FACTOR * (self.temperature - ambient) * elapsed
+
+        return self.temperature
+
+
+_model = _ThermalModel()
+
+
+class _DS18B20:
+    def __init__(self, identity):
+        self.resolution = 12
+        self.offset = (zlib.crc32(identity.encode('ascii')) % 100) / 100 - 0.5  # Each sensor is at a different spot
+        self.converted = None  # Result of the last bulk conversion, until read
+
+    def convert(self):
+        step = 0.5 / 2 ** (self.resolution - 9)
+        temperature = _model.update() + self.offset + noise(0.05)
+        return round(temperature / step) * step
+
+    def w1_slave(self):
+        if self.converted is not None:
+            temperature, self.converted = self.converted, None
+        else:
+            time.sleep(CONVERSION_TIMES[self.resolution])
+            temperature = self.convert()
+
+        raw = int(temperature * 16) & 0xFFFF
+        scratchpad = "{:02x} {:02x} 4b 46 7f ff 0c 10 1c".format(raw & 0xFF, raw >> 8)
+        return "{} : crc=1c YES\n{} t={}\n".format(scratchpad, scratchpad, int(temperature * 1000))
+
+
+class _SysfsFile:
+    """File-like object. Every read from the start of the file gets fresh content, like sysfs."""
+
+    def __init__(self, path, mode, read, write):
+        self.binary = 'b' in mode
+        self.__read = read
+        self.__write = write
+        self.position = 0
+
+    def read(self, size=-1):
+        content = self.__read() if self.position == 0 else ''
+        self.position = len(content)
+        return content.encode('ascii') if self.binary else content
+
+    def readlines(self):
+        return self.read().splitlines(keepends=True)
+
+    def write(self, data):
+        self.__write(data.decode('ascii') if isinstance(data, bytes) else data)
+        return len(data)
+
+    def seek(self, position, whence=0):
+        self.position = position
+        return position
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _bulk_read():
+    with _lock:
+        if time.monotonic() < _bulk_done:
+            return '-1\n'
+        return '1\n' if any(t.converted is not None for t in _thermometers.values()) else '0\n'
+
+
+def _bulk_trigger(data):
+    global _bulk_done
+
+    if data.strip() != 'trigger':
+        raise OSError("Invalid argument")
+
+    with _lock:
+        resolution = max((t.resolution for t in _thermometers.values()), default=12)
+        _bulk_done = time.monotonic() + CONVERSION_TIMES[resolution]
+        for thermometer in _thermometers.values():
+            thermometer.converted = thermometer.convert()
+
+
+def _read_only(data):
+    raise OSError("Permission denied")
+
+
+def _thermometer(identity):
+    with _lock:
+        if identity not in _thermometers:
+            _thermometers[identity] = _DS18B20(identity)
+        return _thermometers[identity]
+
+
+def _set_resolution(thermometer, data):
+    resolution = int(data)
+    if resolution not in CONVERSION_TIMES:
+        raise OSError("Invalid argument")
+    thermometer.resolution = resolution
+
+
+def open(path, mode='r', buffering=-1, *args, **kwargs):
+    if path == BULK_READ_PATH:
+        return _SysfsFile(path, mode, _bulk_read, _bulk_trigger)
+
+    if not path.startswith(DEVICES_PATH + '28-'):
+        raise FileNotFoundError("No such file or directory: '{}'".format(path))
+
+    identity, _, name = path[len(DEVICES_PATH):].partition('/')
+    thermometer = _thermometer(identity)
+    if name == 'w1_slave':
+        return _SysfsFile(path, mode, thermometer.w1_slave, _read_only)
+    elif name == 'resolution':
+        return _SysfsFile(path, mode, lambda: "{}\n".format(thermometer.resolution),
+                          lambda data: _set_resolution(thermometer, data))
+
+    raise FileNotFoundError("No such file or directory: '{}'".format(path))
+
+
+def glob(pattern):
+    with _lock:
+        paths = [BULK_READ_PATH]
+        for identity in _thermometers:
+            paths += [DEVICES_PATH + identity + '/w1_slave', DEVICES_PATH + identity + '/resolution']
+
+    return [path for path in paths if fnmatch.fnmatch(path, pattern)]
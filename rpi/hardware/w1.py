@@ -0,0 +1,9 @@
+"""
+Real backend for the one-wire sysfs files, giving the same interface as rpi.hardware.simulated.w1
+"""
+import glob as _glob
+
+DEVICES_PATH = '/sys/bus/w1/devices/'
+
+open = open
+glob = _glob.glob
@@ -2,9 +2,7 @@ import logging
 import threading
 import time
 
-from DMXEnttecPro import Controller
-from DMXEnttecPro.utils import get_port_by_serial_number
-
+from rpi.hardware import dmx
 from rpi.teensy import Teensy
 from shared.customlogging.errormanager import ErrorManager
 
@@ -12,8 +10,8 @@ from shared.customlogging.errormanager import ErrorManager
 class LEDs:
     def __init__(self):
         try:
-            port = get_port_by_serial_number('6A011004')
-            self.dmx = Controller(port, auto_submit=True)
+            port = dmx.get_port_by_serial_number('6A011004')
+            self.dmx = dmx.Controller(port, auto_submit=True)
         except (IOError, ValueError) as e:
             em = ErrorManager(__name__)
             em.error("Could connect to the DMX controller!", "DMX_CONNECTION")
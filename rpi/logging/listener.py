@@ -1,18 +1,40 @@
 import logging
 import logging.handlers
 import multiprocessing
+import queue
 import sys
+import time
 
 import shared.config as config
+from rpi.logging.samplering import SampleRing
+from rpi.logging.sinks import SinkHandler, SinkWorker
+from rpi.logging.telemetry import ChannelWriter
 from rpi.network.bufferedsockethandler import BufferedSocketHandler
+from rpi.network.datagramsender import DatagramSender
+from rpi.network.spool import Spool
+from shared.customlogging.errormanager import ErrorManager
 from shared.customlogging.filter import SensorFilter
 from shared.customlogging.handler import MakeFileHandler
+from shared.customlogging.samplebatch import SampleBatch
+from shared.telemetry import Channel, Sample
+
+RING_DRAIN_PERIOD = 0.05  # Seconds between two drains of the sample rings
+RING_MAX_BATCH = 1024  # Maximum number of samples written and sent as a single batch
+SINK_REPORT_PERIOD = 30  # Seconds between two reports of the sink metrics
+SINK_CLOSE_TIMEOUT = 5  # Seconds to wait for each sink to write what is left when the process stops
+CSV_FLUSH_PERIOD = 0.5  # Seconds between two checks of the flush policy of a csv file, when no sample arrives
+SPOOL_PATH = 'logs/rpi/spool/uplink.spool'
 
 
 class LoggingListener(multiprocessing.Process):
     """
     Continuously checks the queue and processes any logs inside. Uses logging_config()
-    to setup the handling of the logs.
+    to setup the handling of the logs. The queue also carries the declarations of the telemetry channels and their
+    samples. Those are written to csv files and sent to the laptop without going through the logging module.
+
+    Every sink (console, files, socket) is fed by its own SinkWorker thread, so a slow SD card or a network outage only
+    delays its own sink. The data of the channels listed in udp_channels is sent to the laptop in UDP datagrams instead
+    of the TCP connection, so losses on the network do not delay the rest.
     """
 
     def __init__(self, queue):
@@ -20,11 +42,186 @@ class LoggingListener(multiprocessing.Process):
         self.queue = queue
 
     def run(self):
-        logging_config()
+        self.socketHandler = logging_config()
+        self.socketSent = 0  # Counters of the socket handler at the last report
+        self.socketDropped = 0
+        self.socketRaw = 0
+        self.socketLink = 0
+        self.socketCompression = 0
+
+        RPIConfig = config.get_config('rpi')
+        self.udpChannels = {name.strip() for name in RPIConfig['udp_channels'].split(',') if name.strip() != ''}
+        self.datagramSender = DatagramSender(RPIConfig['laptop_ip'], logging.handlers.DEFAULT_UDP_LOGGING_PORT)
+        self.datagramSent = 0  # Counters of the datagram sender at the last report
+        self.datagramDropped = 0
+        self.csvConfig = (RPIConfig.getint('csv_flush_kb') * 1024, RPIConfig.getint('csv_flush_ms'),
+                          RPIConfig.getint('csv_fsync_ms'), RPIConfig['sensor_storage'] == 'columnar',
+                          RPIConfig.getint('segment_mb') * 1024 * 1024, RPIConfig.getint('segment_s') * 1000)
+
+        self.writers = dict()  # ChannelWriter of each telemetry channel, by channel name
+        self.writerSinks = dict()  # SinkWorker of each ChannelWriter, by channel name
+        self.rings = dict()  # Sample rings of the channels which have one, by channel name
+        self.dropped = dict()  # Number of samples dropped by each ring, the last time it was checked
+        self.em = ErrorManager(__name__)
+
+        try:
+            self.listen()
+        finally:
+            # Write what is left in the buffers of the csv files, on Ctrl+C for example
+            for sink in self.writerSinks.values():
+                sink.close()
+            for sink in self.writerSinks.values():
+                sink.join(SINK_CLOSE_TIMEOUT)
+
+    def listen(self):
+        next_drain = time.monotonic()
+        next_report = time.monotonic() + SINK_REPORT_PERIOD
+        while True:
+            try:
+                item = self.queue.get(timeout=max(next_drain - time.monotonic(), 0))
+                if isinstance(item, Sample):
+                    self.write_sample(item.channel, item.values)
+                elif isinstance(item, Channel):
+                    self.declare_channel(item)
+                elif isinstance(item, list):
+                    # Batch of records from a CustomQueueHandler in batching mode
+                    for record in item:
+                        logging.getLogger(record.name).handle(record)
+                else:
+                    logger = logging.getLogger(item.name)
+                    logger.handle(item)
+            except queue.Empty:
+                pass
+
+            if time.monotonic() >= next_drain:
+                self.drain_rings()
+                next_drain = time.monotonic() + RING_DRAIN_PERIOD
+
+            if time.monotonic() >= next_report:
+                self.report_sinks()
+                next_report = time.monotonic() + SINK_REPORT_PERIOD
+
+    def declare_channel(self, channel):
+        """
+        Create the csv file of a channel declared by a sensor process, and start draining its sample ring if it has
+        one. If the sensor process was restarted, the ring of the previous process is drained one last time and dropped.
+        """
+        old_ring = self.rings.pop(channel.name, None)
+        if old_ring is not None:
+            self.drain_ring(channel.name, old_ring)
+            old_ring.close()
+
+        writer = self.writers.get(channel.name)
+        if writer is None or writer.channel.header() != channel.header():
+            if writer is not None:
+                self.writerSinks[channel.name].close()
+
+            writer = ChannelWriter(channel, *self.csvConfig)
+            self.writers[channel.name] = writer
+            self.writerSinks[channel.name] = SinkWorker("csv." + channel.name, writer.write, writer.flush,
+                                                        flush_period=CSV_FLUSH_PERIOD, close=writer.close)
+            self.writerSinks[channel.name].start()
+            if channel.name in self.udpChannels:
+                try:
+                    self.datagramSender.declare_channel(channel)
+                except ValueError as e:
+                    self.em.error("{}. Sending {} over TCP instead of UDP".format(e, channel.name),
+                                  "UDP_CHANNEL_" + channel.name)
+                    self.udpChannels.discard(channel.name)
+
+            if channel.name not in self.udpChannels:
+                self.socketHandler.declare_channel(channel)
+
+        if channel.ring is not None:
+            self.rings[channel.name] = SampleRing(channel.row_format(), channel.ring)
+            self.dropped[channel.name] = 0
+
+    def write_sample(self, channel, values):
+        """Write a sample or a SampleBatch to the csv file of its channel and send it to the laptop"""
+        self.writerSinks[channel].put(values)
+        if channel in self.udpChannels:
+            self.datagramSender.send_telemetry(channel, values)
+        else:
+            self.socketHandler.send_telemetry(channel, values)
+
+    def drain_rings(self):
+        for name, ring in self.rings.items():
+            self.drain_ring(name, ring)
+
+        self.datagramSender.flush()
+
+    def drain_ring(self, name, ring):
+        """Write everything waiting in a ring, by batches of at most RING_MAX_BATCH samples"""
         while True:
-            record = self.queue.get()
-            logger = logging.getLogger(record.name)
-            logger.handle(record)
+            data = ring.read(RING_MAX_BATCH)
+            if len(data) == 0:
+                break
+
+            self.write_sample(name, SampleBatch(ring.sample.format, data))
+
+            if len(data) < RING_MAX_BATCH * ring.sample.size:
+                break
+
+        dropped = ring.dropped()
+        if dropped != self.dropped[name]:
+            self.em.warning("{} samples of {} were dropped because the logging process fell behind".format(
+                (dropped - self.dropped[name]) & 0xFFFFFFFF, name), "RING_OVERFLOW_" + name)
+            self.dropped[name] = dropped
+        else:
+            self.em.resolve("Logging process caught up with {}".format(name), "RING_OVERFLOW_" + name, False)
+
+    def report_sinks(self):
+        """Log the metrics of every sink since the last report, and warn if a sink had to drop data"""
+        logger = logging.getLogger(__name__)
+        workers = [h.worker for h in logging.getLogger().handlers if isinstance(h, SinkHandler)]
+        workers.extend(self.writerSinks.values())
+
+        for worker in workers:
+            stats = worker.take_stats()
+            logger.debug("Sink {}: {}, {} waiting".format(worker.sink_name, stats, worker.depth()))
+
+            if stats.dropped != 0:
+                self.em.warning("The {} sink dropped {} items in the last {} s because it fell behind".format(
+                    worker.sink_name, stats.dropped, SINK_REPORT_PERIOD), "SINK_DROP_" + worker.sink_name)
+            else:
+                self.em.resolve("The {} sink caught up".format(worker.sink_name), "SINK_DROP_" + worker.sink_name,
+                                False)
+
+        for name, writer in self.writers.items():
+            write_latency, fsync_latency = writer.writer.take_latencies()
+            logger.debug("Disk csv.{}: writes {}, fsyncs {}".format(name, write_latency, fsync_latency))
+
+        # The socket has its own sender thread and counters
+        sent, dropped = self.socketHandler.sent, self.socketHandler.dropped
+        logger.debug("Sink socket: {} sent, {} dropped, {} waiting".format(sent - self.socketSent,
+                                                                          dropped - self.socketDropped,
+                                                                          self.socketHandler.queued()))
+        if dropped != self.socketDropped:
+            self.em.warning("{} records for the laptop were dropped in the last {} s because the connection is too "
+                            "slow or down".format(dropped - self.socketDropped, SINK_REPORT_PERIOD), "SINK_DROP_socket")
+        else:
+            self.em.resolve("Records for the laptop are not dropped anymore", "SINK_DROP_socket", False)
+        self.socketSent, self.socketDropped = sent, dropped
+
+        raw, link, cpu = self.socketHandler.raw_bytes, self.socketHandler.link_bytes, self.socketHandler.compression_time
+        if raw != self.socketRaw:
+            logger.info("Uplink: {:.1f} kB of frames sent as {:.1f} kB (ratio {:.2f}, level {}), {:.1f} ms of CPU per MB"
+                        .format((raw - self.socketRaw) / 1024, (link - self.socketLink) / 1024,
+                                (raw - self.socketRaw) / max(link - self.socketLink, 1),
+                                self.socketHandler.compression_level,
+                                (cpu - self.socketCompression) * 1000 / ((raw - self.socketRaw) / 1024 / 1024)))
+        self.socketRaw, self.socketLink, self.socketCompression = raw, link, cpu
+
+        sent, dropped = self.datagramSender.sent, self.datagramSender.dropped
+        if sent != self.datagramSent or dropped != self.datagramDropped:
+            logger.debug("Sink datagrams: {} sent, {} could not be sent".format(sent - self.datagramSent,
+                                                                              dropped - self.datagramDropped))
+        self.datagramSent, self.datagramDropped = sent, dropped
+
+        frames, size = self.socketHandler.backlog()
+        if frames != 0:
+            logger.info("Uplink backlog: {} records ({:.1f} MB) waiting to be sent to the laptop, {} sent again so far"
+                        .format(frames, size / 1024 / 1024, self.socketHandler.replayed))
 
 
 def logging_config():
@@ -38,14 +235,20 @@ def logging_config():
     consoleHandler = logging.StreamHandler(sys.stdout)
     consoleHandler.setFormatter(loggingFormat)
     consoleHandler.addFilter(loggingFilter)
-    logger.addHandler(consoleHandler)
+    logger.addHandler(SinkHandler("console", consoleHandler))
 
     # Logging to file. A new file is created each run, with the name being the current date and time
     fileHandler = MakeFileHandler('rpi', 'main')
     fileHandler.setFormatter(loggingFormat)
     fileHandler.addFilter(loggingFilter)
-    logger.addHandler(fileHandler)
+    logger.addHandler(SinkHandler("file", fileHandler))
 
+    # Logs that cannot be sent to the laptop are kept in a file, and sent again once the laptop is back
     RPIConfig = config.get_config('rpi')
-    socketHandler = BufferedSocketHandler(RPIConfig['laptop_ip'], logging.handlers.DEFAULT_TCP_LOGGING_PORT)
-    logger.addHandler(socketHandler)
+    spool = Spool(SPOOL_PATH, RPIConfig.getint('spool_size_mb') * 1024 * 1024)
+    socketHandler = BufferedSocketHandler(RPIConfig['laptop_ip'], logging.handlers.DEFAULT_TCP_LOGGING_PORT, spool,
+                                          RPIConfig.getfloat('spool_replay_kbps') * 1024,
+                                          RPIConfig.getint('link_compression_level'))
+    logger.addHandler(socketHandler)  # Does not need a SinkHandler, as it has its own sender thread
+
+    return socketHandler
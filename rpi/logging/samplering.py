@@ -0,0 +1,135 @@
+import multiprocessing
+import struct
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+# Default number of samples a ring can hold. Must be a power of 2. At 3200 Hz, this is more than 2 s of data.
+RING_CAPACITY = 8192
+
+INDEX_MASK = 0xFFFFFFFF  # The indexes are 32 bits counters
+
+# Lock ordering the accesses to the counters of all the rings with the samples, see SampleRing. It is created when the
+# module is first imported, in the main process, so the logging process and the sensor processes inherit it.
+_counters_lock = multiprocessing.Lock()
+
+
+class SampleRing:
+    """
+    Ring buffer of fixed-size samples in shared memory, with a single writer (a sensor process) and a single reader
+    (the logging listener). Samples are packed with the struct module directly into the shared memory, so they never
+    need to be pickled or copied through a pipe.
+
+    The memory starts with a header of 4 counters: the number of samples written, the number of samples read, the
+    number of samples dropped because the ring was full, and the capacity of the ring. Each counter is only ever written
+    by one of the two sides. The stores to shared memory are not ordered on the ARM cores of the RPi, so the number of
+    samples written and read are only stored and loaded with a lock held. Taking the lock is a memory barrier: a sample
+    is completely written before the reader can see the new count, and a slot is completely read before the writer can
+    reuse it. The lock is taken once per sample by the writer, and twice per batch by the reader, and only held for
+    these accesses. When the reader falls behind, new samples are dropped and counted instead of waiting.
+    """
+
+    WRITTEN = struct.Struct("<I")
+    READ = struct.Struct("<I")
+    DROPPED = struct.Struct("<I")
+    CAPACITY = struct.Struct("<I")
+    WRITTEN_OFFSET = 0
+    READ_OFFSET = 4
+    DROPPED_OFFSET = 8
+    CAPACITY_OFFSET = 12
+    HEADER_SIZE = 16
+
+    def __init__(self, format, name=None, capacity=RING_CAPACITY):
+        """
+        :param format: struct format of a single sample
+        :param name: Name of an existing ring to attach to. If None, a new ring is created.
+        :param capacity: Number of samples the new ring can hold. Ignored when attaching to an existing ring.
+        """
+        self.sample = struct.Struct(format)
+
+        if name is None:
+            if capacity & (capacity - 1) != 0:
+                raise ValueError("The capacity of a ring must be a power of 2, not {}".format(capacity))
+
+            self.shm = SharedMemory(create=True, size=self.HEADER_SIZE + capacity * self.sample.size)
+            self.buf = self.shm.buf
+            self.buf[:self.HEADER_SIZE] = bytes(self.HEADER_SIZE)
+            self.CAPACITY.pack_into(self.buf, self.CAPACITY_OFFSET, capacity)
+        else:
+            self.shm = SharedMemory(name=name)
+            self.buf = self.shm.buf
+
+            # Only the process that created the ring should remove it when it exits. Otherwise, the ring would be
+            # removed twice.
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        self.capacity = self.CAPACITY.unpack_from(self.buf, self.CAPACITY_OFFSET)[0]
+
+        # Each side keeps a copy of the counter it owns, so it only needs to read the other one from the memory
+        with _counters_lock:
+            self.written = self.WRITTEN.unpack_from(self.buf, self.WRITTEN_OFFSET)[0]
+            self.read_count = self.READ.unpack_from(self.buf, self.READ_OFFSET)[0]
+        self.dropped_count = self.DROPPED.unpack_from(self.buf, self.DROPPED_OFFSET)[0]
+        self.read_seen = self.read_count  # Number of samples read, the last time the writer loaded it
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def put(self, *values):
+        """
+        Writer side. Adds a sample to the ring. Returns False if the ring was full, in which case the sample is dropped.
+        """
+        if (self.written - self.read_seen) & INDEX_MASK >= self.capacity:
+            # Looks full, but the reader may have freed slots since the last sample
+            with _counters_lock:
+                self.read_seen = self.READ.unpack_from(self.buf, self.READ_OFFSET)[0]
+            if (self.written - self.read_seen) & INDEX_MASK >= self.capacity:
+                self.dropped_count = (self.dropped_count + 1) & INDEX_MASK
+                self.DROPPED.pack_into(self.buf, self.DROPPED_OFFSET, self.dropped_count)
+                return False
+
+        slot = self.written & (self.capacity - 1)
+        self.sample.pack_into(self.buf, self.HEADER_SIZE + slot * self.sample.size, *values)
+
+        # The lock makes the sample visible before the new count. The number of samples read is loaded at the same
+        # time, for the next sample.
+        self.written = (self.written + 1) & INDEX_MASK
+        with _counters_lock:
+            self.WRITTEN.pack_into(self.buf, self.WRITTEN_OFFSET, self.written)
+            self.read_seen = self.READ.unpack_from(self.buf, self.READ_OFFSET)[0]
+        return True
+
+    def read(self, max_count):
+        """
+        Reader side. Removes up to max_count samples from the ring. Returns the packed samples, from the oldest to the
+        newest, as a single bytes object.
+        """
+        with _counters_lock:
+            written = self.WRITTEN.unpack_from(self.buf, self.WRITTEN_OFFSET)[0]
+        count = min((written - self.read_count) & INDEX_MASK, max_count)
+        if count == 0:
+            return b''
+
+        # The samples can wrap around the end of the ring, in which case they are copied in two parts
+        slot = self.read_count & (self.capacity - 1)
+        first = min(count, self.capacity - slot)
+        start = self.HEADER_SIZE + slot * self.sample.size
+        data = self.buf[start:start + first * self.sample.size].tobytes()
+        if first < count:
+            data += self.buf[self.HEADER_SIZE:self.HEADER_SIZE + (count - first) * self.sample.size].tobytes()
+
+        # The lock makes the slots free for the writer only once they have been copied
+        self.read_count = (self.read_count + count) & INDEX_MASK
+        with _counters_lock:
+            self.READ.pack_into(self.buf, self.READ_OFFSET, self.read_count)
+        return data
+
+    def dropped(self):
+        """Return the number of samples dropped since the ring was created (modulo 2^32)"""
+        return self.DROPPED.unpack_from(self.buf, self.DROPPED_OFFSET)[0]
+
+    def close(self):
+        """Detach from the ring. The ring itself is removed when the process that created it exits."""
+        self.buf.release()
+        self.buf = None
+        self.shm.close()
@@ -0,0 +1,128 @@
+import logging
+import queue
+import threading
+import time
+
+SINK_QUEUE_SIZE = 10000  # Maximum number of items waiting for a sink. Items are dropped past that.
+
+
+class SinkStats:
+    """
+    Metrics of a sink since the last reset. The lag is the time between an item being queued and the sink being done
+    with it.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.handled = 0
+        self.dropped = 0
+        self.lag_total = 0
+        self.lag_max = 0
+
+    def add(self, lag):
+        self.handled += 1
+        self.lag_total += lag
+        self.lag_max = max(self.lag_max, lag)
+
+    def __str__(self):
+        mean = self.lag_total / self.handled * 1000 if self.handled != 0 else 0
+        return "{} handled, {} dropped, lag {:.1f} ms mean, {:.1f} ms max".format(self.handled, self.dropped, mean,
+                                                                                  self.lag_max * 1000)
+
+
+class SinkWorker(threading.Thread):
+    """
+    Thread feeding a single sink (a file, the console, the socket...) from its own bounded queue, so a slow or stalled
+    sink does not hold up the others. When the queue is full, new items are dropped and counted instead of blocking the
+    listener.
+    """
+
+    def __init__(self, name, target, flush=None, maxsize=SINK_QUEUE_SIZE, flush_period=None, close=None):
+        """
+        :param name: Name of the sink, for the metrics
+        :param target: Function called with each item
+        :param flush: Optional. Function called when the queue becomes empty
+        :param maxsize: Maximum number of items in the queue
+        :param flush_period: Optional. flush is also called after this many seconds without any item.
+        :param close: Optional. Function called when the worker stops, after the last flush.
+        """
+        super().__init__(name="sink-" + name, daemon=True)
+        self.sink_name = name
+        self.target = target
+        self.flush = flush
+        self.flush_period = flush_period
+        self.close_sink = close
+        self.queue = queue.Queue(maxsize)
+
+        self.stats_lock = threading.Lock()
+        self.stats = SinkStats()
+
+    def put(self, item):
+        """Queue an item for the sink. Returns False if the queue was full, in which case the item is dropped."""
+        try:
+            self.queue.put_nowait((time.monotonic(), item))
+            return True
+        except queue.Full:
+            with self.stats_lock:
+                self.stats.dropped += 1
+            return False
+
+    def close(self):
+        """Stop the worker once everything already queued is handled"""
+        self.queue.put((time.monotonic(), None))
+
+    def run(self):
+        logger = logging.getLogger(__name__)
+        while True:
+            try:
+                queued, item = self.queue.get(timeout=self.flush_period)
+            except queue.Empty:
+                self.flush()
+                continue
+
+            if item is None:
+                break
+
+            try:
+                self.target(item)
+            except Exception:
+                logger.exception("Error in the {} sink".format(self.sink_name))
+
+            with self.stats_lock:
+                self.stats.add(time.monotonic() - queued)
+
+            if self.flush is not None and self.queue.empty():
+                self.flush()
+
+        if self.flush is not None:
+            self.flush()
+        if self.close_sink is not None:
+            self.close_sink()
+
+    def depth(self):
+        """Return the number of items waiting"""
+        return self.queue.qsize()
+
+    def take_stats(self):
+        """Return the metrics since the last call, and start new ones"""
+        with self.stats_lock:
+            stats = self.stats
+            self.stats = SinkStats()
+        return stats
+
+
+class SinkHandler(logging.Handler):
+    """
+    Handler passing the records to another handler, through a SinkWorker
+    """
+
+    def __init__(self, name, handler):
+        super().__init__()
+        self.handler = handler
+        self.worker = SinkWorker(name, handler.handle)
+        self.worker.start()
+
+    def emit(self, record):
+        self.worker.put(record)
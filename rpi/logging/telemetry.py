@@ -0,0 +1,106 @@
+import os
+import struct
+import time
+
+from shared.customlogging.columnar import ColumnarWriter
+from shared.customlogging.csvwriter import BufferedCSVWriter
+from shared.customlogging.handler import make_log_path
+from shared.customlogging.manifest import add_segment
+from shared.customlogging.samplebatch import SampleBatch
+from shared.customlogging.spectrum import SpectrumRecord
+
+# Queue of the logging process. The sensor data is put on it directly, without going through the logging module.
+_queue = None
+
+
+def setup(queue):
+    """
+    Set the queue of the logging process where the telemetry is sent. Must be called in the main process, before
+    starting the other processes, so they inherit it.
+    """
+    global _queue
+    _queue = queue
+
+
+def send(item):
+    """Send a Channel or a Sample to the logging process"""
+    _queue.put(item)
+
+
+class ChannelWriter:
+    """
+    Writes the samples of a channel to its files, in the logging process. Channels with a format are written to
+    columnar files if columnar is True (see shared.customlogging.columnar), the others always go to csv files. See
+    BufferedCSVWriter for the other parameters.
+
+    The data is split in segments: a new file is started once the current one reaches segment_bytes, or once it was
+    started segment_ms ago. Each complete segment is added to the manifest of the folder (see
+    shared.customlogging.manifest), with the time it covers.
+    """
+
+    def __init__(self, channel, flush_bytes, flush_ms, fsync_ms, columnar=False, segment_bytes=64 * 1024 * 1024,
+                 segment_ms=300000):
+        self.channel = channel
+        self.columnar = columnar and channel.format is not None
+        self.csvConfig = (flush_bytes, flush_ms, fsync_ms)
+        self.segment_bytes = segment_bytes
+        self.segment_delay = segment_ms / 1000
+
+        self.segment = 0
+        self.writer = None
+        self.__open_segment()
+
+    def __open_segment(self):
+        flush_bytes, flush_ms, fsync_ms = self.csvConfig
+        if self.columnar:
+            path = make_log_path('rpi', 'sensor', self.channel.name, 'col', self.segment)
+            writer = ColumnarWriter(path, self.channel, flush_ms, fsync_ms)
+        else:
+            path = make_log_path('rpi', 'sensor', self.channel.name, 'csv', self.segment)
+            writer = BufferedCSVWriter(path, flush_bytes, flush_ms, fsync_ms)
+            writer.write_message(self.channel.header())
+
+        if self.writer is not None:
+            # Keep the metrics of the previous segments, until the next report
+            writer.write_latency, writer.fsync_latency = self.writer.write_latency, self.writer.fsync_latency
+
+        self.writer = writer
+        self.segment += 1
+        self.opened = time.monotonic()
+        self.offset = writer.tell()  # Where the samples start
+        self.first = None  # Timestamps of the first and last samples of the segment, in ms
+        self.last = None
+        self.rows = 0
+
+    def __close_segment(self):
+        self.writer.close()
+        add_segment(os.path.dirname(self.writer.path), os.path.basename(self.writer.path), self.first, self.last,
+                    self.rows, self.offset, os.path.getsize(self.writer.path))
+
+    def write(self, values):
+        """Write a sample (row or SpectrumRecord) or a SampleBatch"""
+        if self.writer.tell() >= self.segment_bytes or time.monotonic() - self.opened >= self.segment_delay:
+            self.__close_segment()
+            self.__open_segment()
+
+        if isinstance(values, SampleBatch):
+            if len(values.data) == 0:
+                return
+            first, last, rows = struct.unpack_from(values.format, values.data)[0], values.last()[0], len(values)
+        elif isinstance(values, SpectrumRecord):
+            first, last, rows = values.timestamp, values.timestamp, 1
+        else:
+            first, last, rows = values[0], values[0], 1
+
+        self.writer.write_message(values)
+        if self.first is None:
+            self.first = first
+        self.last = last
+        self.rows += rows
+
+    def flush(self):
+        """Write the buffered samples to the file if they waited long enough"""
+        self.writer.flush_if_due()
+
+    def close(self):
+        self.__close_segment()
@@ -11,17 +11,8 @@ class MotorControl:
         self.teensy = Teensy()
         self.em = ErrorManager(__name__)
 
-    def __start_motor(self, motor_number, motor_direction):
+    def __wait_motor(self, motor_number):
         logger = logging.getLogger(__name__)
-        logger.debug("Starting motor {}".format(motor_number + 1))
-        try:
-            self.teensy.activate_motor(motor_number, motor_direction)
-            self.em.resolve("Started motor {}".format(motor_number + 1), f"motor_{motor_number}_start")
-        except:
-            self.em.error("Could not send start motor {} command to Teensy".format(motor_number + 1),
-                          f"motor_{motor_number}_start")
-            return
-
         try:
             status = 0b11
             while (status >> 1) == 1:  # Wait here until the motor stops running
@@ -47,4 +38,18 @@ class MotorControl:
             self.em.error("Could not retrieve motor state from the Teensy", f"motor_state")
 
     def start_motor(self, motor_number, motor_direction):
-        threading.Thread(target=self.__start_motor, args=(motor_number, motor_direction)).start()
+        """
+        Send the start command to the Teensy, and watch the motor until it stops in another thread. Returns True if the
+        command could be sent.
+        """
+        logging.getLogger(__name__).debug("Starting motor {}".format(motor_number + 1))
+        try:
+            self.teensy.activate_motor(motor_number, motor_direction)
+            self.em.resolve("Started motor {}".format(motor_number + 1), f"motor_{motor_number}_start")
+        except:
+            self.em.error("Could not send start motor {} command to Teensy".format(motor_number + 1),
+                          f"motor_{motor_number}_start")
+            return False
+
+        threading.Thread(target=self.__wait_motor, args=(motor_number,)).start()
+        return True
@@ -1,14 +1,78 @@
+import json
 import logging.handlers
-import pickle
-import struct
+import socket
+import threading
+import time
+import zlib
 from collections import deque
 
+import shared.network.frames as frames
+from shared.network.frames import channel_id, log_frame, schema_frame, telemetry_frame
+from shared.telemetry import Channel, Sample
+
+SEND_BUFFER_SIZE = 5000  # Maximum number of records waiting to be sent. The oldest ones are dropped past that.
+SEND_BATCH_BYTES = 64 * 1024  # Records are sent together until they reach about this size
+RECONNECT_DELAY_MIN = 0.5  # Seconds to wait before reconnecting after the first failure
+RECONNECT_DELAY_MAX = 30  # The delay doubles after each failure, up to this
+REPLAY_PERIOD = 0.1  # Seconds between two replays of spooled records when there is no live record to send
+HEARTBEAT_PERIOD = 1  # Seconds without sending anything after which a heartbeat is sent, so the laptop knows we are alive
+NEGOTIATION_TIMEOUT = 2  # Seconds to wait for the laptop to answer the HELLO frame, before sending uncompressed
+
 
 class BufferedSocketHandler(logging.handlers.SocketHandler):
-    def __init__(self, host, port):
+    """
+    SocketHandler that never blocks the caller. Records and sensor data are put in a bounded buffer, and a dedicated
+    thread encodes them as binary frames (see shared.network.frames) and sends them in batches. If the buffer is full,
+    the oldest records are dropped.
+
+    When the laptop cannot be reached, the thread tries to reconnect with an increasing delay. Meanwhile, if a spool is
+    given, the records are moved to it instead of accumulating in memory. Once reconnected, the spooled records are
+    replayed at a limited rate, alongside the live ones, so the link is not saturated by the backlog.
+
+    If the connection breaks in the middle of a batch, the whole batch is spooled and sent again, so a few records can
+    be received twice.
+
+    A heartbeat is sent when nothing else was sent for a while, so the laptop can detect a dead connection quickly.
+
+    If a compression level is given, the batches are compressed with zlib when the laptop accepts it. The compression
+    is negotiated again on each connection.
+    """
+
+    def __init__(self, host, port, spool=None, replay_rate=None, compression_level=0):
+        """
+        :param spool: Optional. Spool where the records are kept while the laptop cannot be reached
+        :param replay_rate: Maximum rate at which the spooled records are sent again, in bytes per second
+        :param compression_level: zlib level (1 to 9) of the compression to propose to the laptop. 0 to disable.
+        """
         super().__init__(host, port)
 
-        self.buffer = deque(maxlen=1000)  # TODO: Review if this maximum length is the ideal one
+        self.buffer = deque(maxlen=SEND_BUFFER_SIZE)
+        self.condition = threading.Condition()
+        self.closing = False
+        self.channels = dict()  # Declared telemetry channels, by name. The values are tuples (id, channel).
+
+        self.spool = spool
+        self.replay_rate = replay_rate
+        self.replay_budget = 0  # Number of bytes that can be replayed right now
+        self.replay_updated = time.monotonic()
+
+        self.retry_at = 0  # time.monotonic() of the next connection attempt
+        self.retry_delay = RECONNECT_DELAY_MIN
+
+        self.compression_level = compression_level
+        self.compressor = None  # zlib stream of the current connection, if the laptop accepted the compression
+        self.last_sent = time.monotonic()
+
+        # Counters since the start, for the metrics
+        self.sent = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.raw_bytes = 0  # Size of the frames, before compression
+        self.link_bytes = 0  # Size of what was actually sent
+        self.compression_time = 0  # CPU time spent compressing, in seconds
+
+        self.sender = threading.Thread(target=self.__send_forever, name="socket-sender", daemon=True)
+        self.sender.start()
 
     def emit(self, record):
         """
@@ -17,34 +81,196 @@ class BufferedSocketHandler(logging.handlers.SocketHandler):
         is not desired in our case, we will use a queue that will act as a buffer if
         the message is not sent
         """
-        self.buffer.append(record)
-        while len(self.buffer) != 0:
-            nextRecord = self.buffer.popleft()
+        with self.condition:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(record)
+            self.condition.notify()
+
+    def declare_channel(self, channel):
+        """Declare a telemetry channel. Its schema is sent to the laptop before its data, and after each reconnection."""
+        with self.condition:
+            self.channels[channel.name] = (channel_id(channel), channel)
+            self.buffer.append(channel)
+            self.condition.notify()
+
+    def send_telemetry(self, channel, msg):
+        """Send sensor data (a row, a SampleBatch or a SpectrumRecord) of a declared channel to the laptop"""
+        with self.condition:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(Sample(channel, msg))
+            self.condition.notify()
 
-            super().emit(nextRecord)
+    def queued(self):
+        """Return the number of records waiting to be sent, in memory"""
+        return len(self.buffer)
 
-            if self.sock is None:  # If we failed to send the record
-                self.buffer.appendleft(nextRecord)
-                break
+    def backlog(self):
+        """Return the number of records and of bytes waiting in the spool"""
+        if self.spool is None:
+            return 0, 0
+        return self.spool.frames, self.spool.used
 
-    def makePickle(self, record):
+    def __next_batch(self, timeout):
         """
-        The following code is copied from the SocketHandler implementation.
-        One line is changed to prevent all messages from being converted to strings.
+        Wait up to timeout seconds (None for no limit) for records and remove a batch of them from the buffer. Returns
+        a list of frames, which is empty if nothing arrived in time.
         """
-        ei = record.exc_info
-        if ei:
-            # just to get traceback text into record.exc_text ...
-            dummy = self.format(record)
-        # See issue #14436: If msg or args are objects, they may not be
-        # available on the receiving end. So we convert the msg % args
-        # to a string, save it as msg and zap the args.
-        d = dict(record.__dict__)
-        d['msg'] = record.msg  # This line has been changed
-        d['args'] = None
-        d['exc_info'] = None
-        # Issue #25685: delete 'message' if present: redundant with 'msg'
-        d.pop('message', None)
-        s = pickle.dumps(d, 1)
-        slen = struct.pack(">L", len(s))
-        return slen + s
+        with self.condition:
+            if len(self.buffer) == 0 and not self.closing:
+                self.condition.wait(timeout)
+
+            batch = []
+            size = 0
+            while len(self.buffer) != 0 and size < SEND_BATCH_BYTES:
+                item = self.buffer.popleft()
+                try:
+                    if isinstance(item, Sample):
+                        data = telemetry_frame(self.channels[item.channel][0], item.values)
+                    elif isinstance(item, Channel):
+                        data = schema_frame(item)
+                    else:
+                        data = log_frame(item)
+                except Exception:
+                    logging.getLogger(__name__).exception("Could not encode {} for the laptop".format(item))
+                    continue
+
+                batch.append(data)
+                size += len(data)
+
+            return batch
+
+    def __connected(self):
+        """Return True if there is a connection to the laptop, trying to make one if the delay since the last try passed"""
+        if self.sock is None and time.monotonic() >= self.retry_at:
+            try:
+                self.sock = self.makeSocket()
+                self.retry_delay = RECONNECT_DELAY_MIN
+                self.compressor = self.__negotiate()
+
+                # The laptop needs the schema of every channel to decode their data
+                with self.condition:
+                    schemas = [schema_frame(channel) for _, channel in self.channels.values()]
+                self.__send(b''.join(schemas))
+            except OSError:
+                self.__disconnected()
+
+        return self.sock is not None
+
+    def __negotiate(self):
+        """Propose the compression to the laptop. Returns the compressor to use, or None to send uncompressed."""
+        if self.compression_level == 0:
+            return None
+
+        self.sock.sendall(frames.hello_frame(['zlib']))
+
+        # An older laptop does not answer, so it is only waited for a limited time
+        timeout = self.sock.gettimeout()
+        self.sock.settimeout(NEGOTIATION_TIMEOUT)
+        try:
+            version, frame_type, length = frames.HEADER.unpack(self.__receive(frames.HEADER.size))
+            answer = json.loads(self.__receive(length)) if frame_type == frames.ACK else dict()
+        except (socket.timeout, ValueError):  # socket.timeout is only an alias of TimeoutError since Python 3.10
+            answer = dict()
+
+        self.sock.settimeout(timeout)
+        if answer.get('compression') == 'zlib':
+            return frames.make_compressor(self.compression_level)
+        return None
+
+    def __receive(self, size):
+        """Read exactly size bytes from the laptop"""
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if len(chunk) == 0:
+                raise ConnectionResetError("The laptop closed the connection")
+            data += chunk
+        return data
+
+    def __send(self, data):
+        """Send frames to the laptop, compressing them if the compression was accepted"""
+        if len(data) == 0:
+            return
+
+        if self.compressor is not None:
+            start = time.thread_time()
+            payload = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.compression_time += time.thread_time() - start
+            packet = frames.make_frame(frames.COMPRESSED, payload)
+        else:
+            packet = data
+
+        self.sock.sendall(packet)
+        self.last_sent = time.monotonic()
+        self.raw_bytes += len(data)
+        self.link_bytes += len(packet)
+
+    def __disconnected(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+        self.retry_at = time.monotonic() + self.retry_delay
+        self.retry_delay = min(self.retry_delay * 2, RECONNECT_DELAY_MAX)
+
+    def __keep(self, batch):
+        """Keep a batch that could not be sent, in the spool if there is one"""
+        if self.spool is not None:
+            self.spool.append(batch)
+        else:
+            self.dropped += len(batch)
+
+    def __replay(self):
+        """Send the oldest spooled records, within the replay rate"""
+        now = time.monotonic()
+        self.replay_budget = min(self.replay_budget + (now - self.replay_updated) * self.replay_rate,
+                                 max(self.replay_rate, SEND_BATCH_BYTES))
+        self.replay_updated = now
+
+        while self.spool.frames != 0 and self.replay_budget > 0:
+            data, count, size = self.spool.peek(min(self.replay_budget, SEND_BATCH_BYTES))
+            self.__send(data)
+            self.spool.consume(size, count)
+            self.replay_budget -= len(data)
+            self.replayed += count
+
+    def __timeout(self):
+        """Return how long to wait for new records before there is something else to do"""
+        if self.sock is None:
+            if self.spool is None or self.spool.frames == 0:
+                return None
+            return max(self.retry_at - time.monotonic(), 0)
+        elif self.spool is not None and self.spool.frames != 0:
+            return REPLAY_PERIOD
+        return max(self.last_sent + HEARTBEAT_PERIOD - time.monotonic(), 0)
+
+    def __send_forever(self):
+        while not self.closing:
+            batch = self.__next_batch(self.__timeout())
+
+            if not self.__connected():
+                self.__keep(batch)
+                continue
+
+            try:
+                if len(batch) != 0:
+                    self.__send(b''.join(batch))
+                    self.sent += len(batch)
+                    batch = []
+
+                if self.spool is not None:
+                    self.__replay()
+
+                if time.monotonic() - self.last_sent >= HEARTBEAT_PERIOD:
+                    self.__send(frames.make_frame(frames.HEARTBEAT, b''))
+            except OSError:
+                self.__disconnected()
+                self.__keep(batch)
+
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        super().close()
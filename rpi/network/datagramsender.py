@@ -0,0 +1,96 @@
+import random
+import socket
+import struct
+import time
+
+from shared.customlogging.samplebatch import SampleBatch
+from shared.customlogging.spectrum import SpectrumRecord
+from shared.network.frames import (CHANNEL_ID, DATAGRAM_HEADER, HEADER, MAX_DATAGRAM_SIZE, VERSION, channel_id,
+                                   schema_frame, telemetry_frame)
+
+SCHEMA_PERIOD = 1  # Seconds between two sendings of the schemas, so the laptop can decode the data after a loss
+
+
+class DatagramSender:
+    """
+    Sends the data of loss-tolerant telemetry channels to the laptop in UDP datagrams, so a lost packet only loses its
+    own samples instead of holding back everything sent after it, like on the TCP connection. The frames are grouped
+    in datagrams of at most MAX_DATAGRAM_SIZE bytes, each one with a sequence number so the laptop can count the lost
+    ones. The schemas of the channels are sent again every SCHEMA_PERIOD.
+
+    Nothing is kept if the laptop cannot be reached: the data of those channels is only in the csv files of the RPi.
+    Spectrum channels are refused: a capture is far bigger than a datagram, and losing any part of it would lose all of
+    it. Not thread-safe. It is meant to be used by the logging process only.
+    """
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+        self.session = random.getrandbits(32)
+        self.sequence = 0
+        self.channels = dict()  # Tuples (id, schema frame) of the declared channels, by name
+        self.next_schemas = 0  # time.monotonic() when the schemas must be sent again
+
+        self.frames = []  # Frames waiting for the next flush
+        self.sent = 0  # Counters since the start, for the metrics
+        self.dropped = 0
+
+    def declare_channel(self, channel):
+        """Declare a channel whose data will be sent. Raises a ValueError if its data cannot be sent in datagrams."""
+        if channel.header() == SpectrumRecord.CSV_HEADER:
+            raise ValueError("The captures of {} do not fit in a datagram".format(channel.name))
+
+        self.channels[channel.name] = (channel_id(channel), schema_frame(channel))
+        self.next_schemas = 0
+
+    def send_telemetry(self, channel, msg):
+        """Queue sensor data (a row or a SampleBatch) of a declared channel, until the next flush"""
+        id = self.channels[channel][0]
+        if isinstance(msg, SampleBatch):
+            # Split the batch so each part fits in a datagram
+            row_size = struct.calcsize(msg.format)
+            rows = max((MAX_DATAGRAM_SIZE - DATAGRAM_HEADER.size - HEADER.size - CHANNEL_ID.size) // row_size, 1)
+            size = rows * row_size
+            for start in range(0, len(msg.data), size):
+                self.frames.append(telemetry_frame(id, SampleBatch(msg.format, msg.data[start:start + size])))
+        else:
+            self.frames.append(telemetry_frame(id, msg))
+
+    def flush(self):
+        """Send the queued frames, and the schemas if it is time to"""
+        if time.monotonic() >= self.next_schemas:
+            self.__send_frames([schema for _, schema in self.channels.values()])
+            self.next_schemas = time.monotonic() + SCHEMA_PERIOD
+
+        self.__send_frames(self.frames)
+        self.frames = []
+
+    def __send_frames(self, frames):
+        datagram = []
+        size = DATAGRAM_HEADER.size
+        for frame in frames:
+            if len(datagram) != 0 and size + len(frame) > MAX_DATAGRAM_SIZE:
+                self.__send_datagram(datagram)
+                datagram = []
+                size = DATAGRAM_HEADER.size
+
+            datagram.append(frame)
+            size += len(frame)
+
+        if len(datagram) != 0:
+            self.__send_datagram(datagram)
+
+    def __send_datagram(self, frames):
+        data = DATAGRAM_HEADER.pack(VERSION, self.session, self.sequence) + b''.join(frames)
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        try:
+            self.sock.sendto(data, self.address)
+            self.sent += 1
+        except OSError:
+            # The send buffer is full or the network is unreachable. The laptop counts it as lost.
+            self.dropped += 1
+
+    def close(self):
+        self.sock.close()
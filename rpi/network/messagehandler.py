@@ -1,9 +1,10 @@
-import json
 import logging
 import logging.handlers
+import time
 
 from rpi.motor import MotorControl
 from rpi.led import LEDs
+from shared.network.commands import CommandError
 from shared.network.requesttypes import RequestTypes
 
 
@@ -12,20 +13,27 @@ class MessageHandler:
         self.motor_control = MotorControl()
         self.leds = LEDs()
 
-    def process_message(self, json_string, client_adr):
+    def process_message(self, data, client_adr):
+        """
+        Execute a request from the laptop, and return its result. Raises a CommandError if the request cannot be
+        executed.
+        """
         logger = logging.getLogger(__name__)
 
         try:
-            data = json.loads(json_string)
-        except json.JSONDecodeError:
-            logger.error("Cannot decode JSON string")
-            return
+            request_type = data['type']
+            if request_type == RequestTypes.PING:
+                logger.debug("Received a ping from {}".format(client_adr[0]))
+                return {'time': time.time() * 1000}
+            elif request_type == RequestTypes.CONTROLMOTOR:
+                if not self.motor_control.start_motor(data['motorNumber'], data['motorDirection']):
+                    raise CommandError("Could not send the command of motor {} to the Teensy".format(
+                        data['motorNumber'] + 1))
+                return {'motorNumber': data['motorNumber'], 'started': True}
+            elif request_type == RequestTypes.CONTROLLED:
+                self.leds.activate_led(data['ledNumber'])
+                return {'ledNumber': data['ledNumber'], 'started': True}
+        except KeyError as e:
+            raise CommandError("Missing field {} in the request".format(e))
 
-        if data['type'] == RequestTypes.PING:
-            logger.debug("Received a ping from {}".format(client_adr[0]))
-        elif data['type'] == RequestTypes.CONTROLMOTOR:
-            self.motor_control.start_motor(data['motorNumber'], data['motorDirection'])
-        elif data['type'] == RequestTypes.CONTROLLED:
-            self.leds.activate_led(data['ledNumber'])
-        else:
-            logger.error("Received an unknown message type")
+        raise CommandError("Unknown request type {}".format(request_type))
@@ -1,90 +1,65 @@
 import logging
 import multiprocessing
-import select
+import socket
 import socketserver
-import struct
 
 import shared.config as config
+import shared.network.commands as commands
 from rpi.network.messagehandler import MessageHandler
 
-
-class NetworkError(Exception):
-    pass
-
-
-class NetworkReadingTimeoutError(Exception):
-    pass
-
-
-class NetworkWritingTimeoutError(Exception):
-    pass
-
-
 message_handler = None
 
 
 class RequestHandler(socketserver.StreamRequestHandler):
     """
-    Handles an incoming request. It expects the request to have a header of type
-    unsigned long indicating the size of the following body. Body should be in JSON with
-    utf-8 encoding. If the message can successfully be parsed (but not necessarily processed),
-    a "OK" will be sent back to the client. If there is an error while parsing the message,
-    the connection will be closed without anything being sent.
-    """
-
-    def read_chunk(self, size):
-        buf = b""
+    Handles a command connection from the laptop (see shared.network.commands). The connection stays open, and the
+    requests are executed in the order they arrive. Each one gets a response with its id and the result of the
+    command, or the error that prevented its execution.
 
-        while len(buf) != size:
-            read, _, _ = select.select([self.request], [], [],
-                                       1)  # Make sure we can read from client. If not, we wait up to 1 sec before timing out
-
-            if len(read) == 0:
-                raise NetworkReadingTimeoutError()
+    A request without id is handled like before: "OK" is sent back once the message is parsed, and the connection is
+    closed.
+    """
 
-            data = read[0].recv(size - len(buf))
-            if not data:
-                raise NetworkError()
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-            buf += data
+    def handle(self):
+        logger = logging.getLogger(__name__)
+        logger.debug("Command connection from {}".format(self.client_address))
 
-        return buf
+        while True:
+            try:
+                message = commands.read(self.rfile)
+            except (OSError, ValueError) as e:
+                logger.error("Error while reading from client. Is the message in the correct format? {}".format(e))
+                break
 
-    def send_data(self, data):
-        _, write, _ = select.select([], [self.request], [],
-                                    1)  # Make sure we can write to client. If not, we wait up to 1 sec before timing out
+            if message is None:
+                break
 
-        if len(write) == 0:
-            raise NetworkWritingTimeoutError()
+            logger.debug("Received {} from {}".format(message, self.client_address))
 
-        write[0].sendall(data)
+            if 'id' not in message:
+                self.wfile.write("OK".encode("utf-8"))
+                self.execute(message)
+                break
 
-    def handle(self):
-        logger = logging.getLogger(__name__)
+            try:
+                self.wfile.write(commands.encode(self.execute(message)))
+            except OSError:
+                logger.error("Error while writing to client")
+                break
 
-        self.request.setblocking(0)
+    def execute(self, message):
+        """Execute a command, and return its response"""
         try:
-            header = self.read_chunk(struct.calcsize("L"))
-            bodySize = struct.unpack("!L", header)[0]
-            body = self.read_chunk(bodySize).decode("utf-8")
-
-            logger.debug("Received {} from {}".format(body, self.client_address))
-
-            self.send_data("OK".encode("utf-8"))
-        except NetworkReadingTimeoutError:
-            logger.error("Timed out while reading from client")
-        except NetworkWritingTimeoutError:
-            logger.error("Timed out while writing to client")
-        except NetworkError:
-            logger.error("Error while reading from client. Is the message in the correct format?")
-        except:
-            logger.exception("Major error while handling client connection")
-        else:
-            try:
-                # noinspection PyUnresolvedReferences
-                message_handler.process_message(body, self.client_address)
-            except Exception as e:
-                logger.error(f"Error processing client message: {e}")
+            # noinspection PyUnresolvedReferences
+            return commands.response(message.get('id'), message_handler.process_message(message, self.client_address))
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Error processing client message: {e}")
+            return commands.error_response(message.get('id'), e)
 
 
 class Server(multiprocessing.Process):
@@ -97,9 +72,10 @@ class Server(multiprocessing.Process):
         logger.info("Starting server and listening to incoming connections")
 
         RPIConfig = config.get_config('rpi')
-        socketserver.TCPServer.allow_reuse_address = True
-        with socketserver.TCPServer((RPIConfig['rpi_listening_ip'], RPIConfig.getint('rpi_port')),
-                                    RequestHandler) as server:
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        socketserver.ThreadingTCPServer.daemon_threads = True
+        with socketserver.ThreadingTCPServer((RPIConfig['rpi_listening_ip'], RPIConfig.getint('rpi_port')),
+                                             RequestHandler) as server:
             global message_handler
             message_handler = MessageHandler()
             server.serve_forever()
@@ -0,0 +1,117 @@
+import mmap
+import os
+import struct
+
+SPOOL_MAGIC = b'CRGXSPL2'
+
+
+class Spool:
+    """
+    Circular buffer of frames (bytes) in a memory-mapped file. Each frame is stored after its length, as a 32 bits
+    integer. The file has a fixed size, so the disk usage is bounded: when it is full, the oldest frames are
+    overwritten. The position of the frames is kept in the header of the file, so frames that were not replayed survive
+    a restart.
+
+    Not thread-safe. It is meant to be used by a single thread.
+    """
+
+    HEADER = struct.Struct("<8sQQQQQQ")  # Magic, capacity, head, tail, used bytes, frames, overwritten frames
+    HEADER_SIZE = mmap.PAGESIZE
+    LENGTH = struct.Struct(">L")
+
+    def __init__(self, path, capacity):
+        """
+        :param path: Path of the spool file. Created if it does not exist.
+        :param capacity: Number of bytes of frames the spool can hold
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'a+b')
+        self.file.truncate(self.HEADER_SIZE + capacity)
+        self.map = mmap.mmap(self.file.fileno(), self.HEADER_SIZE + capacity)
+
+        magic, old_capacity, *positions = self.HEADER.unpack_from(self.map, 0)
+        if magic == SPOOL_MAGIC and old_capacity == capacity:
+            self.head, self.tail, self.used, self.frames, self.overwritten = positions
+        else:
+            self.head = self.tail = self.used = self.frames = self.overwritten = 0
+        self.capacity = capacity
+        self.__save()
+
+    def __save(self):
+        self.HEADER.pack_into(self.map, 0, SPOOL_MAGIC, self.capacity, self.head, self.tail, self.used, self.frames,
+                              self.overwritten)
+
+    def __write(self, offset, data):
+        """Write data at an offset of the circular area, wrapping around its end"""
+        first = min(len(data), self.capacity - offset)
+        self.map[self.HEADER_SIZE + offset:self.HEADER_SIZE + offset + first] = data[:first]
+        if first < len(data):
+            self.map[self.HEADER_SIZE:self.HEADER_SIZE + len(data) - first] = data[first:]
+
+    def __read(self, offset, size):
+        """Read size bytes at an offset of the circular area, wrapping around its end"""
+        first = min(size, self.capacity - offset)
+        data = self.map[self.HEADER_SIZE + offset:self.HEADER_SIZE + offset + first]
+        if first < size:
+            data += self.map[self.HEADER_SIZE:self.HEADER_SIZE + size - first]
+        return data
+
+    def __frame_size(self, offset):
+        return self.LENGTH.size + self.LENGTH.unpack(self.__read(offset, self.LENGTH.size))[0]
+
+    def append(self, frames):
+        """
+        Add frames (a list of bytes) at the end of the spool, overwriting the oldest ones if there is not enough room.
+        Frames bigger than the whole spool are dropped.
+        """
+        for frame in frames:
+            frame = self.LENGTH.pack(len(frame)) + frame
+            if len(frame) > self.capacity:
+                self.overwritten += 1
+                continue
+
+            while self.capacity - self.used < len(frame):
+                size = self.__frame_size(self.head)
+                self.head = (self.head + size) % self.capacity
+                self.used -= size
+                self.frames -= 1
+                self.overwritten += 1
+
+            self.__write(self.tail, frame)
+            self.tail = (self.tail + len(frame)) % self.capacity
+            self.used += len(frame)
+            self.frames += 1
+
+        self.__save()
+
+    def peek(self, max_bytes):
+        """
+        Return the oldest frames, joined together, without removing them. At least one frame is returned if the spool
+        is not empty, and more as long as they fit in max_bytes. Returns a tuple (data, number of frames, size taken
+        in the spool by those frames).
+        """
+        frames = []
+        size = 0
+        offset = self.head
+        while len(frames) < self.frames:
+            frame_size = self.__frame_size(offset)
+            if len(frames) != 0 and size + frame_size > max_bytes:
+                break
+
+            frames.append(self.__read((offset + self.LENGTH.size) % self.capacity, frame_size - self.LENGTH.size))
+            size += frame_size
+            offset = (offset + frame_size) % self.capacity
+
+        return b''.join(frames), len(frames), size
+
+    def consume(self, size, count):
+        """Remove the frames returned by peek(), once they were sent. size and count are the ones returned by peek()"""
+        self.head = (self.head + size) % self.capacity
+        self.used -= size
+        self.frames -= count
+        self.__save()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
@@ -1,8 +1,9 @@
+import struct
 import time
 
-import spidev
-
-from rpi.sensors.sensorlogging import SensorLogging
+from rpi.hardware import GPIO, spidev
+from rpi.sensors.gpioedge import EdgeWaiter
+from rpi.sensors.sensorlogging import SensorLogging, interpolate_timestamps
 from shared.customlogging.errormanager import ErrorManager
 
 
@@ -18,6 +19,9 @@ DATA_FORMAT = 0x31  # clear bit d6 for 4 wire, set for 3 wire
 BW_RATE = 0x2C  # date and power mode control
 POWER_CTL = 0x2D  # power saving features control
 FIFO_CTL = 0x38  # FIFO mode select
+FIFO_STATUS = 0x39  # FIFO entries and trigger status
+INT_ENABLE = 0x2E  # interrupt enable control
+INT_MAP = 0x2F  # interrupt mapping control, bit cleared sends the interrupt to INT1
 INT_SOURCE = 0x30
 
 DATA_X0 = 0x32  # x-axis data0
@@ -34,6 +38,9 @@ SPIBus = 0
 SPIDevice = 0  # vib on 1, acc on 0
 CSHIGH = False  # cs pin low at start of transmission
 
+# GPIO (BCM numbering) connected to the INT1 output of the sensor
+INT1Pin = 6
+
 # Data Range
 RANGE_2G = 0b00  # full resolution (10bits) , left-justified MSB mode, +/- 2g
 RANGE_4G = 0b01  # full resolution (11bits), MSB mode, +/- 4g
@@ -44,14 +51,30 @@ SELF_TEST = 0b10001111  # full resolution (13bits) MSB mode, +/-16g
 
 # register values
 MEASURE_MODE = 0b00001000  # set device to measure mode (D3)
-BW_OUTPUT_RATE = 0x0B  # normal operation, 3200Hz output rate, 1600Hz bandwidth
-FIFO_MODE = 0b10000001  # stream mode, INT1 triggered, 31bit buffer
+BW_OUTPUT_RATE = 0x0F  # normal operation, 3200Hz output rate, 1600Hz bandwidth
+OUTPUT_RATE_HZ = 3200
+FIFO_WATERMARK = 16  # number of samples in the FIFO that raises the watermark interrupt. FIFO holds 32 samples
+FIFO_MODE = 0b10000000 | FIFO_WATERMARK  # stream mode, trigger on INT1, watermark in the 5 lowest bits
 FIFO_BYPASS = 0b00000000
+FIFO_ENTRIES_MASK = 0b00111111  # number of samples stored in the FIFO, in FIFO_STATUS
+INT_WATERMARK = 0b00000010  # watermark interrupt bit, in INT_ENABLE, INT_MAP and INT_SOURCE
+INT_MAP_ALL_INT1 = 0b00000000  # send every interrupt to INT1
+
+# Time to wait for the watermark interrupt before reading the FIFO anyway. Must be shorter than the time to fill the
+# FIFO (32 samples, 10ms at 3200Hz) so a missed interrupt doesn't make us lose samples.
+WATERMARK_TIMEOUT = 0.008
 READ_BIT = 0x01
 WRITE_BIT = 0x00
 DUMMY_BYTE = 0x00
 SEQUENTIAL_READ_BYTE = 0b11
 
+# SPI request popping a single sample from the FIFO: multi-byte read of the 6 data registers
+FIFO_READ_REQUEST = [DATA_X0 | (SEQUENTIAL_READ_BYTE << 6)] + [DUMMY_BYTE] * 6
+# The FIFO needs at least 5us after the chip select goes high to pop the next sample
+FIFO_POP_DELAY_US = 5
+# Format of the 6 data registers: 3 little-endian signed 16 bits values
+RAW_AXES_FORMAT = struct.Struct("<hhh")
+
 # Conversion factors
 CONV_FULLR = 0.004  # applicable for all gs
 EARTH_GRAVITY = 9.80665
@@ -67,9 +90,16 @@ class Accelerometer(SensorLogging):
         self.spi.max_speed_hz = SPI_MAX_CLOCK_HZ
         self.spi.mode = SPI_MODE
 
+        # Configure the INT1 pin, where the watermark interrupt is sent
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        GPIO.setup(INT1Pin, GPIO.IN)
+        self.watermark = EdgeWaiter(INT1Pin)
+
         self.check_sensor_connection()
         self.set_measure_range(measure_range)
         self.set_fifo()
+        self.set_interrupts()
         self.set_bw_rate()
         self.enable_measure_mode()
 
@@ -102,6 +132,11 @@ class Accelerometer(SensorLogging):
         """Function to set FIFO mode"""
         self.xfer_write_byte(FIFO_CTL, FIFO_MODE)
 
+    def set_interrupts(self):
+        """Function to send the FIFO watermark interrupt to INT1"""
+        self.xfer_write_byte(INT_MAP, INT_MAP_ALL_INT1)
+        self.xfer_write_byte(INT_ENABLE, INT_WATERMARK)
+
     def set_bw_rate(self):
         """Function to set bandwidth and output data rate"""
         self.xfer_write_byte(BW_RATE, BW_OUTPUT_RATE)
@@ -127,11 +162,36 @@ class Accelerometer(SensorLogging):
         return retlist
 
     def wait_until_data_ready(self):
-        """Block here until the sensor has new data"""
-        ready = 0
-        while ready == 0:
-            int_source = self.xfer_read_byte(INT_SOURCE)
-            ready = (int_source >> 7) & 0x1  # Check the DATA_READY bit
+        """
+        Block here until the FIFO reaches the watermark. The thread sleeps on the INT1 edge instead of polling the
+        sensor. Returns False if the interrupt didn't come in time.
+        """
+        return self.watermark.wait(WATERMARK_TIMEOUT)
+
+    def get_fifo_entries(self):
+        """Return the number of samples currently waiting in the FIFO"""
+        return self.xfer_read_byte(FIFO_STATUS) & FIFO_ENTRIES_MASK
+
+    def read_fifo(self):
+        """
+        Drain every sample queued in the FIFO, back to back. Returns a list of (x, y, z) tuples in m/s^2, from the
+        oldest to the newest sample.
+
+        Each sample needs its own transfer: the FIFO only pops when the chip select goes high after a read of the data
+        registers, so the samples cannot be read together in a single transfer.
+        """
+        entries = self.get_fifo_entries()
+
+        factor = CONV_FULLR * EARTH_GRAVITY
+        samples = []
+        for _ in range(entries):
+            raw_axes = self.spi.xfer2(FIFO_READ_REQUEST, SPI_MAX_CLOCK_HZ, FIFO_POP_DELAY_US)
+            x_data, y_data, z_data = RAW_AXES_FORMAT.unpack(bytes(raw_axes[1:]))
+            samples.append((round(x_data * factor, OUTPUT_PRECISION),
+                            round(y_data * factor, OUTPUT_PRECISION),
+                            round(z_data * factor, OUTPUT_PRECISION)))
+
+        return samples
 
     def get_acceleration_data(self):
         """
@@ -163,10 +223,25 @@ class Accelerometer(SensorLogging):
         return {"x": x_data, "y": y_data, "z": z_data}
 
     def run(self):
-        super().setup_logging("acceleration", ["x", "y", "z"])
+        self.channel = super().declare_channel("acceleration", ["x", "y", "z"], "ddd")
 
         self.setup()
+        em = ErrorManager(__name__)
+
+        period = 1000.0 / OUTPUT_RATE_HZ  # In ms, like the timestamps
+        last_timestamp = None
         while True:
-            self.wait_until_data_ready()
-            val = self.get_acceleration_data()
-            self.sensorlogger.info([time.time() * 1000, val["x"], val["y"], val["z"]])
+            if self.wait_until_data_ready():
+                em.resolve("Acceleration sensor watermark interrupt received", "ACCEL_INT1", False)
+            else:
+                em.warning("Acceleration sensor watermark interrupt not received. Is INT1 connected?", "ACCEL_INT1")
+
+            now = time.time() * 1000  # The newest sample in the FIFO was acquired right before it is read
+            samples = self.read_fifo()
+
+            timestamps = interpolate_timestamps(last_timestamp, now, len(samples), period)
+            for timestamp, (x_data, y_data, z_data) in zip(timestamps, samples):
+                self.publish(self.channel, (timestamp, x_data, y_data, z_data))
+
+            if len(samples) != 0:
+                last_timestamp = timestamps[-1]
@@ -1,8 +1,7 @@
 import time
 
-import smbus
-
-from rpi.sensors.sensorlogging import SensorLogging
+from rpi.hardware import smbus
+from rpi.sensors.sensorlogging import SensorLogging, interpolate_timestamps
 from shared.customlogging.errormanager import ErrorManager
 
 
@@ -18,6 +17,7 @@ DATA_FORMAT = 0x31  # clear bit d6 for 4 wire, set for 3 wire
 BW_RATE = 0x2C  # date and power mode control
 POWER_CTL = 0x2D  # power saving features control
 FIFO_CTL = 0x38  # FIFO mode select
+FIFO_STATUS = 0x39  # FIFO entries and trigger status
 INT_SOURCE = 0x30
 
 DATA_X0 = 0x32  # x-axis data0
@@ -37,9 +37,19 @@ SELF_TEST = 0b10001111  # full resolution (13bits) MSB mode, +/-16g
 
 # register values
 MEASURE_MODE = 0b00001000  # set device to measure mode (D3)
-BW_OUTPUT_RATE = 0x0A  # normal operation, 50Hz output rate (max for 100kHz RPi I2C)
+BW_OUTPUT_RATE = 0x0C  # normal operation, 400Hz output rate (needs FIFO burst mode on the 100kHz RPi I2C)
 FIFO_MODE = 0b10000001  # stream mode, INT1 triggered, 31bit buffer
 FIFO_BYPASS = 0b00000000
+FIFO_ENTRIES_MASK = 0b00111111  # number of samples stored in the FIFO, in FIFO_STATUS
+
+# Output data rate in Hz for each BW_RATE rate code (table 7 in datasheet)
+OUTPUT_RATES_HZ = {0x0F: 3200, 0x0E: 1600, 0x0D: 800, 0x0C: 400, 0x0B: 200, 0x0A: 100, 0x09: 50, 0x08: 25}
+
+# If True, the FIFO is drained in bursts at a pace matching the output data rate. If False, the data registers are
+# polled continuously, which can return the same sample more than once.
+USE_FIFO_BURST = True
+# Number of samples to let accumulate in the FIFO between two drains. Must stay well under the 32 samples it can hold.
+FIFO_DRAIN_SAMPLES = 16
 
 # I2C specific read/write with ALT ADDRESS pin high
 READ_BIT = 0x3B
@@ -105,20 +115,17 @@ class Accelerometer(SensorLogging):
         self.bus.write_byte_data(ACC_ADDRESS, POWER_CTL, MEASURE_MODE)
 
     def get_acceleration_data(self):
-        """Return acceleration of each axis in m/s^2"""
-        x_data0 = self.bus.read_byte_data(ACC_ADDRESS, DATA_X0)
-        x_data1 = self.bus.read_byte_data(ACC_ADDRESS, DATA_X1)
-
-        y_data0 = self.bus.read_byte_data(ACC_ADDRESS, DATA_Y0)
-        y_data1 = self.bus.read_byte_data(ACC_ADDRESS, DATA_Y1)
-
-        z_data0 = self.bus.read_byte_data(ACC_ADDRESS, DATA_Z0)
-        z_data1 = self.bus.read_byte_data(ACC_ADDRESS, DATA_Z1)
+        """
+        Return acceleration of each axis in m/s^2. When the FIFO is enabled, this also pops the oldest sample from it.
+        """
+        # All 6 data registers must be read in a single transaction, so the sample cannot change (or the FIFO pop)
+        # between reading two of them
+        raw_axes = self.bus.read_i2c_block_data(ACC_ADDRESS, DATA_X0, 6)
 
         # Combine respective registers
-        x_data = ((x_data1 & 0x03) * 256) + x_data0
-        y_data = ((y_data1 & 0x03) * 256) + y_data0
-        z_data = ((z_data1 & 0x03) * 256) + z_data0
+        x_data = ((raw_axes[1] & 0x03) * 256) + raw_axes[0]
+        y_data = ((raw_axes[3] & 0x03) * 256) + raw_axes[2]
+        z_data = ((raw_axes[5] & 0x03) * 256) + raw_axes[4]
 
         # Apply 2s comp
         x_data = twos_comp(x_data, 16)
@@ -137,14 +144,59 @@ class Accelerometer(SensorLogging):
 
         return {"x": x_data, "y": y_data, "z": z_data}
 
+    def get_fifo_entries(self):
+        """Return the number of samples currently waiting in the FIFO"""
+        return self.bus.read_byte_data(ACC_ADDRESS, FIFO_STATUS) & FIFO_ENTRIES_MASK
+
+    def read_fifo(self):
+        """
+        Drain every sample queued in the FIFO. Returns a list of the samples (in the same format as
+        get_acceleration_data()), from the oldest to the newest.
+        """
+        entries = self.get_fifo_entries()
+        return [self.get_acceleration_data() for _ in range(entries)]
+
+    def run_fifo_burst(self, em):
+        """
+        Drains the FIFO each time about FIFO_DRAIN_SAMPLES samples accumulated in it. Every sample is logged exactly
+        once, with a timestamp interpolated from the time of the drain and the output data rate.
+        """
+        period = 1000.0 / OUTPUT_RATES_HZ[BW_OUTPUT_RATE]  # In ms, like the timestamps
+        last_timestamp = None
+        while True:
+            try:
+                now = time.time() * 1000  # The newest sample in the FIFO was acquired right before it is read
+                samples = self.read_fifo()
+
+                timestamps = interpolate_timestamps(last_timestamp, now, len(samples), period)
+                for timestamp, acceleration in zip(timestamps, samples):
+                    self.publish(self.channel, (timestamp, acceleration["x"], acceleration["y"], acceleration["z"]))
+
+                if len(samples) != 0:
+                    last_timestamp = timestamps[-1]
+
+                em.resolve("Acceleration sensor is now working correctly", "accel", False)
+
+                # Sleep until FIFO_DRAIN_SAMPLES new samples are available, minus the time spent draining
+                elapsed = time.time() * 1000 - now
+                time.sleep(max(FIFO_DRAIN_SAMPLES * period - elapsed, 0) / 1000)
+            except OSError:
+                em.error("Error reading from acceleration sensor", "accel")
+                last_timestamp = None
+
     def run(self):
-        super().setup_logging("acceleration", ["x", "y", "z"])
+        self.channel = super().declare_channel("acceleration", ["x", "y", "z"], "ddd")
         self.setup()
         em = ErrorManager(__name__)
+
+        if USE_FIFO_BURST:
+            self.run_fifo_burst(em)
+
         while True:
             try:
                 acceleration = self.get_acceleration_data()
-                self.sensorlogger.info([time.time() * 1000, acceleration["x"], acceleration["y"], acceleration["z"]])
+                self.publish(self.channel,
+                             (time.time() * 1000, acceleration["x"], acceleration["y"], acceleration["z"]))
 
                 em.resolve("Acceleration sensor is now working correctly", "accel", False)
             except OSError:
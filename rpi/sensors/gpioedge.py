@@ -0,0 +1,51 @@
+"""
+Helper to wait on a GPIO input without busy looping on GPIO.input()
+"""
+import threading
+
+from rpi.hardware import GPIO
+
+
+# If using Pylint in IDE, for some reason warns about GPIO not
+# having any members. The following line tells it to ignore this.
+# pylint: disable=no-member
+class EdgeWaiter:
+    """
+    Waits until a GPIO input is at the requested level. The pin is watched with edge detection, so the waiting thread
+    sleeps until the edge happens instead of polling the pin.
+
+    The pin must already be configured as an input with GPIO.setup().
+    """
+
+    def __init__(self, pin, level=GPIO.HIGH):
+        """
+        :param pin: The pin number to watch, in the numbering mode given to GPIO.setmode()
+        :param level: The level to wait for. The matching edge (rising for HIGH, falling for LOW) is detected.
+        """
+        self.pin = pin
+        self.level = level
+        self.edge_event = threading.Event()
+
+        edge = GPIO.RISING if level == GPIO.HIGH else GPIO.FALLING
+        GPIO.add_event_detect(pin, edge, callback=self.__edge_detected)
+
+    def __edge_detected(self, channel):
+        self.edge_event.set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the pin is at the requested level.
+        :param timeout: Maximum time to wait in seconds. None to wait forever.
+        :return: True if the pin reached the level, False if the timeout expired
+        """
+        # Clear before checking the level. If the edge happens between the check and the wait, the callback has
+        # already set the event and wait() returns right away.
+        self.edge_event.clear()
+        if GPIO.input(self.pin) == self.level:
+            return True
+
+        return self.edge_event.wait(timeout)
+
+    def close(self):
+        """Stops watching the pin"""
+        GPIO.remove_event_detect(self.pin)
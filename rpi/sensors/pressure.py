@@ -1,11 +1,35 @@
 import struct
 import time
 
-import smbus
-
-from rpi.sensors.sensorlogging import SensorLogging
+from rpi.hardware import GPIO, smbus
+from rpi.sensors.gpioedge import EdgeWaiter
+from rpi.sensors.sensorlogging import SensorLogging, interpolate_timestamps
 from shared.customlogging.errormanager import ErrorManager
 
+# If True and the sensor is an LPS25H (see FIFO_DEVICE_ID), it measures continuously at its own output data rate and
+# the samples are drained from its FIFO. Otherwise, a one-shot measurement is triggered for each sample, and read as
+# soon as the sensor reports it is done.
+# Only enable it once the fitted part has been checked against the LPS25H datasheet, and INT1Pin is wired.
+USE_CONTINUOUS_MODE = False
+
+# Number of samples to let accumulate in the FIFO between two drains. The FIFO holds 32 samples.
+FIFO_WATERMARK = 16
+
+# Output data rate set in continuous mode (ODR = 0b100 in CTRL_REG1), used to spread the timestamps of the samples
+NOMINAL_OUTPUT_RATE_HZ = 25
+
+# Pin connected to the INT1 output of the sensor, where the FIFO watermark interrupt is sent
+INT1Pin = 13
+
+# Time in seconds the FIFO can take to reach the watermark before the sensor is considered stalled. About 5 times the
+# time it needs at NOMINAL_OUTPUT_RATE_HZ.
+FIFO_STALL_TIMEOUT = 5 * FIFO_WATERMARK / NOMINAL_OUTPUT_RATE_HZ
+
+# Time in seconds between two reads of STATUS_REG while a one-shot measurement is being done, and maximum time it can
+# take. A measurement takes a few tens of ms, depending on the number of internal averages.
+DATA_READY_POLL_INTERVAL = 0.002
+DATA_READY_TIMEOUT = 0.5
+
 
 class Pressure(SensorLogging):
     device_ID = 0xBB  # device_id
@@ -18,8 +42,41 @@ class Pressure(SensorLogging):
     PRESS_OUT_L = 0x29  # middle part of reference pressure (bits 8-15)
     PRESS_OUT_H = 0x2A  # higher part of reference pressure (bits 16-23)
 
+    WHO_AM_I = 0x0F  # device identification register
+    STATUS_REG = 0x27  # P_DA (bit 1) is set when a new pressure is available, cleared once PRESS_OUT_H is read
+    P_DA = 0b00000010
+
+    # Continuous mode registers, from the LPS25H datasheet. Only used if WHO_AM_I is FIFO_DEVICE_ID.
+    FIFO_DEVICE_ID = 0xBD  # WHO_AM_I of the LPS25H
+    LPS25H_CTRL_REG1 = 0x20  # PD (bit 7), ODR (bits 6-4), BDU (bit 2)
+    LPS25H_CTRL_REG2 = 0x21  # BOOT (bit 7), FIFO_EN (bit 6), WTM_EN (bit 5), SWRESET (bit 2), ONE_SHOT (bit 0)
+    LPS25H_CTRL_REG3 = 0x22  # INT1 pad. 0 is active high, push-pull, signals chosen by CTRL_REG4
+    LPS25H_CTRL_REG4 = 0x23  # Signals sent to INT1
+    FIFO_CTRL = 0x2E  # FIFO mode (bits 7-5) and watermark level (bits 4-0)
+    FIFO_STATUS = 0x2F  # WTM_FIFO (bit 7), FULL_FIFO (bit 6), EMPTY_FIFO (bit 5), level (bits 4-0)
+
+    AUTO_INCREMENT = 0x80  # set on the register address to read multiple registers in one transaction
+    LPS25H_CTRL_REG1_CONTINUOUS = 0b11000100  # powered up, 25 Hz output data rate, block data update
+    LPS25H_CTRL_REG2_SWRESET = 0b00000100
+    LPS25H_CTRL_REG2_FIFO = 0b01100000  # FIFO_EN and WTM_EN: samples go to the FIFO, watermark level is used
+    LPS25H_CTRL_REG4_WATERMARK = 0b00000100  # P1_WTM: INT1 is high while the FIFO is at or above the watermark
+    FIFO_STREAM_MODE = 0b01000000  # stream mode, oldest samples are overwritten when full. Watermark in lowest bits
+    FIFO_LEVEL_MASK = 0b00011111  # number of unread samples, in FIFO_STATUS
+    FIFO_FULL = 0b01000000  # set in FIFO_STATUS when the FIFO is full, so the next sample overwrites the oldest
+    FIFO_SIZE = 32
+    FIFO_LSB_PER_PA = 40.96  # 4096 LSB/hPa
+
+    SAMPLE_BYTES = 3  # PRESS_OUT_XL to PRESS_OUT_H. A sample pops from the FIFO once they have been read.
+    # Samples per block read of the FIFO: as many whole samples as fit in the 32 bytes of an SMBus block read
+    SAMPLES_PER_READ = 32 // SAMPLE_BYTES
+
     def setup(self):
         self.bus = smbus.SMBus(1)
+        self.last_timestamp = None  # The FIFO starts over, so the timestamps of its samples too
+        if self.continuous:
+            self.setup_fifo()
+            return
+
         self.bus.write_byte_data(self.address, self.CTRL_REG0, 0b00000010)
         time.sleep(0.5)
         # activate ENABLE_MEAS and set output data rates (table 16)
@@ -27,15 +84,38 @@ class Pressure(SensorLogging):
         self.bus.write_byte_data(self.address, self.CTRL_REG0, 0b00000000)
         time.sleep(0.5)
 
-    def read_pressure(self):
-        self.bus.write_byte_data(self.address, self.CTRL_REG0, 0b00000011)
-        time.sleep(0.1)  # Wait for the measurement to be done
-
-        data0 = self.bus.read_byte_data(self.address, self.PRESS_OUT_XL)
-        data1 = self.bus.read_byte_data(self.address, self.PRESS_OUT_L)
-        data2 = self.bus.read_byte_data(self.address, self.PRESS_OUT_H)
-
-        # convert data
+    def setup_fifo(self):
+        """
+        Configure an LPS25H to measure continuously into its FIFO, in stream mode, with the watermark interrupt on INT1
+        """
+        self.bus.write_byte_data(self.address, self.LPS25H_CTRL_REG2, self.LPS25H_CTRL_REG2_SWRESET)
+        time.sleep(0.01)
+        # The FIFO must be enabled before selecting its mode
+        self.bus.write_byte_data(self.address, self.LPS25H_CTRL_REG2, self.LPS25H_CTRL_REG2_FIFO)
+        self.bus.write_byte_data(self.address, self.FIFO_CTRL, self.FIFO_STREAM_MODE | FIFO_WATERMARK)
+        self.bus.write_byte_data(self.address, self.LPS25H_CTRL_REG3, 0)
+        self.bus.write_byte_data(self.address, self.LPS25H_CTRL_REG4, self.LPS25H_CTRL_REG4_WATERMARK)
+        self.bus.write_byte_data(self.address, self.LPS25H_CTRL_REG1, self.LPS25H_CTRL_REG1_CONTINUOUS)
+
+    def supports_fifo(self, em):
+        """Return True if the sensor is the part the continuous mode is written for. If not, an error is logged."""
+        try:
+            device_id = self.bus.read_byte_data(self.address, self.WHO_AM_I)
+        except OSError:
+            device_id = None
+
+        if device_id != self.FIFO_DEVICE_ID:
+            em.error("Pressure sensor continuous mode needs an LPS25H (WHO_AM_I {:#x}), got {}. Using one-shot "
+                     "measurements".format(self.FIFO_DEVICE_ID, hex(device_id) if device_id is not None else None),
+                     "pressure_device")
+            return False
+        return True
+
+    @staticmethod
+    def convert_pressure(data0, data1, data2, lsb_per_pa=64):
+        """
+        Convert the 3 bytes of a measurement, from PRESS_OUT_XL to PRESS_OUT_H, to a pressure in Pa
+        """
         if data2 & (1 << 7):
             filler = 0xFF
         else:
@@ -43,29 +123,131 @@ class Pressure(SensorLogging):
 
         # 2s comp notation ">i", ">"  use Big Endian
         pressure = struct.unpack(">i", bytes([filler, data2, data1, data0]))[0]
-        # LSB represents 1/64 of a Pascal
-        pressure /= 64
+        # LSB represents 1/64 of a Pascal, or 1/40.96 on the LPS25H
+        pressure /= lsb_per_pa
         return pressure
 
+    def read_pressure(self):
+        """
+        Trigger a one-shot measurement, and read it once P_DA is set in STATUS_REG, so the rate is set by the time the
+        sensor needs for a measurement. Raises a TimeoutError if it is not done after DATA_READY_TIMEOUT.
+        """
+        self.bus.write_byte_data(self.address, self.CTRL_REG0, 0b00000011)
+
+        deadline = time.monotonic() + DATA_READY_TIMEOUT
+        while not self.bus.read_byte_data(self.address, self.STATUS_REG) & self.P_DA:
+            if time.monotonic() >= deadline:
+                raise TimeoutError("Pressure measurement not done after {} s".format(DATA_READY_TIMEOUT))
+            time.sleep(DATA_READY_POLL_INTERVAL)
+
+        # The 3 bytes in one transaction, so they are from the same measurement
+        data = self.bus.read_i2c_block_data(self.address, self.PRESS_OUT_XL | self.AUTO_INCREMENT, self.SAMPLE_BYTES)
+        return self.convert_pressure(data[0], data[1], data[2])
+
+    def read_fifo_status(self):
+        """
+        Return a tuple with the number of samples waiting in the FIFO, and if it was full, so samples may have been lost
+        """
+        status = self.bus.read_byte_data(self.address, self.FIFO_STATUS)
+        if status & self.FIFO_FULL:
+            return self.FIFO_SIZE, True
+        return status & self.FIFO_LEVEL_MASK, False
+
+    def read_fifo(self, count):
+        """
+        Drain count samples from the FIFO with auto-increment block reads of up to SAMPLES_PER_READ samples. While the
+        FIFO is enabled, the address rolls back from PRESS_OUT_H to PRESS_OUT_XL and the next sample is output, so
+        consecutive samples are read in a single transaction. Returns the pressures in Pa, from the oldest to the
+        newest.
+        """
+        pressures = []
+        while count > 0:
+            samples = min(count, self.SAMPLES_PER_READ)
+            data = self.bus.read_i2c_block_data(self.address, self.PRESS_OUT_XL | self.AUTO_INCREMENT,
+                                                samples * self.SAMPLE_BYTES)
+            for i in range(0, len(data), self.SAMPLE_BYTES):
+                pressures.append(self.convert_pressure(data[i], data[i + 1], data[i + 2], self.FIFO_LSB_PER_PA))
+            count -= samples
+
+        return pressures
+
+    def check_pressure(self, pressure, em):
+        """
+        Keeps track of unreasonable values, and resets the sensor if it keeps returning them
+        """
+        if pressure < 65000:  # Fail if we are constantly at a unreasonable value
+            self.invalid_data_times += 1
+        else:
+            self.invalid_data_times = 0
+
+        if self.invalid_data_times > 10:
+            em.error("Pressure sensor is returning unusual values. Resetting the sensor", "unusual")
+            self.invalid_data_times = 0
+            self.setup()
+
+    def run_continuous(self, em):
+        """
+        Drains the FIFO each time it reaches FIFO_WATERMARK samples. The thread sleeps until the sensor raises INT1,
+        and the timestamps of the samples are spread at the nominal output data rate.
+        """
+        period = 1000.0 / NOMINAL_OUTPUT_RATE_HZ  # In ms, like the timestamps
+        while True:
+            try:
+                if not self.watermark.wait(FIFO_STALL_TIMEOUT):
+                    em.error("Pressure sensor stalled: the FIFO did not reach the watermark in {:.1f} s. Is INT1 "
+                             "connected?".format(FIFO_STALL_TIMEOUT), "pressure_stall")
+                    self.last_timestamp = None  # Do not spread the next samples over the stall
+                    continue
+                em.resolve("Pressure sensor FIFO is filling again", "pressure_stall", False)
+
+                count, full = self.read_fifo_status()
+                if full:
+                    em.warning("Pressure sensor FIFO overflowed, samples were lost", "pressure_fifo")
+                    self.last_timestamp = None
+                else:
+                    em.resolve("Pressure sensor FIFO is read in time again", "pressure_fifo", False)
+
+                now = time.time() * 1000  # The newest sample in the FIFO was acquired right before it is read
+                pressures = self.read_fifo(count)
+                if len(pressures) == 0:
+                    continue
+
+                timestamps = interpolate_timestamps(self.last_timestamp, now, len(pressures), period)
+                self.last_timestamp = timestamps[-1]
+
+                for timestamp, pressure in zip(timestamps, pressures):
+                    self.publish(self.channel, (timestamp, pressure))
+                    self.check_pressure(pressure, em)
+
+                em.resolve("Error has been cleared for pressure sensor", "pressure", False)
+            except OSError:
+                em.error("Error while reading from pressure sensor", "pressure")
+                self.last_timestamp = None
+                time.sleep(period / 1000)
+
     def run(self):
-        super().setup_logging("pressure", ["value"])
+        self.channel = super().declare_channel("pressure", ["value"], "d")
+        self.continuous = False
         self.setup()
 
-        invalid_data_times = 0
+        self.invalid_data_times = 0
         em = ErrorManager(__name__)
+
+        if USE_CONTINUOUS_MODE and self.supports_fifo(em):
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setwarnings(False)
+            GPIO.setup(INT1Pin, GPIO.IN)
+            self.watermark = EdgeWaiter(INT1Pin)
+
+            self.continuous = True
+            self.setup()
+            self.run_continuous(em)
+
         while True:
             try:
                 pressure = self.read_pressure()
-                self.sensorlogger.info([time.time() * 1000, pressure])
-
-                if pressure < 65000: # Fail if we are constantly at a unreasonable value
-                    invalid_data_times += 1
-                else:
-                    invalid_data_times = 0
-
-                if invalid_data_times > 10:
-                    em.error("Pressure sensor is returning unusual values. Resetting the sensor", "unusual")
-                    self.setup()
+                self.publish(self.channel, (time.time() * 1000, pressure))
+                self.check_pressure(pressure, em)
 
                 em.resolve("Error has been cleared for pressure sensor", "pressure", False)
             except OSError as e:
@@ -1,38 +1,83 @@
-import logging
 import multiprocessing
 from abc import ABC, abstractmethod
 
-from shared.customlogging.formatter import CSVFormatter
-from shared.customlogging.handler import MakeFileHandler
+import rpi.logging.telemetry as telemetry
+from rpi.logging.samplering import SampleRing
+from shared.telemetry import Channel, Sample
+
+
+def interpolate_timestamps(last_timestamp, now, count, period):
+    """
+    Spread the acquisition time of `count` samples read together from a sensor FIFO. The newest sample is assumed to
+    have been acquired at `now`, and the others are evenly spaced before it.
+
+    Parameters:
+        last_timestamp : timestamp given to the newest sample of the previous read, or None if there is none
+        now : time at which the FIFO was read
+        count : number of samples read from the FIFO
+        period : nominal time between two samples (output data rate of the sensor), or None if it is unknown
+
+    All times must be in the same unit. Returns a list of `count` timestamps, from the oldest to the newest.
+    """
+    if count == 0:
+        return []
+
+    spacing = period
+    if last_timestamp is not None and now > last_timestamp:
+        spacing = (now - last_timestamp) / count
+
+        # If way more time than expected passed, the FIFO overflowed and samples were lost. In that case, the
+        # nominal period is a better guess than spreading the samples over the whole gap.
+        if period is not None and spacing > 2 * period:
+            spacing = period
+
+    if spacing is None:
+        spacing = 0
+
+    return [now - (count - 1 - i) * spacing for i in range(count)]
 
 
 class SensorLogging(ABC, multiprocessing.Process):
     """
-    Base class for pretty much all sensors. This class main function is to create the logger for each sensors.
+    Base class for pretty much all sensors. This class main function is to publish the data (telemetry) of each sensor.
+    Errors and events should still be logged with ErrorManager and the logging module.
     """
 
-    def setup_logging(self, folderName, dataRow):
+    def declare_channel(self, name, fields, format=None):
         """
         Parameters:
-            folderName : name of the folder to use
-            dataRow : list representing the header of the csv file. Do not include timestamp, it will be included automatically
+            name : name of the channel, also used as the name of the folder of the csv files
+            fields : names of the values of each sample. Do not include timestamp, it will be included automatically
+            format : Optional. struct format of the values (ex: "ddd" for 3 floats), without the timestamp. If given,
+                     the samples are sent to the logging process through a shared memory ring instead of the logging
+                     queue. Use it for sensors publishing many samples per second.
 
-        Sets up the sensor logging for the base class, i.e. create a file where all the data specifically for this
-        sensor is written to. The logger can be access by the base class at `self.sensorlogger`.
-
-        Side note: Other lower-level loggers (ex: the root logger) can do other things with this data. For example, the
-        root logger can be configured to send data over a network connection to somewhere else. This method only assures
-        the data is written to a local file.
+        Declares a channel of data published by this sensor. The logging process writes all the samples of the channel
+        to a csv file, and sends them to the laptop. Returns the channel to pass to publish().
         """
+        if not hasattr(self, 'samplerings'):
+            self.samplerings = dict()
 
-        self.sensorlogger = logging.getLogger("sensorlog." + folderName)
+        channel = Channel(name, fields, format)
+        if format is not None:
+            ring = SampleRing(channel.row_format())
+            channel.ring = ring.name
+            self.samplerings[name] = ring
 
-        csvHandler = MakeFileHandler('rpi', 'sensor', folderName, 'csv')
-        csvHandler.setFormatter(CSVFormatter())
-        self.sensorlogger.addHandler(csvHandler)
-        self.sensorlogger.setLevel(logging.INFO)
+        telemetry.send(channel)
+        return channel
 
-        self.sensorlogger.info(["timestamp", *dataRow])
+    def publish(self, channel, values):
+        """
+        Publishes a sample of a channel. values is a sequence starting with the timestamp (in ms), followed by the
+        values of the fields. If the ring of the channel is full because the logging process fell behind, the sample is
+        dropped (and counted) instead of stalling the acquisition.
+        """
+        ring = self.samplerings.get(channel.name)
+        if ring is None:
+            telemetry.send(Sample(channel.name, values))
+        else:
+            ring.put(*values)
 
     @abstractmethod
     def run(self):
@@ -3,10 +3,10 @@ import logging
 import threading
 import time
 
-import RPi.GPIO as GPIO
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 
+from rpi.hardware import GPIO
 # desired temp
 from shared.customlogging.errormanager import ErrorManager
 
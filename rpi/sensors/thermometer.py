@@ -3,12 +3,11 @@ import re
 import threading
 import time
 
+from rpi.hardware import GPIO, w1
 from rpi.sensors.sensorlogging import SensorLogging
 from rpi.sensors.temp_management import TempManagement
 from shared.customlogging.errormanager import ErrorManager
 
-import RPi.GPIO as GPIO
-
 RELAY_PIN = 21
 
 thermometer_names = {
@@ -19,6 +18,17 @@ thermometer_names = {
     '28-00000bc807e7': 'Foam'
     }
 
+W1_DEVICES_PATH = w1.DEVICES_PATH
+
+# Resolution of the temperature conversions, in bits (9 to 12). Lower resolutions convert faster, see below.
+THERMOMETER_RESOLUTION = 10
+
+# Time in seconds needed for a temperature conversion at each resolution (table 2 in DS18B20 datasheet)
+CONVERSION_TIMES = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.75}
+
+# Minimum time in seconds between two readings of all the thermometers
+READ_PERIOD = 0.25
+
 
 class InvalidTemperatureDataError(Exception):
     pass
@@ -33,31 +43,84 @@ class ThermometerList(threading.Thread):
     """
     Class to retrieve data from temperature sensors
 
-    Each instance of this class represents a separate temperature sensor. Also contains a static variable to keep track
-    of the current temperature of all sensors.
+    A single instance reads all the temperature sensors. A conversion is triggered on every sensor of the bus at the
+    same time (bulk read), then all the results are read together, so every reading of a cycle is aligned in time.
+    Also contains a static variable to keep track of the current temperature of all sensors.
     """
 
     thermometer_data = dict()
     thermometer_data_lock = threading.Lock()
 
-    def __init__(self, identity, name, sensor_logger):
+    def __init__(self, thermometers, publish, resolution=THERMOMETER_RESOLUTION):
+        """
+        :param thermometers: A map with the id of each sensor as the key, and the name of the sensor as the value
+        :param publish: Function to call with each sample ([timestamp, name, temperature]) to publish
+        :param resolution: Resolution of the conversions, in bits (9 to 12)
+        """
         super().__init__()
-        self.device_file = '/sys/bus/w1/devices/' + identity + '/w1_slave'
-        self.sensor_logger = sensor_logger
-        self.name = name
+        self.thermometers = thermometers
+        self.publish = publish
+        self.resolution = resolution
+        self.em = ErrorManager(__name__)
 
-    def __read_temp_raw(self):
-        f = open(self.device_file, 'r')
-        lines = f.readlines()
-        f.close()
-        return lines
+        # The files are kept open and read again from the start for each reading. Opened when first needed.
+        self.device_files = dict()
 
-    '''
-    Reads and returns the temperature of this sensor
-    '''
+        # One file per bus master to trigger a conversion on all the sensors of that bus
+        self.bulk_files = [w1.open(path, 'r+b', buffering=0)
+                           for path in w1.glob(W1_DEVICES_PATH + 'w1_bus_master*/therm_bulk_read')]
 
-    def __read(self):
-        lines = self.__read_temp_raw()
+    def set_resolution(self):
+        """
+        Set the resolution of every sensor. If this is not supported, the sensors keep their current resolution.
+        """
+        for identity, name in self.thermometers.items():
+            try:
+                with w1.open(W1_DEVICES_PATH + identity + '/resolution', 'w') as f:
+                    f.write(str(self.resolution))
+                self.em.resolve("Resolution of temperature sensor {} set to {} bits".format(name, self.resolution),
+                                "resolution_" + name, False)
+            except OSError:
+                self.em.warning("Could not set the resolution of temperature sensor {}".format(name),
+                                "resolution_" + name)
+
+    def __trigger_conversion(self):
+        """
+        Start a conversion on all the sensors at the same time, and block until it is done.
+        If bulk read is not supported, every sensor will do its own conversion when it is read.
+        """
+        for f in self.bulk_files:
+            f.write(b'trigger\n')
+
+        time.sleep(CONVERSION_TIMES[self.resolution])
+
+        # Make sure the conversion is done. The file returns -1 while a conversion is in progress.
+        deadline = time.monotonic() + CONVERSION_TIMES[self.resolution]
+        for f in self.bulk_files:
+            f.seek(0)
+            while f.read().strip() == b'-1' and time.monotonic() < deadline:
+                time.sleep(0.01)
+                f.seek(0)
+
+    def __read_temp_raw(self, identity):
+        f = self.device_files.get(identity)
+        if f is None:
+            f = w1.open(W1_DEVICES_PATH + identity + '/w1_slave', 'rb', buffering=0)
+            self.device_files[identity] = f
+
+        try:
+            f.seek(0)
+            return f.read().decode('ascii').splitlines()
+        except OSError:
+            # Reopen the file next time, in case the sensor was disconnected
+            self.device_files.pop(identity).close()
+            raise
+
+    def __read(self, identity):
+        """
+        Reads and returns the temperature of a sensor
+        """
+        lines = self.__read_temp_raw(identity)
 
         # The following regex retrieves the result of the CRC check
         crc = re.match(r'^(?:\w{2} ){9}: crc=\w+ (\w+)$', lines[0]).group(1)
@@ -65,43 +128,60 @@ class ThermometerList(threading.Thread):
             raise InvalidTemperatureDataError  # CRC check failed, so the data is not valid
 
         # Now, this regex retrieves the actual temperature
-        temp = re.match(r'^(?:\w{2} ){9}t=(\d+)$', lines[1]).group(1)
+        temp = re.match(r'^(?:\w{2} ){9}t=(-?\d+)$', lines[1]).group(1)
 
         temp = float(temp) / 1000.0
 
         # Sanity check for the temperature
         if temp < 15 or temp > 75:
-            raise InvalidTemperatureDataError(temp)
+            raise InvalidTemperatureRangeError(temp)
 
         return temp
 
-    def run(self):
-        em = ErrorManager(__name__)
-        while True:
-            time.sleep(1)
+    def read_all(self):
+        """
+        Converts and reads the temperature of all the sensors, logging them with the same timestamp
+        """
+        self.__trigger_conversion()
+        now = time.time() * 1000
+
+        for identity, name in self.thermometers.items():
             try:
-                temperature = self.__read()
+                temperature = self.__read(identity)
 
                 # Log to the laptop and files
-                self.sensor_logger.info([time.time() * 1000, self.name, temperature])
+                self.publish([now, name, temperature])
 
                 # Store in static variable so the temperature management can access it
-                ThermometerList.__update_temperature_data(self.name, temperature)
+                ThermometerList.__update_temperature_data(name, temperature)
 
                 # If we had a previous error, resolve it
-                em.resolve("Error has been cleared for temperature sensor {}".format(self.name), self.name, False)
+                self.em.resolve("Error has been cleared for temperature sensor {}".format(name), name, False)
             except InvalidTemperatureDataError:
-                em.error("Temperature sensor {} is returning invalid data. It may have been disconnected."
-                         .format(self.name), self.name)
-                ThermometerList.__update_temperature_data(self.name, None)
+                self.em.error("Temperature sensor {} is returning invalid data. It may have been disconnected."
+                              .format(name), name)
+                ThermometerList.__update_temperature_data(name, None)
             except InvalidTemperatureRangeError as e:
-                em.error("Temperature sensor {} is returning a temperature of {}. This is outside the valid range, "
-                         "so discarding it".format(self.name, e.temperature), self.name)
-                ThermometerList.__update_temperature_data(self.name, None)
+                self.em.error("Temperature sensor {} is returning a temperature of {}. This is outside the valid "
+                              "range, so discarding it".format(name, e.temperature), name)
+                ThermometerList.__update_temperature_data(name, None)
             except (OSError, IndexError, AttributeError):
-                em.error("Error reading from temperature sensor {}. Check if it is connected.".format(self.name),
-                         self.name)
-                ThermometerList.__update_temperature_data(self.name, None)
+                self.em.error("Error reading from temperature sensor {}. Check if it is connected.".format(name),
+                              name)
+                ThermometerList.__update_temperature_data(name, None)
+
+    def run(self):
+        self.set_resolution()
+
+        while True:
+            start = time.monotonic()
+            try:
+                self.read_all()
+                self.em.resolve("Temperature conversions can be triggered again", "bulk_read", False)
+            except OSError:
+                self.em.error("Could not trigger a conversion on the temperature sensors", "bulk_read")
+
+            time.sleep(max(READ_PERIOD - (time.monotonic() - start), 0))
 
     @staticmethod
     def __update_temperature_data(name, data):
@@ -148,18 +228,17 @@ class Thermometer(SensorLogging):
     This class doesn't contain any other logic.
     """
 
-    def start_thermometer_threads(self):
+    def start_thermometer_thread(self):
         logger = logging.getLogger(__name__)
 
-        for identity, name in thermometer_names.items():
-            t = ThermometerList(identity, name, self.sensorlogger)
-            t.start()
-            logger.debug("Started {} thermometer".format(name))
+        t = ThermometerList(thermometer_names, lambda values: self.publish(self.channel, values))
+        t.start()
+        logger.debug("Started thermometer thread for {} sensors".format(len(thermometer_names)))
 
     def run(self):
-        super().setup_logging("thermometer", ["id", "value"])
+        self.channel = super().declare_channel("thermometer", ["id", "value"])
 
-        self.start_thermometer_threads()
+        self.start_thermometer_thread()
 
         # Enable pull up for second thermometer data line
         GPIO.setmode(GPIO.BCM)
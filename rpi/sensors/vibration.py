@@ -5,10 +5,13 @@ Code for interacting with the ADCMXL3021BMLZ vibration sensor
 import logging
 import time
 
-import RPi.GPIO as GPIO
-import spidev
+import numpy as np
 
+from rpi.hardware import GPIO, spidev
+from rpi.sensors.gpioedge import EdgeWaiter
 from rpi.sensors.sensorlogging import SensorLogging
+from shared.customlogging.errormanager import ErrorManager
+from shared.customlogging.spectrum import SpectrumRecord
 
 # Only bus 0 is available on RPi
 SPIBus = 0
@@ -25,6 +28,10 @@ FFTAverages = 1
 # Pin connected to the BUSY output
 BUSYPin = 5
 
+# Time in seconds BUSY can stay low before the sensor is considered stalled. Must be longer than a whole FFT
+# measurement, which takes 4096 samples per average (about 2.4 s per average at AVG_CNT_Bit = 7).
+BUSY_STALL_TIMEOUT = 10
+
 # Registers from the sensor
 PAGE_ID = 0x00
 TEMP_OUT = 0x02
@@ -83,15 +90,63 @@ FUND_FREQ = 0x7A
 FLASH_CNT_L = 0x7C
 FLASH_CNT_U = 0x7E
 
+# Number of bins in the FFT of each axis
+FFT_BINS = 2048
+
+# Every 16 bits SPI frame sent to read a FFT capture, built once. Data requested only arrives on the next frame, so each
+# frame requests the next bin and the last frame requests nothing. The chip select must go high between each frame,
+# so each one is a separate transfer.
+FFT_READ_REQUESTS = [[axis & ~(1 << 7), 0x00] for axis in (X_BUF, Y_BUF, Z_BUF) for _ in range(FFT_BINS)]
+FFT_READ_REQUESTS.append([0x00, 0x00])
+
+# Value in mg for every possible 16 bits word returned for a FFT bin, so a whole capture is decoded with one lookup
+FFT_DECODE_TABLE = (2 ** (np.arange(1 << 16) / 2048) / FFTAverages) * 0.9535
+
 
-class FFTRecord:
-    def __init__(self, lowestfrequency, binsize, x_data, y_data, z_data):
-        self.lowestfrequency = lowestfrequency
+class FFTData:
+    """
+    One FFT capture of the three axis. x_data, y_data and z_data are arrays of FFT_BINS values in mg, one per bin.
+    """
+
+    def __init__(self, binsize, x_data, y_data, z_data):
         self.binsize = binsize
         self.x_data = x_data
         self.y_data = y_data
         self.z_data = z_data
 
+    def to_record(self, timestamp):
+        """Pack the capture in a SpectrumRecord, to be logged as a single record"""
+        payload = np.concatenate((self.x_data, self.y_data, self.z_data)).astype("<f4").tobytes()
+        return SpectrumRecord(timestamp, self.binsize, len(self.x_data), payload)
+
+
+class BusyWaitStats:
+    """
+    Keeps track of the time spent waiting on the BUSY pin
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+    def add(self, duration):
+        """
+        :param duration: Duration of a wait, in seconds
+        """
+        self.count += 1
+        self.total += duration
+        self.longest = max(self.longest, duration)
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+    def __str__(self):
+        return "{} waits, {:.1f} ms in total, longest {:.1f} ms".format(self.count, self.total * 1000,
+                                                                        self.longest * 1000)
+
 
 # If using Pylint in IDE, for some reason warns about GPIO not
 # having any members. The following line tells it to ignore this.
@@ -104,6 +159,8 @@ class Vibration(SensorLogging):
     def setup(self):
         # Keep track of raised errors
         self.errors = set()
+        self.em = ErrorManager(__name__)
+        self.busy_stats = BusyWaitStats()
 
         self.spi = spidev.SpiDev()
         self.spi.open(SPIBus, SPIDevice)
@@ -118,6 +175,7 @@ class Vibration(SensorLogging):
         GPIO.setwarnings(False)
 
         GPIO.setup(BUSYPin, GPIO.IN)
+        self.busy = EdgeWaiter(BUSYPin)
 
         self.write_to_register(PAGE_ID, 0x0000)
 
@@ -135,10 +193,26 @@ class Vibration(SensorLogging):
 
     def wait_for_sensor(self):
         """
-        Blocks until sensor is ready
+        Blocks until sensor is ready. The thread sleeps until the rising edge of BUSY, instead of polling the pin.
+
+        Returns how long the wait took, in seconds. If BUSY stays low for more than BUSY_STALL_TIMEOUT, an error is
+        logged and this keeps waiting.
         """
-        while not GPIO.input(BUSYPin):
-            pass
+        start = time.perf_counter()
+        stalled = False
+        while not self.busy.wait(BUSY_STALL_TIMEOUT):
+            stalled = True
+            self.em.error("Vibration sensor stalled: BUSY has been low for {:.1f} s"
+                          .format(time.perf_counter() - start), "BUSY_STALL")
+
+        duration = time.perf_counter() - start
+        self.busy_stats.add(duration)
+
+        if stalled:
+            self.em.resolve("Vibration sensor is ready again after being busy for {:.1f} s".format(duration),
+                            "BUSY_STALL")
+
+        return duration
 
     def __check_sensor(self, check):
         if check != 0x0BCD and "PROD_ID_Error" not in self.errors:
@@ -236,57 +310,48 @@ class Vibration(SensorLogging):
         rcv = self.spi.readbytes(2)
         return (rcv[0] << 8) | rcv[1]
 
-    def read_fft_data(self):
+    def transfer_frames(self, frames):
         """
-        Reads from sensor the FFT data and return as a list of FFTRecord
+        Sends each frame in its own transfer, and returns the bytes received for all of them.
         """
-        self.wait_for_sensor()
+        xfer2 = self.spi.xfer2
+        received = bytearray()
+        for frame in frames:
+            received += bytes(xfer2(frame))
 
-        # Data returned is an array, so combine both elements to get the real number
-        combineData = lambda data: (data[0] << 8) | data[1]
+        return received
 
-        # Get the correct value from the data received. This will be in mg
-        getValue = lambda data: (2 ** ((combineData(data) / 2048)) / FFTAverages) * 0.9535
-
-        data = list()
+    def read_fft_data(self):
+        """
+        Reads from sensor the FFT data and return it as a FFTData
+        """
+        self.wait_for_sensor()
 
         samplerate = 220000 / 2 ** AVG_CNT_Bit
         binsize = samplerate / 4096
 
-        axis = [X_BUF, Y_BUF, Z_BUF]
-        axis_data = [list(), list(), list()]
-
-        self.spi.xfer2([axis[0] & ~(1 << 7), 0x00])
-        for n, a in enumerate(axis):
-            for i in range(2048):
-                if i != 2047:
-                    rcv = self.spi.xfer2([a & ~(1 << 7),
-                                          0x00])  # Remember that any data requested will only arrive at the next spi transaction
-                elif n < 2:
-                    rcv = self.spi.xfer2([axis[n + 1] & ~(1 << 7), 0x00])  # Request right away for the next axis
-                else:
-                    rcv = self.spi.xfer2([0x00, 0x00])  # If we are at the very end, don't request anything
+        received = self.transfer_frames(FFT_READ_REQUESTS)
 
-                axis_data[n].append(getValue(rcv))
+        # Each bin is a big endian 16 bits word. Skip the first frame, as its answer was requested before the read.
+        words = np.frombuffer(received, dtype=">u2")[1:]
+        x_data, y_data, z_data = FFT_DECODE_TABLE[words].reshape(3, FFT_BINS)
 
-        # Combine the data from all axis together
-        for i in range(2048):
-            data.append(FFTRecord(binsize * i, binsize, axis_data[0][i], axis_data[1][i], axis_data[2][i]))
-
-        return data
+        return FFTData(binsize, x_data, y_data, z_data)
 
     def run(self):
-        super().setup_logging("vibration",
-                              ["binsize (Hz)", "lowestfrequency (Hz)", "value x (mg)", "value y (mg)", "value z (mg)"])
+        # The timestamp column is added by declare_channel()
+        self.channel = super().declare_channel("vibration", SpectrumRecord.CSV_HEADER[1:])
         self.setup()
         while True:
             self.check_sensor_connection(True)
             self.check_for_errors()
 
             self.write_to_register(GLOB_CMD, 1 << 11)  # Start a measurement
-            self.wait_for_sensor()
+            measure_time = self.wait_for_sensor()
 
             data = self.read_fft_data()
-            now = time.time() * 1000
-            for i in data:
-                self.sensorlogger.info([now, i.binsize, i.lowestfrequency, i.x_data, i.y_data, i.z_data])
+            self.publish(self.channel, data.to_record(time.time() * 1000))
+
+            logging.getLogger(__name__).debug("Capture done. Measurement took {:.1f} ms. BUSY: {}"
+                                              .format(measure_time * 1000, self.busy_stats))
+            self.busy_stats.reset()
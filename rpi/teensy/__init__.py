@@ -4,15 +4,14 @@ avoid possible race conditions.
 """
 import logging
 
-import serial
-import glob
-
 from tenacity import retry, stop_after_attempt
 
+from rpi.hardware import glob_serial_ports, serial
+
 
 class Teensy:
     def __init__(self):
-        ports = glob.glob('/dev/ttyACM[0-9]*')
+        ports = glob_serial_ports('/dev/ttyACM[0-9]*')
         self.ser = serial.Serial(ports[0], 115200, timeout=1)
         self.current_port = ports[0]
 
@@ -20,7 +19,7 @@ class Teensy:
         """
         Workaround for unreliable USB cable sometime reconnecting, changing the serial port
         """
-        ports = glob.glob('/dev/ttyACM[0-9]*')
+        ports = glob_serial_ports('/dev/ttyACM[0-9]*')
         if ports[0] != self.current_port:
             logging.getLogger(__name__).warning("Teensy seems to have changed port. Updating accordingly...")
             self.ser = serial.Serial(ports[0], 115200, timeout=1)
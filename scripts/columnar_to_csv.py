@@ -0,0 +1,37 @@
+import argparse
+import csv
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared.customlogging.columnar import read_columnar, read_schema  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Convert the columnar sensor files of the RPi to csv files, written next '
+                                             'to them, so they can be used like the csv files of the RPi')
+parser.add_argument('path', help='columnar file, or folder containing the columnar files')
+parser.add_argument('--force', action='store_true', help='convert the files even if their csv file already exists')
+
+args = parser.parse_args()
+
+if os.path.isdir(args.path):
+    all_files = glob.glob(os.path.join(args.path, "*.col"))
+else:
+    all_files = [args.path]
+
+for f in sorted(all_files):
+    output = os.path.splitext(f)[0] + '.csv'
+    if os.path.exists(output) and not args.force:
+        print("Skipping {}, {} already exists".format(f, output))
+        continue
+
+    fields = read_schema(f)['fields']
+    columns = read_columnar(f)
+
+    with open(output, 'w', newline='') as file:
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(fields)
+        # Converted to Python numbers, so they are written exactly like the RPi writes them in its csv files
+        writer.writerows(zip(*(columns[field].tolist() for field in fields)))
+
+    print("Converted {} samples of {} to {}".format(len(columns[fields[0]]), f, output))
@@ -0,0 +1,165 @@
+"""
+Loading of the sensor data files of a folder for the scripts, with a cache.
+
+Each csv file is parsed once: the parsed data is kept in a binary file in the CACHE_FOLDER of the folder, along with the
+size and modification time of the csv file, so only the new or changed files are parsed again. When a date is given, the
+files which cannot hold data for that date are not read at all, using the manifest of the segments (see
+shared.customlogging.manifest) or the time range of the files in the cache.
+"""
+import glob
+import json
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared.customlogging.columnar import read_columnar, read_schema  # noqa: E402
+from shared.customlogging.manifest import select_segments  # noqa: E402
+
+TIMEZONE = 'America/Toronto'
+CACHE_FOLDER = '.sensorcache'
+CACHE_VERSION = 1  # Increase when the format of the cache changes, so the old caches are ignored
+
+
+class SensorCache:
+    """
+    Parsed data of the csv files of a folder. The index (index.json) tells for each csv file its size, modification
+    time and time range when it was parsed, and the pickle file holding its data.
+    """
+
+    def __init__(self, folder, timestamp_scale):
+        self.folder = os.path.join(folder, CACHE_FOLDER)
+        self.index_path = os.path.join(self.folder, 'index.json')
+        self.timestamp_scale = timestamp_scale
+        self.changed = False
+
+        try:
+            with open(self.index_path) as file:
+                self.index = json.load(file)
+            if self.index.get('version') != CACHE_VERSION:
+                raise ValueError("Old cache")
+        except (OSError, ValueError):
+            self.index = {'version': CACHE_VERSION, 'files': dict()}
+
+    def lookup(self, path, stat):
+        """Return the entry of a csv file, or None if it is not in the cache or changed since"""
+        entry = self.index['files'].get(os.path.basename(path))
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns or \
+                entry['scale'] != self.timestamp_scale:
+            return None
+        return entry
+
+    def load(self, entry):
+        return pd.read_pickle(os.path.join(self.folder, entry['cache']))
+
+    def store(self, path, stat, df):
+        """Keep the parsed data of a csv file. Nothing is kept if the folder is read-only."""
+        name = os.path.basename(path)
+        timestamps = df.index.dropna()
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'scale': self.timestamp_scale,
+                 'first': timestamps.min().value if len(timestamps) != 0 else None,
+                 'last': timestamps.max().value if len(timestamps) != 0 else None,
+                 'cache': name + '.pkl'}
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            df.to_pickle(os.path.join(self.folder, entry['cache']))
+        except OSError:
+            return
+
+        self.index['files'][name] = entry
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+
+        # Written to another file first, so an interrupted script does not leave a broken index
+        try:
+            with open(self.index_path + '.tmp', 'w') as file:
+                json.dump(self.index, file)
+            os.replace(self.index_path + '.tmp', self.index_path)
+        except OSError:
+            pass
+
+
+def data_files(folder):
+    """Return the sensor data files of a folder. A columnar file converted to csv is only read once, as columnar."""
+    columnar = glob.glob(os.path.join(folder, "*.col"))
+    converted = {os.path.splitext(f)[0] for f in columnar}
+    csv = [f for f in glob.glob(os.path.join(folder, "*.csv")) if os.path.splitext(f)[0] not in converted]
+    return sorted(csv + columnar)
+
+
+def date_range(date, timezone=TIMEZONE):
+    """Return the first and last instants (UTC Timestamps) of a date like '2021-03-05', local to timezone"""
+    period = pd.Period(date)
+    start = period.start_time.tz_localize(timezone, ambiguous=True, nonexistent='shift_backward')
+    end = period.end_time.tz_localize(timezone, ambiguous=False, nonexistent='shift_forward')
+    return start.tz_convert('UTC'), end.tz_convert('UTC')
+
+
+def parse_csv(path, timestamp_scale):
+    """Return the data of a csv file, indexed by its UTC timestamps"""
+    try:
+        df = pd.read_csv(path)
+    except pd.errors.EmptyDataError:
+        # Segment just started, its header is not written yet
+        return None
+
+    df['timestamp'] = pd.to_datetime(df['timestamp'] * timestamp_scale, unit='ms', utc=True)
+    return df.set_index('timestamp')
+
+
+def parse_columnar(path, timestamp_scale):
+    """Return the data of a columnar file, indexed by its UTC timestamps"""
+    fields = read_schema(path)['fields']
+    columns = read_columnar(path)
+    index = pd.DatetimeIndex(pd.to_datetime(columns['timestamp'] * timestamp_scale, unit='ms', utc=True),
+                             name='timestamp')
+    return pd.DataFrame({field: columns[field] for field in fields[1:]}, index=index)
+
+
+def load_sensor_data(folder, date=None, timestamp_scale=1, timezone=TIMEZONE):
+    """
+    Return the data of the sensor data files (csv or columnar) of a folder, indexed by the time in timezone.
+
+    :param folder: Folder holding the files of a sensor
+    :param date: Optional. If specified, only return the data for this date (ex: '2021-03-05', or '2021-03' for a month)
+    :param timestamp_scale: Factor applied to the timestamps of the files to have milliseconds
+    :param timezone: Time zone of the returned times and of the date
+    """
+    files = data_files(folder)
+    start = end = None
+    if date:
+        start, end = date_range(date, timezone)
+        files = select_segments(files, start.value / 1e6 / timestamp_scale, end.value / 1e6 / timestamp_scale)
+
+    cache = SensorCache(folder, timestamp_scale)
+    frames = []
+    for path in files:
+        if path.endswith('.col'):
+            df = parse_columnar(path, timestamp_scale)
+        else:
+            stat = os.stat(path)
+            entry = cache.lookup(path, stat)
+            if entry is None:
+                df = parse_csv(path, timestamp_scale)
+                if df is None:
+                    continue
+                cache.store(path, stat, df)
+            elif start is not None and (entry['first'] is None or entry['last'] < start.value or
+                                        entry['first'] > end.value):
+                continue  # Not read at all
+            else:
+                df = cache.load(entry)
+
+        if start is not None:
+            df = df[(df.index >= start) & (df.index <= end)]
+        frames.append(df)
+
+    cache.save()
+
+    if len(frames) == 0:
+        raise FileNotFoundError("No sensor data in {}{}".format(folder, " for " + date if date else ""))
+    return pd.concat(frames).tz_convert(timezone)
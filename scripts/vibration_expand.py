@@ -0,0 +1,26 @@
+import argparse
+
+import pandas as pd
+
+from sensorloader import load_sensor_data
+from shared.customlogging.spectrum import SpectrumRecord  # Found through the path set by sensorloader
+
+parser = argparse.ArgumentParser(description='Expand the vibration captures to one row per FFT bin')
+parser.add_argument('path', help='path to the folder containing the csv files')
+parser.add_argument('output', help='csv file to write the expanded rows to')
+parser.add_argument('--date', help='if specified, only expand the captures for this date')
+
+args = parser.parse_args()
+
+df = load_sensor_data(args.path, args.date)
+
+COLUMNS = ['timestamp', 'binsize (Hz)', 'lowestfrequency (Hz)', 'value x (mg)', 'value y (mg)', 'value z (mg)']
+
+frames = []
+for timestamp, capture in df.iterrows():
+    record = SpectrumRecord.from_csv_row([timestamp.value / 1e6] + capture[SpectrumRecord.CSV_HEADER[1:]].tolist())
+    expanded = pd.DataFrame(record.rows(), columns=COLUMNS)
+    expanded['timestamp'] = timestamp  # In the time zone of the data, instead of the ms of the record
+    frames.append(expanded)
+
+pd.concat(frames).to_csv(args.output, index=False)
@@ -10,14 +10,43 @@ def get_config(location):
 
 def update_config():
     default = dict()
-    default['DEFAULT'] = {'rpi_port': '65432'}
+    default['DEFAULT'] = {
+        'rpi_port': '65432',
+        'csv_flush_kb': '256',  # Sensor data is written to the csv files once this much is waiting...
+        'csv_flush_ms': '1000',  # ...or once the oldest sample waited this long
+        'csv_fsync_ms': '10000'}  # Time between two syncs of the csv files to the disk. 0 to only sync when closing.
     default['rpi'] = {
         'rpi_listening_ip': '127.0.0.1',
-        'laptop_ip': '127.0.0.1'}
+        'laptop_ip': '127.0.0.1',
+        'simulate_hardware': 'no',
+        'log_batch_size': '64',  # Maximum number of log records sent together to the logging process. 1 to disable.
+        'log_batch_ms': '20',  # Maximum time a log record can wait for the rest of its batch
+        'spool_size_mb': '256',  # Size of the file keeping the logs while the laptop cannot be reached
+        'spool_replay_kbps': '256',  # Rate at which the logs kept during an outage are sent again, in kB/s
+        'link_compression_level': '6',  # zlib level (1 to 9) of the logs sent to the laptop. 0 to disable.
+        'udp_channels': '',  # Channels sent to the laptop over UDP, separated by commas. Ex: acceleration,pressure
+        'sensor_storage': 'csv',  # csv, or columnar to write the channels with a fixed format to binary column files
+        'segment_mb': '64',  # A new file is started for the data of a sensor once the current one reaches this size...
+        'segment_s': '300'}  # ...or once it was started this long ago
 
     default['laptop'] = {
         'laptop_listening_ip': '127.0.0.1',
-        'rpi_ip': '127.0.0.1'}
+        'rpi_ip': '127.0.0.1',
+        'ping_period_ms': '100',  # Period of the pings measuring the round-trip time to the RPi
+        'link_timeout_ms': '500',  # The control link is considered down when no ping was answered for this long
+        'telemetry_gap_ms': '1500'}  # Warn if nothing was received on the logging connection for this long
+
+    # Only used when simulate_hardware is enabled
+    default['simulation'] = {
+        'i2c_clock_hz': '100000',
+        'spi_transfer_latency_us': '15',
+        'parabola_period': '120',
+        'accelerometer_noise': '0.02',
+        'pressure_lps25h': 'no',  # yes to simulate an LPS25H with a FIFO instead of the fitted sensor
+        'pressure_noise': '3',
+        'ambient_temperature': '22',
+        'teensy_line_period': '0.1',
+        'motor_run_time': '5'}
 
     modified = False
     for section, keys in default.items():  # Make sure the config has at least all the keys. If not, init to default
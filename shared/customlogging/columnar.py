@@ -0,0 +1,186 @@
+"""
+Columnar storage of the sensor data of channels with a fixed format.
+
+A file starts with a header of FILE_HEADER_SIZE bytes: the magic, then the schema of the channel as JSON. It is followed
+by chunks of the same size, each one holding up to chunk_rows samples. A chunk starts with a CHUNK_HEADER (magic, number
+of samples, first and last timestamp), followed by one array per column (timestamp first), each one being chunk_rows
+little-endian values of the type of the column. The unused end of the arrays of the last chunk is filled with zeros.
+
+The whole file can be memory-mapped with NumPy, see read_columnar().
+"""
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from shared.customlogging.csvwriter import LatencyHistogram
+from shared.customlogging.samplebatch import SampleBatch
+
+FILE_MAGIC = b'CRGXCOL1'
+FILE_HEADER_SIZE = 4096
+CHUNK_HEADER = struct.Struct("<4sIdd")  # Magic, number of samples, first timestamp, last timestamp
+CHUNK_MAGIC = b'CHNK'
+CHUNK_ROWS = 1024  # Samples per chunk. About a second of data for the fastest channels.
+
+
+def row_dtype(fields, format):
+    """Return the NumPy dtype of a sample, given the names of its values and its struct format (timestamp included)"""
+    format = format.lstrip('<')
+    if len(fields) != len(format):
+        raise ValueError("Format {} does not have a single character per field of {}".format(format, fields))
+    return np.dtype([(field, '<' + code) for field, code in zip(fields, format)])
+
+
+def chunk_dtype(row, chunk_rows):
+    """Return the NumPy dtype of a chunk, given the dtype of a sample"""
+    return np.dtype([('magic', 'S4'), ('count', '<u4'), ('first', '<f8'), ('last', '<f8')] +
+                    [(name, row.fields[name][0], (chunk_rows,)) for name in row.names])
+
+
+class ColumnarWriter:
+    """
+    Writes the samples of a channel with a fixed format to a columnar file. The samples are kept in memory until their
+    chunk is full, and the chunk is then written with a single system call. If the chunk is not full after flush_ms,
+    it is written anyway, and written again at the same place once it has more samples.
+
+    Has the same interface as BufferedCSVWriter. Not thread-safe.
+    """
+
+    def __init__(self, path, channel, flush_ms=1000, fsync_ms=10000, chunk_rows=CHUNK_ROWS):
+        """
+        :param path: Path of the file. Must not exist.
+        :param channel: Channel of the samples. Must have a format.
+        :param flush_ms: Maximum time a sample can wait in memory, in milliseconds
+        :param fsync_ms: Time between two syncs to the disk, in milliseconds. 0 to only sync when closing.
+        :param chunk_rows: Number of samples per chunk
+        """
+        self.path = path
+        self.row = row_dtype(channel.header(), channel.row_format())
+        self.chunk_rows = chunk_rows
+        self.chunk_size = chunk_dtype(self.row, chunk_rows).itemsize
+        self.flush_delay = flush_ms / 1000
+        self.fsync_delay = fsync_ms / 1000
+
+        schema = {'name': channel.name, 'fields': channel.header(), 'format': channel.row_format(),
+                  'chunk_rows': chunk_rows}
+        header = FILE_MAGIC + json.dumps(schema).encode('utf-8')
+        if len(header) > FILE_HEADER_SIZE:
+            raise ValueError("Schema of {} too big for the header of a columnar file".format(channel.name))
+
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        os.write(self.fd, header.ljust(FILE_HEADER_SIZE, b'\0'))
+
+        self.chunk = np.zeros(chunk_rows, dtype=self.row)  # Samples of the current chunk
+        self.count = 0
+        self.offset = FILE_HEADER_SIZE  # Where the current chunk is written
+        self.oldest = None  # time.monotonic() of the oldest sample not written yet
+
+        self.synced = True
+        self.last_fsync = time.monotonic()
+        self.written = 0  # Bytes written since the start
+        self.write_latency = LatencyHistogram()
+        self.fsync_latency = LatencyHistogram()
+
+    def write_message(self, msg):
+        """Add a SampleBatch or a single row"""
+        if isinstance(msg, SampleBatch):
+            rows = np.frombuffer(msg.data, dtype=self.row)
+        else:
+            rows = np.array([tuple(msg)], dtype=self.row)
+
+        while len(rows) != 0:
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+
+            count = min(len(rows), self.chunk_rows - self.count)
+            self.chunk[self.count:self.count + count] = rows[:count]
+            self.count += count
+            rows = rows[count:]
+
+            if self.count == self.chunk_rows:
+                self.flush()
+                self.chunk[:] = 0
+                self.count = 0
+                self.offset += self.chunk_size
+
+    def flush_if_due(self):
+        """Write the current chunk if its oldest sample waited flush_ms, and sync the file if it is time to"""
+        now = time.monotonic()
+        if self.oldest is not None and now - self.oldest >= self.flush_delay:
+            self.flush()
+        if not self.synced and self.fsync_delay != 0 and now - self.last_fsync >= self.fsync_delay:
+            self.sync()
+
+    def flush(self):
+        """Write the current chunk, even if it is not full"""
+        if self.oldest is None:
+            return
+        self.oldest = None
+
+        timestamps = self.chunk['timestamp']
+        data = [CHUNK_HEADER.pack(CHUNK_MAGIC, self.count, timestamps[0], timestamps[self.count - 1])]
+        data.extend(self.chunk[name].tobytes() for name in self.row.names)
+        data = memoryview(b''.join(data))
+
+        start = time.monotonic()
+        offset = self.offset
+        while len(data) != 0:
+            count = os.pwrite(self.fd, data, offset)
+            offset += count
+            self.written += count
+            data = data[count:]
+        self.write_latency.add(time.monotonic() - start)
+        self.synced = False
+
+    def sync(self):
+        """Make sure everything written is on the disk"""
+        start = time.monotonic()
+        os.fsync(self.fd)
+        self.last_fsync = time.monotonic()
+        self.fsync_latency.add(self.last_fsync - start)
+        self.synced = True
+
+    def tell(self):
+        """Return the number of bytes in the file once the current chunk is written"""
+        return self.offset + (self.chunk_size if self.count != 0 else 0)
+
+    def take_latencies(self):
+        """Return the histograms of the write and fsync times since the last call, and start new ones"""
+        latencies = self.write_latency, self.fsync_latency
+        self.write_latency, self.fsync_latency = LatencyHistogram(), LatencyHistogram()
+        return latencies
+
+    def close(self):
+        self.flush()
+        if not self.synced:
+            self.sync()
+        os.close(self.fd)
+
+
+def read_schema(path):
+    """Return the schema of a columnar file, as a dictionary"""
+    with open(path, 'rb') as file:
+        header = file.read(FILE_HEADER_SIZE)
+    if not header.startswith(FILE_MAGIC):
+        raise ValueError("{} is not a columnar file".format(path))
+    return json.loads(header[len(FILE_MAGIC):].rstrip(b'\0'))
+
+
+def read_columnar(path):
+    """
+    Memory-map a columnar file, and return its samples as a dictionary of NumPy arrays, by field name. A chunk being
+    written when the file is read may be missing.
+    """
+    schema = read_schema(path)
+    chunk = chunk_dtype(row_dtype(schema['fields'], schema['format']), schema['chunk_rows'])
+
+    chunks = (os.path.getsize(path) - FILE_HEADER_SIZE) // chunk.itemsize
+    if chunks <= 0:
+        return {field: np.zeros(0, dtype=chunk.fields[field][0].base) for field in schema['fields']}
+
+    data = np.memmap(path, dtype=chunk, mode='r', offset=FILE_HEADER_SIZE, shape=(chunks,))
+    data = data[data['magic'] == CHUNK_MAGIC]
+    used = np.arange(schema['chunk_rows']) < data['count'][:, None]
+    return {field: data[field][used] for field in schema['fields']}
@@ -0,0 +1,145 @@
+import csv
+import os
+import time
+
+from shared.customlogging.samplebatch import SampleBatch
+from shared.customlogging.spectrum import SpectrumRecord
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations, in buckets whose bounds double from 1 us to about 1 min
+    """
+
+    BUCKETS = [1e-6 * 2 ** i for i in range(27)]  # Upper bounds, in seconds
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.max = 0
+
+    def add(self, duration):
+        i = 0
+        while i < len(self.BUCKETS) and duration > self.BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.max = max(self.max, duration)
+
+    def percentile(self, p):
+        """Return the upper bound of the bucket holding the p-th percentile, or 0 if there is nothing"""
+        cumulated = 0
+        for i, count in enumerate(self.counts):
+            cumulated += count
+            if count != 0 and cumulated >= p / 100 * self.count:
+                return min(self.BUCKETS[i], self.max) if i < len(self.BUCKETS) else self.max
+        return 0
+
+    def __str__(self):
+        return "{} times, p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+            self.count, self.percentile(50) * 1000, self.percentile(99) * 1000, self.max * 1000)
+
+
+class BufferedCSVWriter:
+    """
+    Writes sensor data to a csv file through a large buffer. The rows are encoded by the csv module straight into the
+    buffer, which is written to the file with a single system call once it reaches flush_bytes, or once its oldest row
+    waited flush_ms. The file is synced to the disk (fsync) every fsync_ms, so a power loss loses at most that much
+    data, while the SD card of the RPi is not worn by a sync per row.
+
+    The time of each write and fsync is kept in histograms. Not thread-safe.
+    """
+
+    def __init__(self, path, flush_bytes=256 * 1024, flush_ms=1000, fsync_ms=10000):
+        """
+        :param path: Path of the csv file. Data is added at its end if it exists.
+        :param flush_bytes: Size of the buffer, in bytes
+        :param flush_ms: Maximum time a row can wait in the buffer, in milliseconds
+        :param fsync_ms: Time between two syncs to the disk, in milliseconds. 0 to only sync when closing.
+        """
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.flush_bytes = flush_bytes
+        self.flush_delay = flush_ms / 1000
+        self.fsync_delay = fsync_ms / 1000
+
+        self.chunks = []  # Encoded rows waiting to be written
+        self.size = 0
+        self.oldest = None  # time.monotonic() of the oldest row in the buffer
+        self.csv = csv.writer(self, lineterminator='\n')
+
+        self.synced = True
+        self.last_fsync = time.monotonic()
+        self.written = 0  # Bytes written since the start
+        self.write_latency = LatencyHistogram()
+        self.fsync_latency = LatencyHistogram()
+
+    def write(self, text):
+        """Add text to the buffer. Called by the csv module for each row."""
+        self.chunks.append(text)
+        self.size += len(text)
+
+    def write_message(self, msg):
+        """Add sensor data (a row, a SampleBatch or a SpectrumRecord) to the buffer"""
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+
+        if isinstance(msg, SpectrumRecord):
+            self.csv.writerow(msg.to_csv_row())
+        elif isinstance(msg, SampleBatch):
+            self.csv.writerows(msg.rows())
+        else:
+            self.csv.writerow(msg)
+
+        if self.size >= self.flush_bytes:
+            self.flush()
+
+    def flush_if_due(self):
+        """Write the buffer if its oldest row waited flush_ms, and sync the file if it is time to"""
+        now = time.monotonic()
+        if self.oldest is not None and now - self.oldest >= self.flush_delay:
+            self.flush()
+        if not self.synced and self.fsync_delay != 0 and now - self.last_fsync >= self.fsync_delay:
+            self.sync()
+
+    def flush(self):
+        """Write the buffer to the file"""
+        if len(self.chunks) == 0:
+            return
+
+        data = memoryview(''.join(self.chunks).encode('utf-8'))
+        self.chunks = []
+        self.size = 0
+        self.oldest = None
+
+        start = time.monotonic()
+        while len(data) != 0:
+            count = os.write(self.fd, data)
+            self.written += count
+            data = data[count:]
+        self.write_latency.add(time.monotonic() - start)
+        self.synced = False
+
+    def sync(self):
+        """Make sure everything written is on the disk"""
+        start = time.monotonic()
+        os.fsync(self.fd)
+        self.last_fsync = time.monotonic()
+        self.fsync_latency.add(self.last_fsync - start)
+        self.synced = True
+
+    def tell(self):
+        """Return the number of bytes in the file once the buffer is written, if it was empty when opened"""
+        return self.written + self.size  # The csv files are ASCII, so a character is a byte
+
+    def take_latencies(self):
+        """Return the histograms of the write and fsync times since the last call, and start new ones"""
+        latencies = self.write_latency, self.fsync_latency
+        self.write_latency, self.fsync_latency = LatencyHistogram(), LatencyHistogram()
+        return latencies
+
+    def close(self):
+        self.flush()
+        if not self.synced:
+            self.sync()
+        os.close(self.fd)
@@ -1,9 +1,35 @@
 import copy
 import logging
 import logging.handlers
+import multiprocessing.util
 import os
+import threading
+import time
 from datetime import datetime
 
+from shared.customlogging.csvwriter import BufferedCSVWriter
+
+
+def make_log_path(location, foldername, subfolder=None, filetype='log', segment=None):
+    """
+    Return the path of a new log file and create its directory if needed. The name of the file is the current date and
+    time, so a new file is created each run. See MakeFileHandler for the parameters.
+
+    segment: Optional. Number of the segment, added to the name, when the data of a run is split in several files.
+    """
+    if segment is not None:
+        filetype = f"{segment:04d}.{filetype}"
+
+    if subfolder is None:
+        fileName = datetime.now().strftime(f"{location}.{foldername}_%Y-%m-%d %H-%M-%S.{filetype}")
+        path = f'logs/{location}/{foldername}/{fileName}'
+    else:
+        fileName = datetime.now().strftime(f"{location}.{subfolder}_%Y-%m-%d %H-%M-%S.{filetype}")
+        path = f'logs/{location}/{foldername}/{subfolder}/{fileName}'
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
 
 class MakeFileHandler(logging.FileHandler):
     """
@@ -17,25 +43,94 @@ class MakeFileHandler(logging.FileHandler):
         foldername: Folder inside location.
         subfolder: Optional. If we need another folder level. Mainly used for sensor logging.
         """
-        if subfolder is None:
-            fileName = datetime.now().strftime(f"{location}.{foldername}_%Y-%m-%d %H-%M-%S.{filetype}")
-            path = f'logs/{location}/{foldername}/{fileName}'
-        else:
-            fileName = datetime.now().strftime(f"{location}.{subfolder}_%Y-%m-%d %H-%M-%S.{filetype}")
-            path = f'logs/{location}/{foldername}/{subfolder}/{fileName}'
-
-        os.makedirs(os.path.dirname(path), exist_ok=True)
+        path = make_log_path(location, foldername, subfolder, filetype)
         logging.FileHandler.__init__(self, path, mode, encoding, delay)
 
 
+class CSVLogHandler(logging.Handler):
+    """
+    Writes the sensor data of the records (rows, SampleBatches or SpectrumRecords) to a csv file, through a
+    BufferedCSVWriter. A thread applies the time policy of the writer, and everything is written when the handler is
+    flushed or closed, which logging does at exit.
+    """
+
+    def __init__(self, location, foldername, subfolder, flush_bytes, flush_ms, fsync_ms):
+        """See MakeFileHandler and BufferedCSVWriter for the parameters"""
+        super().__init__()
+        self.writer = BufferedCSVWriter(make_log_path(location, foldername, subfolder, 'csv'), flush_bytes, flush_ms,
+                                        fsync_ms)
+        self.closed = False
+
+        flusher = threading.Thread(target=self.__flush_periodically, args=(min(flush_ms, 500) / 1000,), daemon=True)
+        flusher.start()
+
+    def __flush_periodically(self, period):
+        while True:
+            time.sleep(period)
+            with self.lock:
+                if self.closed:
+                    break
+                self.writer.flush_if_due()
+
+    def emit(self, record):
+        try:
+            self.writer.write_message(record.msg)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        with self.lock:
+            if not self.closed:
+                self.writer.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.writer.close()
+                self.closed = True
+        super().close()
+
+
 class CustomQueueHandler(logging.handlers.QueueHandler):
     """
     Overrides the prepare method of QueueHandler to prevent all
     messages from being converted to strings
+
+    In batching mode (batch_size > 1), records are collected and put on the queue as a single list, once batch_size
+    records are waiting or batch_ms milliseconds passed. A record of level WARNING or higher is sent right away, along
+    with the records waiting before it, so errors are not delayed. The listener must accept lists of records.
     """
 
-    def __init__(self, queue):
+    def __init__(self, queue, batch_size=1, batch_ms=0):
         super().__init__(queue)
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        self.pid = None  # Process where the buffer was created. Only set once the buffer is ready.
+        self.start_lock = threading.Lock()  # So threads logging at the same time do not each create a buffer
+
+    def __start_batching(self):
+        """
+        Create the buffer and the thread sending it periodically. The handler is created in the main process and
+        inherited by the others, but the thread is not, so this is done again in each process using the handler.
+        """
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return  # Another thread did it first
+
+            self.buffer = []
+            self.buffer_lock = threading.Lock()
+            self.pid = os.getpid()
+
+            flusher = threading.Thread(target=self.__flush_periodically, daemon=True)
+            flusher.start()
+
+            # Send what is left in the buffer when a process started by multiprocessing exits
+            multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def __flush_periodically(self):
+        while True:
+            time.sleep(self.batch_ms / 1000)
+            self.flush()
 
     def prepare(self, record):
         """
@@ -48,3 +143,32 @@ class CustomQueueHandler(logging.handlers.QueueHandler):
         record.exc_info = None
         record.exc_text = None
         return record
+
+    def emit(self, record):
+        if self.batch_size <= 1:
+            super().emit(record)
+            return
+
+        try:
+            if self.pid != os.getpid():
+                self.__start_batching()
+
+            with self.buffer_lock:
+                self.buffer.append(self.prepare(record))
+                if len(self.buffer) >= self.batch_size or record.levelno >= logging.WARNING:
+                    self.__send_buffer()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if self.batch_size <= 1 or self.pid != os.getpid():
+            return
+
+        with self.buffer_lock:
+            self.__send_buffer()
+
+    def __send_buffer(self):
+        """Put the waiting records on the queue as a single item. Must be called with the lock held, to keep the order."""
+        if len(self.buffer) != 0:
+            self.enqueue(self.buffer)
+            self.buffer = []
@@ -0,0 +1,71 @@
+"""
+Manifest of the segments of the sensor data files of a channel.
+
+The data of a channel is written to a new file (a segment) every segment_mb or segment_s (see ChannelWriter). Once a
+segment is complete, a line describing it is added to the manifest of its folder, so readers can open only the segments
+covering the time they need. Each line is a JSON object with:
+    file: Name of the segment, in the same folder as the manifest
+    first, last: Timestamps (in ms) of the first and last sample, or None if the segment is empty
+    rows: Number of samples
+    offset: Byte offset of the first sample in the file, after its header
+    bytes: Size of the file
+
+The segment being written is not in the manifest yet, nor is the last one of a run which did not stop cleanly.
+"""
+import json
+import os
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+def add_segment(folder, file, first, last, rows, offset, size):
+    """Add a complete segment to the manifest of a folder. See the module for the parameters."""
+    entry = {'file': file, 'first': first, 'last': last, 'rows': rows, 'offset': offset, 'bytes': size}
+    with open(os.path.join(folder, MANIFEST_NAME), 'a') as manifest:
+        manifest.write(json.dumps(entry) + '\n')
+        manifest.flush()
+        os.fsync(manifest.fileno())
+
+
+def read_manifest(folder):
+    """
+    Return the segments listed in the manifest of a folder, by file name without the extension, so a segment converted
+    to another format (see scripts/columnar_to_csv.py) is found too. Empty if there is no manifest.
+    """
+    segments = dict()
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME)) as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Line cut by a power loss
+                segments[os.path.splitext(entry['file'])[0]] = entry
+    except FileNotFoundError:
+        pass
+    return segments
+
+
+def select_segments(files, start=None, end=None):
+    """
+    Return the files which may hold samples between start and end, in the same order.
+
+    :param files: Paths of the data files
+    :param start: Optional. Timestamp (in ms) of the start of the time wanted
+    :param end: Optional. Timestamp (in ms) of the end of the time wanted
+    """
+    manifests = dict()  # Segments of each folder, by file name without the extension
+    selected = []
+    for path in files:
+        folder, name = os.path.split(path)
+        if folder not in manifests:
+            manifests[folder] = read_manifest(folder)
+
+        # Files not in the manifest may hold anything, so they are always read
+        entry = manifests[folder].get(os.path.splitext(name)[0])
+        if entry is not None and (entry['rows'] == 0 or (start is not None and entry['last'] < start) or
+                                  (end is not None and entry['first'] > end)):
+            continue
+        selected.append(path)
+
+    return selected
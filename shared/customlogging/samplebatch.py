@@ -0,0 +1,37 @@
+import struct
+
+
+class SampleBatch:
+    """
+    Several rows of sensor data with the same fixed layout, sent as the message of a single log record. The rows are
+    kept packed (see the struct module) until they are formatted, so a batch costs a single allocation no matter how
+    many samples it holds.
+    """
+
+    __slots__ = ('format', 'data')
+
+    def __init__(self, format, data):
+        """
+        :param format: struct format of a single row, the first field being the timestamp
+        :param data: bytes of the packed rows, from the oldest to the newest
+        """
+        if len(data) % struct.calcsize(format) != 0:
+            raise ValueError("Data of {} bytes does not hold complete rows of format {}".format(len(data), format))
+
+        self.format = format
+        self.data = data
+
+    def __reduce__(self):
+        # Needed so the batch can be pickled with the old protocols, as it has no __dict__
+        return SampleBatch, (self.format, self.data)
+
+    def __len__(self):
+        return len(self.data) // struct.calcsize(self.format)
+
+    def rows(self):
+        """Return an iterator over the rows, each one being a tuple"""
+        return struct.iter_unpack(self.format, self.data)
+
+    def last(self):
+        """Return the newest row, as a tuple"""
+        return struct.unpack_from(self.format, self.data, len(self.data) - struct.calcsize(self.format))
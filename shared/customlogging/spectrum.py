@@ -0,0 +1,56 @@
+import base64
+import struct
+
+
+class SpectrumRecord:
+    """
+    A complete FFT capture of the three axis, sent as the message of a single log record. The values are packed as
+    little-endian 32 bits floats (all the x values, then y, then z), so the whole capture is a single compact payload
+    through the logging queue, the network and the storage. It is only expanded to one row per bin at analysis time.
+    """
+
+    __slots__ = ('timestamp', 'binsize', 'bins', 'payload')
+
+    # Header of the csv file where the records are stored with to_csv_row()
+    CSV_HEADER = ["timestamp", "binsize (Hz)", "bins", "values x,y,z (mg, base64 float32)"]
+
+    def __init__(self, timestamp, binsize, bins, payload):
+        """
+        :param timestamp: Time of the capture, in ms
+        :param binsize: Size of each bin, in Hz
+        :param bins: Number of bins per axis
+        :param payload: bytes of the 3 * bins values, packed as little-endian 32 bits floats
+        """
+        if len(payload) != 3 * bins * 4:
+            raise ValueError("Payload of {} bytes does not hold {} bins for 3 axis".format(len(payload), bins))
+
+        self.timestamp = timestamp
+        self.binsize = binsize
+        self.bins = bins
+        self.payload = payload
+
+    def __reduce__(self):
+        # Needed so the record can be pickled with the old protocols, as it has no __dict__
+        return SpectrumRecord, (self.timestamp, self.binsize, self.bins, self.payload)
+
+    def axes(self):
+        """Return a tuple of 3 tuples, with the values (in mg) of the x, y and z axis"""
+        values = struct.unpack("<{}f".format(3 * self.bins), self.payload)
+        return values[:self.bins], values[self.bins:2 * self.bins], values[2 * self.bins:]
+
+    def rows(self):
+        """
+        Yields one list per bin, in the format [timestamp, binsize, lowestfrequency, value x, value y, value z]
+        """
+        x_data, y_data, z_data = self.axes()
+        for i in range(self.bins):
+            yield [self.timestamp, self.binsize, self.binsize * i, x_data[i], y_data[i], z_data[i]]
+
+    def to_csv_row(self):
+        """Return the record as a single csv row, matching CSV_HEADER"""
+        return [self.timestamp, self.binsize, self.bins, base64.b64encode(self.payload).decode('ascii')]
+
+    @staticmethod
+    def from_csv_row(row):
+        """Rebuild a record from a row written with to_csv_row()"""
+        return SpectrumRecord(float(row[0]), float(row[1]), int(row[2]), base64.b64decode(row[3]))
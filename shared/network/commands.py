@@ -0,0 +1,50 @@
+"""
+Messages of the command connection, from the laptop to the RPi.
+
+Each message is a JSON object with utf-8 encoding, after its length as an unsigned 32 bits integer. The connection is
+kept open, and requests can be sent without waiting for the responses of the previous ones. Each request has an id,
+which is given back in its response, along with a status and either the result of the command or the error.
+
+A request without id is a legacy one-shot request: the RPi answers "OK" once the message is parsed, and closes the
+connection.
+"""
+import json
+import struct
+
+HEADER = struct.Struct("!L")  # Length of the JSON body
+
+# Statuses of the responses
+OK = 'ok'
+ERROR = 'error'
+
+
+class CommandError(Exception):
+    """The RPi could not execute a command"""
+    pass
+
+
+def encode(message):
+    """Return the bytes of a message (a dictionary)"""
+    body = json.dumps(message).encode('utf-8')
+    return HEADER.pack(len(body)) + body
+
+
+def read(file):
+    """Read a message from a binary file (see socket.makefile). Returns None if the connection was closed."""
+    header = file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+
+    (size,) = HEADER.unpack(header)
+    body = file.read(size)
+    if len(body) < size:
+        return None
+    return json.loads(body)
+
+
+def response(id, result):
+    return {'id': id, 'status': OK, 'result': result}
+
+
+def error_response(id, error):
+    return {'id': id, 'status': ERROR, 'error': str(error)}
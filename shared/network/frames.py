@@ -0,0 +1,253 @@
+"""
+Binary frames sent from the RPi to the laptop on the logging connection.
+
+Each frame starts with a header: the version of the format, the type of the frame and the length of the payload. The
+sensor data is sent as struct-packed values, identified by the id of its channel. The schema of every channel is sent
+in a SCHEMA frame at the start of each connection, and before the first samples of a new channel. Text logs are sent
+as JSON. No pickle is involved, so the laptop never unpickles data coming from the network.
+
+The RPi starts each connection with a HELLO frame proposing a compression. If the laptop accepts it in an ACK frame,
+the following frames are sent in batches inside COMPRESSED frames, compressed with a single zlib stream per connection.
+When there is nothing to send, the RPi sends HEARTBEAT frames, so the laptop can tell an idle link from a dead one.
+
+The data of loss-tolerant channels can also be sent in UDP datagrams. Each datagram has a DATAGRAM_HEADER followed by
+complete frames (SCHEMA, SAMPLES, ROW or SPECTRUM), uncompressed.
+"""
+import json
+import logging
+import struct
+import zlib
+
+from shared.customlogging.samplebatch import SampleBatch
+from shared.customlogging.spectrum import SpectrumRecord
+from shared.telemetry import Channel
+
+VERSION = 1
+
+HEADER = struct.Struct(">BBL")  # Version, type, length of the payload
+CHANNEL_ID = struct.Struct(">L")
+SPECTRUM_HEADER = struct.Struct(">dfL")  # Timestamp, binsize, bins. Followed by the payload of the SpectrumRecord.
+
+DATAGRAM_HEADER = struct.Struct(">BLL")  # Version, session (random for each start of the sender), sequence number
+MAX_DATAGRAM_SIZE = 1400  # Frames are grouped in datagrams of at most this size, so they are not fragmented
+
+READ_BUFFER_SIZE = 256 * 1024  # Initial size of the buffer of a FrameReader. Grows if a frame does not fit in it.
+
+# Types of frames
+SCHEMA = 1  # Channel id, then the channel as JSON
+SAMPLES = 2  # Channel id, then rows packed with the format of the channel
+ROW = 3  # Channel id, then a single row as JSON, for channels without a format
+SPECTRUM = 4  # Channel id, then a SpectrumRecord
+LOG = 5  # Text log record, as JSON
+HELLO = 6  # Sent by the RPi when connecting, as JSON. Lists the compressions it can use.
+ACK = 7  # Answer of the laptop to HELLO, as JSON. Gives the compression to use, or null.
+COMPRESSED = 8  # Part of the zlib stream of the connection. Decompresses to complete frames.
+HEARTBEAT = 9  # Empty. Sent by the RPi when it has nothing else to send, so the laptop knows the connection is alive.
+
+# Dictionary for the zlib stream, with the strings found in most frames. Helps the compression of the first frames.
+ZDICT = (b'{"name": "thermometer", "fields": ["id", "value"], "format": null}'
+         b'{"name": "pressure", "fields": ["value"], "format": "d"}'
+         b'{"name": "acceleration", "fields": ["x", "y", "z"], "format": "ddd"}'
+         b'{"name": "vibration", "fields": ["binsize (Hz)", "bins", "values x,y,z (mg, base64 float32)"], '
+         b'"Motors", "Fan Intake", "Opposite to Heater", "Electronics", "Foam"'
+         b'{"name": "rpi.sensors.", "rpi.network.", "rpi.logging.listener", "__main__", '
+         b'"levelno": 30, "levelname": "WARNING", "levelno": 40, "levelname": "ERROR", '
+         b'"levelno": 20, "levelname": "INFO", "created": 1, "msecs": 0, "relativeCreated": 0, "thread": 1, '
+         b'"threadName": "MainThread", "processName": "MainProcess", "process": 1, "filename": ".py", "module": "", '
+         b'"exc_text": null, "funcName": "run", "lineno": 1, "errorID": "", "msg": "')
+
+# Attributes of the LogRecords that are not sent. All the others are, including the ones added with `extra`.
+SKIPPED_ATTRIBUTES = {'msg', 'args', 'exc_info', 'stack_info', 'pathname', 'message', 'asctime', 'taskName'}
+
+
+class FrameError(Exception):
+    pass
+
+
+def channel_id(channel):
+    """
+    Return the id of a channel. It is derived from its schema, so it stays the same across connections and restarts,
+    and samples kept while the laptop was not connected can still be decoded.
+    """
+    return zlib.crc32(json.dumps([channel.name, channel.fields, channel.format]).encode('utf-8'))
+
+
+def make_frame(frame_type, payload):
+    return HEADER.pack(VERSION, frame_type, len(payload)) + payload
+
+
+def schema_frame(channel):
+    schema = {'name': channel.name, 'fields': channel.fields, 'format': channel.format}
+    return make_frame(SCHEMA, CHANNEL_ID.pack(channel_id(channel)) + json.dumps(schema).encode('utf-8'))
+
+
+def telemetry_frame(id, msg):
+    """Return the frame of sensor data (a SampleBatch, a SpectrumRecord or a row) of the channel with that id"""
+    header = CHANNEL_ID.pack(id)
+    if isinstance(msg, SampleBatch):
+        return make_frame(SAMPLES, header + msg.data)
+    elif isinstance(msg, SpectrumRecord):
+        return make_frame(SPECTRUM, header + SPECTRUM_HEADER.pack(msg.timestamp, msg.binsize, msg.bins) + msg.payload)
+    else:
+        return make_frame(ROW, header + json.dumps(list(msg)).encode('utf-8'))
+
+
+def hello_frame(compressions):
+    """Return the HELLO frame proposing a list of compressions, by order of preference"""
+    return make_frame(HELLO, json.dumps({'compression': compressions}).encode('utf-8'))
+
+
+def ack_frame(compression):
+    """Return the ACK frame accepting a compression (None for no compression)"""
+    return make_frame(ACK, json.dumps({'compression': compression}).encode('utf-8'))
+
+
+def make_compressor(level):
+    """Return the compressor of the zlib stream of a connection"""
+    return zlib.compressobj(level, zdict=ZDICT)
+
+
+def make_decompressor():
+    """Return the decompressor of the zlib stream of a connection"""
+    return zlib.decompressobj(zdict=ZDICT)
+
+
+def split_frames(data):
+    """
+    Yield the (version, type, payload) of each frame in data, which must only hold complete frames. The payloads are
+    memoryviews of data.
+    """
+    data = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        version, frame_type, length = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        if offset + length > len(data):
+            raise FrameError("Incomplete frame of {} bytes in a compressed frame".format(length))
+
+        yield version, frame_type, data[offset:offset + length]
+        offset += length
+
+
+class FrameReader:
+    """
+    Cuts a stream of bytes into frames. The bytes are received directly in a single reusable buffer (see free() and
+    filled()), and the frames are returned as memoryviews of that buffer, so nothing is copied until the frames are
+    decoded.
+    """
+
+    def __init__(self, size=READ_BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Start of the first frame not returned yet
+        self.end = 0  # End of the bytes received
+
+    def free(self):
+        """
+        Return the free part of the buffer, where the next bytes must be received (with socket.recv_into for
+        example). The payloads returned by frames() are only valid until this is called.
+        """
+        pending = self.end - self.start
+        needed = HEADER.size
+        if pending >= HEADER.size:
+            needed += HEADER.unpack_from(self.view, self.start)[2]
+
+        if needed > len(self.buffer):
+            # A new buffer is made instead of resizing the current one, as payloads may still be referenced
+            buffer = bytearray(max(needed, 2 * len(self.buffer)))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+        elif len(self.buffer) - self.start < needed or self.end == len(self.buffer):
+            # Move the incomplete frame at the start of the buffer, to make room for the rest of it
+            self.buffer[:pending] = self.view[self.start:self.end]
+        else:
+            return self.view[self.end:]
+
+        self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def filled(self, count):
+        """Tell that count bytes were received in the buffer returned by free()"""
+        self.end += count
+
+    def frames(self):
+        """Return the complete frames received, as a list of tuples (version, type, payload)"""
+        frames = []
+        while self.end - self.start >= HEADER.size:
+            version, frame_type, length = HEADER.unpack_from(self.view, self.start)
+            if self.end - self.start < HEADER.size + length:
+                break
+
+            payload_start = self.start + HEADER.size
+            frames.append((version, frame_type, self.view[payload_start:payload_start + length]))
+            self.start = payload_start + length
+
+        if self.start == self.end:
+            self.start = self.end = 0
+        return frames
+
+
+def log_frame(record):
+    """Return the frame of a text log record"""
+    d = {key: value for key, value in record.__dict__.items() if key not in SKIPPED_ATTRIBUTES}
+    d['msg'] = record.getMessage()
+    return make_frame(LOG, json.dumps(d, default=str).encode('utf-8'))
+
+
+class FrameDecoder:
+    """
+    Decodes the frames of a connection into log records, like the ones logged on the RPi. Sensor data is logged with
+    the logger sensorlog.<channel>, its message being a SampleBatch, a SpectrumRecord or a row.
+    """
+
+    def __init__(self):
+        self.channels = dict()  # Channels of the connection, by id
+
+    def decode(self, version, frame_type, payload):
+        """
+        Return the record of a frame, given its header and payload (bytes or a memoryview, which is not kept). For a
+        SCHEMA frame, the message of the record is the header of the csv file of the channel.
+
+        Raises a FrameError if the frame is invalid. The decoder can still be used for the next frames.
+        """
+        if version != VERSION:
+            raise FrameError("Unsupported frame version {}, expected {}".format(version, VERSION))
+
+        try:
+            return self.__decode(frame_type, payload)
+        except (struct.error, ValueError, KeyError, TypeError) as e:
+            # Truncated payload, invalid JSON or UTF-8, missing field, rows not matching the format...
+            raise FrameError("Malformed frame of type {}: {!r}".format(frame_type, e)) from e
+
+    def __decode(self, frame_type, payload):
+        if frame_type == LOG:
+            return logging.makeLogRecord(json.loads(bytes(payload)))
+
+        (id,) = CHANNEL_ID.unpack_from(payload)
+        payload = payload[CHANNEL_ID.size:]
+
+        if frame_type == SCHEMA:
+            schema = json.loads(bytes(payload))
+            channel = Channel(schema['name'], schema['fields'], schema['format'])
+            self.channels[id] = channel
+            return self.__record(channel, channel.header())
+
+        channel = self.channels.get(id)
+        if channel is None:
+            raise FrameError("Data received for the unknown channel {}".format(id))
+
+        if frame_type == SAMPLES:
+            return self.__record(channel, SampleBatch(channel.row_format(), bytes(payload)))
+        elif frame_type == SPECTRUM:
+            timestamp, binsize, bins = SPECTRUM_HEADER.unpack_from(payload)
+            return self.__record(channel, SpectrumRecord(timestamp, binsize, bins,
+                                                         bytes(payload[SPECTRUM_HEADER.size:])))
+        elif frame_type == ROW:
+            return self.__record(channel, json.loads(bytes(payload)))
+
+        raise FrameError("Unknown frame type {}".format(frame_type))
+
+    @staticmethod
+    def __record(channel, msg):
+        return logging.makeLogRecord({'name': 'sensorlog.' + channel.name, 'msg': msg, 'levelno': logging.INFO,
+                                      'levelname': 'INFO'})
@@ -0,0 +1,50 @@
+class Channel:
+    """
+    Schema of the data published by a sensor. A channel is declared once, before any of its samples is published.
+    """
+
+    __slots__ = ('name', 'fields', 'format', 'ring')
+
+    def __init__(self, name, fields, format=None, ring=None):
+        """
+        :param name: Name of the channel. Also used as the name of the folder where the csv files are written.
+        :param fields: Names of the values of each sample, without the timestamp
+        :param format: Optional. struct format of the values (ex: "ddd" for 3 floats), without the timestamp. Only
+        possible if all the values are numbers. The samples are then packed in shared memory instead of being pickled.
+        :param ring: Name of the shared memory ring carrying the samples. Set by the publisher.
+        """
+        self.name = name
+        self.fields = list(fields)
+        self.format = format
+        self.ring = ring
+
+    def __reduce__(self):
+        return Channel, (self.name, self.fields, self.format, self.ring)
+
+    def header(self):
+        """Return the header of the csv file of this channel"""
+        return ["timestamp", *self.fields]
+
+    def row_format(self):
+        """Return the struct format of a complete sample, timestamp included, or None if the channel has no format"""
+        return None if self.format is None else "<d" + self.format
+
+
+class Sample:
+    """
+    A sample of a channel without a fixed format. The values start with the timestamp (in ms), like a csv row. They can
+    also be a single object formatting itself, like a SpectrumRecord.
+    """
+
+    __slots__ = ('channel', 'values')
+
+    def __init__(self, channel, values):
+        """
+        :param channel: Name of the channel
+        :param values: The values of the sample
+        """
+        self.channel = channel
+        self.values = values
+
+    def __reduce__(self):
+        return Sample, (self.channel, self.values)